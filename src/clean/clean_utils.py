@@ -12,7 +12,6 @@ from math import isclose
 from pathlib import Path
 from shutil import rmtree
 
-import librosa
 import numpy as np
 import requests
 import yt_dlp
@@ -187,30 +186,25 @@ class ItemMaker:
         # We want to do this regardless of if the file is stored locally
         self._split_left_right_audio_channels()
 
-    def _split_left_right_audio_channels(self, timeout: int = 10) -> None:
-        """Splits audio into left and right channels for independent processing"""
+    def _split_left_right_audio_channels(self) -> None:
+        """Splits audio into left and right channels for independent processing by the source separation models.
 
-        mappings: dict = {'l': '0.0.0', 'r': '0.0.1'}
+        The channels are written in-process, block-by-block, rather than by piping the file through ffmpeg. Loaders
+        that only need a single channel of the audio should read it directly using `utils.load_audio_channel`: these
+        files only exist so they can be passed to the command-line separation models, and are removed again in
+        `finalize_output`.
+
+        """
+        # We only need these files if we're going to pass them into the separation models
+        if not self.get_lr_audio:
+            return
         # If we haven't specified channel overrides, the dictionary will be empty, so this loop won't do anything
-        for name in self.item['channel_overrides'].values():
-            cmd = [
-                # Initialise ffmpeg and force overwriting if file is already present
-                'ffmpeg', '-y',
-                # Specify input file location
-                '-i', self.in_file,
-                # Specify required channel mapping
-                '-map_channel', mappings[name],
-                # Specify output location
-                rf'{self.raw_audio_loc}/{self.fname}-{name}chan.{self.fmt}'
-            ]
-            # Open the subprocess and kill if it hasn't completed after a given time
-            p = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True,)
-            try:
-                # This will block execution until the above process has completed
-                _, __ = p.communicate(timeout=timeout)
-            except subprocess.TimeoutExpired:
-                p.kill()
-                raise TimeoutError(f"... error when splitting track channels: timed out after {timeout} seconds")
+        for name in set(self.item['channel_overrides'].values()):
+            utils.write_audio_channel(self.in_file, self._get_channel_fpath(name), name)
+
+    def _get_channel_fpath(self, channel: str) -> str:
+        """Returns the filepath for a single channel of the raw audio, used as an input to the separation models"""
+        return rf'{self.raw_audio_loc}/{self.fname}-{channel}chan.{self.fmt}'
 
     def _download_audio_excerpt_from_youtube(self) -> None:
         """Downloads an item in the corpus from a YouTube link"""
@@ -273,8 +267,7 @@ class ItemMaker:
             # These commands call for separation on the individual right and left channels, as desired
             if self.get_lr_audio and 'channel_overrides' in self.item.keys():
                 for ch in set(self.item['channel_overrides'].values()):
-                    fname = rf'{self.raw_audio_loc}/{self.fname}-{ch}chan.{self.fmt}'
-                    cmds.append(cls.get_cmd(fname))
+                    cmds.append(cls.get_cmd(self._get_channel_fpath(ch)))
             # Run each of our separation commands in parallel, using joblib (set n_jobs to number of commands)
             self._logger_wrapper(f"... separating {len(cmds)} tracks with {separator_name}")
             # with HidePrints() as _:
@@ -317,6 +310,12 @@ class ItemMaker:
             rmtree(os.path.abspath(rf"{self.demucs_audio_loc}/{self.demucs_model}"))
         except FileNotFoundError:
             pass
+        # Remove the split channels of the raw audio: loaders read these directly from the stereo file instead
+        for ch in set(self.item['channel_overrides'].values()):
+            try:
+                os.remove(self._get_channel_fpath(ch))
+            except FileNotFoundError:
+                pass
         # Set a few additional variables within the corpus item
         self.item['fname'] = self.fname
         if include_log:
@@ -475,10 +474,10 @@ class _MVSEPMaker(ItemMaker):
         'use_kim_model_1': False,
         'only_vocals': False
     }
-    # Passed in to librosa.load
+    # Passed in to utils.load_audio
     LOAD_KWS = dict(
         sr=utils.SAMPLE_RATE,
-        dtype=np.float64,
+        dtype=utils.AUDIO_DTYPE,
         offset=0,
         res_type='soxr_vhq'
     )
@@ -574,7 +573,7 @@ class _MVSEPMaker(ItemMaker):
         shifted = shift(audio, (0, -n_samples), cval=0)
         # Add some padding to the end of the signal if it's shorter than the desired size
         if shifted.shape[1] < shape_to_match:
-            padding = np.zeros((2, shape_to_match - shifted.shape[1]))
+            padding = np.zeros((2, shape_to_match - shifted.shape[1]), dtype=shifted.dtype)
             shifted = np.hstack((shifted, padding))
         # Truncate the end of the signal if it's longer than the desired size
         elif shifted.shape[1] > shape_to_match:
@@ -584,9 +583,9 @@ class _MVSEPMaker(ItemMaker):
     def align_audio_signals(self, files_to_pad: list[str]):
         """For a list of demixes stems `files_to_pad`, align these with their raw audio file"""
         # Load in the raw audio, in mono
-        raw, _ = librosa.load(self.in_file, mono=True, **self.LOAD_KWS)
-        # Load in the source separated files, in stereo
-        audio_to_pad = [librosa.load(f, mono=False, **self.LOAD_KWS)[0] for f in files_to_pad]
+        raw, _ = utils.load_audio(self.in_file, mono=True, **self.LOAD_KWS)
+        # Load in the source separated files, in stereo. We don't cache these, as they're overwritten once aligned
+        audio_to_pad = [utils.load_audio(f, mono=False, use_cache=False, **self.LOAD_KWS)[0] for f in files_to_pad]
         # Sum all the source separated files and convert to mono
         proc = sum(audio_to_pad).mean(axis=0)
         # Compute the audio envelopes for the raw audio and the summed demixed audio
@@ -4,7 +4,6 @@
 """Utility classes, functions, and variables when working with MIDI files."""
 
 import os
-from itertools import groupby
 from typing import Generator
 from math import isclose
 from os import makedirs
@@ -12,7 +11,7 @@ from os import makedirs
 import numpy as np
 import pretty_midi
 import librosa
-from piano_transcription_inference import PianoTranscription, load_audio, sample_rate
+from piano_transcription_inference import PianoTranscription, sample_rate
 from piano_transcription_inference.utilities import write_events_to_midi
 from torch import device
 from torch.cuda import is_available
@@ -22,18 +21,73 @@ from src.detect.onset_utils import FREQUENCY_BANDS, OnsetMaker, bandpass_filter
 from src.clean.clean_utils import HidePrints
 
 
-__all__ = ['Note', 'Interval', 'MelodyMaker', 'MIDIMaker', 'group_onsets']
+__all__ = [
+    'Note', 'Interval', 'MelodyMaker', 'MIDIMaker', 'group_onsets', 'NOTE_DTYPE', 'NOTE_NAMES', 'make_note_table',
+    'note_table_from_arrays'
+]
+
+# Lookup tables for the name of every pitch class, and the pitch class and octave of every MIDI note number
+NOTE_NAMES = np.array(utils.ALL_PITCHES)
+PITCH_CLASSES = np.arange(128) % 12
+OCTAVES = np.arange(128) // 12 - 1
+# Structured array type used to store notes: `note_index` is the index of the note name in `NOTE_NAMES`
+NOTE_DTYPE = np.dtype([
+    ('start', np.float64),
+    ('end', np.float64),
+    ('pitch', np.int16),
+    ('velocity', np.int16),
+    ('pitch_class', np.int8),
+    ('octave', np.int8),
+    ('note_index', np.int8),
+])
+
+
+def note_table_from_arrays(start: np.array, end: np.array, pitch: np.array, velocity: np.array) -> np.recarray:
+    """Creates a table of notes with `NOTE_DTYPE` from arrays of start and end times, pitches, and velocities.
+
+    Pitch classes, octaves and note names are derived from the pitches with lookup tables. The notes are not sorted.
+
+    Arguments:
+        start (np.array): start time of every note, in seconds
+        end (np.array): end time of every note, in seconds
+        pitch (np.array): MIDI note number of every note
+        velocity (np.array): MIDI velocity of every note
+
+    Returns:
+        np.recarray: the note table, with one row per note
+
+    """
+    pitch = np.asarray(pitch, dtype=int)
+    table = np.empty(len(pitch), dtype=NOTE_DTYPE).view(np.recarray)
+    table.start, table.end, table.pitch, table.velocity = start, end, pitch, velocity
+    table.pitch_class = PITCH_CLASSES[pitch]
+    table.octave = OCTAVES[pitch]
+    # Our note names use sharps, such that the index of the name is the same as the pitch class
+    table.note_index = table.pitch_class
+    return table
+
+
+def make_note_table(notes: list[pretty_midi.Note]) -> np.recarray:
+    """Creates a table of notes with `NOTE_DTYPE` from `pretty_midi.Note` objects, sorted by start time"""
+    arr = np.array([(n.start, n.end, n.pitch, n.velocity) for n in notes], dtype=float).reshape(-1, 4)
+    # We use a stable sort, so notes with the same start time keep their original order
+    arr = arr[np.argsort(arr[:, 0], kind='stable')]
+    return note_table_from_arrays(arr[:, 0], arr[:, 1], arr[:, 2], arr[:, 3])
 
 
 class Note(pretty_midi.Note):
-    """Overrides `pretty_midi.Note` with a few additional properties"""
+    """Overrides `pretty_midi.Note` with a few additional properties
+
+    Can be created from a `pretty_midi.Note` object or from a single row of a note table with `NOTE_DTYPE`
+    """
 
     def __init__(self, note):
-        super().__init__(**note.__dict__)
+        super().__init__(velocity=int(note.velocity), pitch=int(note.pitch), start=note.start, end=note.end)
         self.ioi = super().duration
-        self.note = ''.join(i for i in pretty_midi.note_number_to_name(self.pitch) if not i.isdigit())
-        self.octave = int(''.join(i for i in pretty_midi.note_number_to_name(self.pitch) if i.isdigit()))
-        self.pitch_class = pretty_midi.note_name_to_number(f'{self.note}0') - 12
+        # Get the name, octave, and pitch class of our note from the lookup tables
+        self.pitch_class = int(PITCH_CLASSES[self.pitch])
+        self.note = str(NOTE_NAMES[self.pitch_class])
+        self.octave = int(OCTAVES[self.pitch])
 
     def __repr__(self):
         return 'Note(start={:f}, end={:f}, ioi={:f}, pitch={}, velocity={}, note={}, octave={}, pitch_class={})'.format(
@@ -81,61 +135,76 @@ class MelodyMaker:
         self.time_signature = time_signature
         self.tempo_thresh = (self.quarter_note * self.time_signature) / 1 / 64  # len(one bar) / (musical value)
         self.midi = self.load_midi(midi_fpath)
+        # All of our notes are stored internally as a table with `NOTE_DTYPE`, sorted by start time
+        self.notes = make_note_table(self.midi.notes)
+        # The extracted melody, both as a table and as `Note` objects: these are created when first required
+        self._melody_table = None
+        self._melody = None
 
     def load_midi(self, midi_fpath) -> pretty_midi.Instrument:
         # TODO: check we don't have more than one instrument here
         return pretty_midi.PrettyMIDI(midi_fpath, initial_tempo=self.tempo).instruments[0]
 
-    def _remove_iois_below_threshold(self, notes: list[pretty_midi.Note]) -> list[pretty_midi.Note]:
-        ioi = lambda n: n.end - n.start
-        return sorted(
-            [n for n in notes if not any([
-                ioi(n) < self.tempo_thresh,
-                ioi(n) < self.TIME_THRESH
-            ])],
-            key=lambda n: n.start
-        )
-
-    def _remove_pitches_below_threshold(self, notes: list[pretty_midi.Note]) -> list[pretty_midi.Note]:
-        return sorted(
-            [n for n in notes if not any([
-                # n.pitch <= self.NOTE_LB,
-                # n.pitch >= self.NOTE_UB,
-                n.pitch <= self.MIDDLE_C
-            ])],
-            key=lambda n: n.start
-        )
-
-    @staticmethod
-    def _quantize_notes_in_beat(
-            beat1: float,
-            beat2: float,
-            notes: list[pretty_midi.Note],
-            num_ticks: int = 8
-    ) -> Generator[pretty_midi.Note, None, None]:
-        """Quantize notes within a beat to the nearest 64th note (default)"""
-        ticks = np.linspace(beat1, beat2, num_ticks)
-        closest = lambda n: ticks[np.argmin(np.abs(n.start - ticks))]
-        yield from (pretty_midi.Note(start=closest(n), end=n.end, pitch=n.pitch, velocity=n.velocity) for n in notes)
+    def _remove_iois_below_threshold(self, notes: np.recarray) -> np.recarray:
+        ioi = notes.end - notes.start
+        return notes[(ioi >= self.tempo_thresh) & (ioi >= self.TIME_THRESH)]
+
+    def _remove_pitches_below_threshold(self, notes: np.recarray) -> np.recarray:
+        # return notes[(notes.pitch > self.NOTE_LB) & (notes.pitch < self.NOTE_UB) & (notes.pitch > self.MIDDLE_C)]
+        return notes[notes.pitch > self.MIDDLE_C]
+
+    def _assign_notes_to_beats(self, notes: np.recarray) -> tuple[np.recarray, np.array]:
+        """Gets the index of the beat containing every note (beat1 <= note < beat2), dropping notes outside all beats"""
+        beats = np.asarray(self.beats, dtype=float)
+        beat_idx = np.searchsorted(beats, notes.start, side='right') - 1
+        in_beats = (beat_idx >= 0) & (beat_idx < len(beats) - 1)
+        return notes[in_beats], beat_idx[in_beats]
+
+    def _quantize_notes(self, notes: np.recarray, beat_idx: np.array, num_ticks: int = 8) -> np.recarray:
+        """Quantize notes within every beat to the nearest 64th note (default)"""
+        beats = np.asarray(self.beats, dtype=float)
+        beat1, beat2 = beats[beat_idx], beats[beat_idx + 1]
+        # This gives the same ticks as calling `np.linspace(beat1, beat2, num_ticks)` for every note
+        ticks = np.arange(num_ticks)[None, :] * ((beat2 - beat1) / (num_ticks - 1))[:, None] + beat1[:, None]
+        ticks[:, -1] = beat2
+        quantized = notes.copy()
+        quantized.start = ticks[np.arange(len(notes)), np.argmin(np.abs(notes.start[:, None] - ticks), axis=1)]
+        return quantized
 
     @staticmethod
-    def _extract_highest_note(
-            notes: list[pretty_midi.Note]
-    ) -> Generator[Note, None, None]:
-        for _, vals in groupby(sorted(notes, key=lambda x: x.start), lambda x: x.start):
-            yield Note(max(vals, key=lambda n: n.pitch))
-
-    def extract_melody(self):
-        """Applies skyline algorithm to extract melody from MIDI"""
+    def _extract_highest_note(notes: np.recarray, beat_idx: np.array) -> np.recarray:
+        """For every quantized start time within every beat, gets the (first) note with the highest pitch"""
+        # Sort by beat, then start time, then descending pitch, then original order, such that ties keep the first note
+        order = np.lexsort((np.arange(len(notes)), -notes.pitch.astype(int), notes.start, beat_idx))
+        notes, beat_idx = notes[order], beat_idx[order]
+        # The first note of every group of notes in the same beat with the same start time is the highest
+        first = np.ones(len(notes), dtype=bool)
+        first[1:] = (np.diff(beat_idx) != 0) | (np.diff(notes.start) != 0)
+        return notes[first]
+
+    def extract_melody_table(self) -> np.recarray:
+        """Applies skyline algorithm to extract melody from MIDI, returning a note table with `NOTE_DTYPE`
+
+        The melody is only extracted once, with subsequent calls returning the same table.
+        """
+        if self._melody_table is not None:
+            return self._melody_table
         # Remove any notes with rhythms or pitches below our thresholds
-        notes = self._remove_pitches_below_threshold(self._remove_iois_below_threshold(self.midi.notes))
-        # Iterate over the MIDI contained within each beat
+        notes = self._remove_pitches_below_threshold(self._remove_iois_below_threshold(self.notes))
+        # Get the beat containing each note, then quantize the notes within each beat to the nearest 64th note
         # TODO: do we want to add a window around here? I.e. a 32nd note before each beat?
-        for beat1, beat2 in zip(self.beats, self.beats[1:]):
-            # Quantize the notes within this beat to the nearest 64th note
-            quantized_notes = self._quantize_notes_in_beat(beat1, beat2, [n for n in notes if beat1 <= n.start < beat2])
-            # Yield the highest note from the quantized MIDI
-            yield from self._extract_highest_note(quantized_notes)
+        notes, beat_idx = self._assign_notes_to_beats(notes)
+        quantized_notes = self._quantize_notes(notes, beat_idx)
+        # Get the highest note at every quantized position
+        self._melody_table = self._extract_highest_note(quantized_notes, beat_idx)
+        return self._melody_table
+
+    def extract_melody(self) -> Generator[Note, None, None]:
+        """Applies skyline algorithm to extract melody from MIDI"""
+        # We only need to create our `Note` objects once
+        if self._melody is None:
+            self._melody = [Note(n) for n in self.extract_melody_table()]
+        yield from self._melody
 
     def extract_intervals(
             self,
@@ -148,21 +217,54 @@ class MelodyMaker:
         # Yield an interval object from consecutive notes in the extracted melody
         yield from (Interval(fn, sn) for fn, sn in zip(melody_notes, melody_notes[1:]))
 
+    def get_chunk_bounds(
+            self,
+            starts: np.array = None,
+            chunk_measures: int = 4,
+            overlapping_chunks: bool = True,
+    ) -> np.ndarray:
+        """Gets the indexes of the first and last (exclusive) note in every chunk of a number of measures
+
+        Arguments:
+            starts (np.array, optional): sorted start times of every note, defaults to those of the extracted melody
+            chunk_measures (int, optional): the number of measures in each chunk, defaults to 4
+            overlapping_chunks (bool, optional): whether consecutive chunks can overlap, defaults to True
+
+        Returns:
+            np.ndarray: array with shape (n_chunks, 2), such that `notes[lo:hi]` gives the notes in every chunk
+
+        """
+        if starts is None:
+            starts = self.extract_melody_table().start
+        downbeats = np.asarray(self.downbeats, dtype=float)
+        if overlapping_chunks:
+            db1, db2 = downbeats[:max(len(downbeats) - chunk_measures, 0)], downbeats[chunk_measures:]
+        else:
+            db2 = downbeats[chunk_measures::chunk_measures]
+            db1 = downbeats[::chunk_measures][:len(db2)]
+        # Notes in each chunk are those where db1 <= note < db2
+        return np.column_stack([np.searchsorted(starts, db1), np.searchsorted(starts, db2)]).reshape(-1, 2)
+
     def chunk_melody(
             self,
             notes: list[Note | Interval] = None,
             chunk_measures: int = 4,
             overlapping_chunks: bool = True,
     ) -> list[tuple[Note]]:
-        """Chunks a melody into slices, corresponding to a number of measures (consecutive chunks can be overlapping)"""
+        """Chunks a melody into slices, corresponding to a number of measures (consecutive chunks can be overlapping)
+
+        Any `notes` passed in should be sorted by start time, as with the extracted melody.
+        """
         if notes is None:
-            notes = self.extract_melody()
-        if overlapping_chunks:
-            z = zip(self.downbeats, self.downbeats[chunk_measures:])
-        else:
-            z = zip(self.downbeats[::chunk_measures], self.downbeats[chunk_measures::chunk_measures])
+            notes = list(self.extract_melody())
+        notes = list(notes)
+        bounds = self.get_chunk_bounds(
+            np.array([m.start for m in notes], dtype=float),
+            chunk_measures=chunk_measures,
+            overlapping_chunks=overlapping_chunks
+        )
         # TODO: check if this can return Interval objects as well as Note
-        return [tuple(m for m in notes if db1 <= m.start < db2) for db1, db2 in z]
+        return [tuple(notes[lo:hi]) for lo, hi in bounds]
 
 
 class MIDIMaker:
@@ -183,16 +285,23 @@ class MIDIMaker:
                 self.item['fname'], instr=self.INSTR, channel=desired_channel
             )
         )
-        # Load in the source separated audio
-        self.proc_audio, _ = load_audio(
-            proc_fpath,
-            sr=sample_rate,
-            mono=True,
-            res_type='soxr_vhq',
-            dtype=np.float64,
-            offset=0,
+        load_kws = dict(
+            sr=sample_rate, mono=True, res_type='soxr_vhq', dtype=kwargs.get('dtype', utils.AUDIO_DTYPE), offset=0,
             duration=None
         )
+        # If we don't have a separate file for our channel, read it directly from the stereo audio
+        if desired_channel is not None and not utils.check_item_present_locally(proc_fpath):
+            proc_fpath = os.path.join(
+                utils.get_project_root(),
+                f'{self.data_dir}/processed/mvsep_audio',
+                utils.construct_audio_fpath_with_channel_overrides(self.item['fname'], instr=self.INSTR)
+            )
+        else:
+            desired_channel = None
+        # Load in the source separated audio, using the cached decoded version if we have it
+        self.proc_audio, _ = utils.load_audio(
+            proc_fpath, channel=desired_channel, use_cache=kwargs.get('use_cache', True), **load_kws
+        )
         self.midi = None
 
     @staticmethod
@@ -123,11 +123,11 @@ class OnsetMaker:
     ) -> dict:
         """Loads audio as a time-series array for all instruments + the raw mix.
 
-        Wrapper around `librosa.load_audio`, called when class instance is constructed in order to generate audio for
-        all instruments in required format. Keyword arguments are passed on to .load_audio
+        Wrapper around `utils.load_audio`, called when class instance is constructed in order to generate audio for
+        all instruments in required format. Decoded audio is cached on disc, so subsequent calls skip resampling.
 
         Arguments:
-            **kwargs: passed to `librosa.load_audio`
+            **kwargs: passed to `utils.load_audio`
 
         Return:
             dict: each key-value pair corresponds to the loaded audio for one instrument, as an array
@@ -141,7 +141,8 @@ class OnsetMaker:
         offset = kwargs.get('offset', 0)
         res_type = kwargs.get('res_type', 'soxr_vhq')
         mono = kwargs.get('mono', True)
-        dtype = kwargs.get('dtype', np.float64)
+        dtype = kwargs.get('dtype', utils.AUDIO_DTYPE)
+        use_cache = kwargs.get('use_cache', True)
         # Empty dictionary to hold audio
         audio = {}
         # Iterate through all the source separated tracks
@@ -149,14 +150,18 @@ class OnsetMaker:
             # Catch any UserWarnings that might be raised, usually to do with different algorithms being used to load
             with warnings.catch_warnings():
                 warnings.simplefilter('ignore', UserWarning)
-                y, _ = librosa.load(
-                    path=self._get_channel_override_fpath(name, fpath),
+                fp, channel = self._get_channel_override_fpath(name, fpath)
+                # If we have a channel override but no separate file for it, the channel is read from the stereo audio
+                y, _ = utils.load_audio(
+                    fp,
                     sr=utils.SAMPLE_RATE,
                     mono=mono,
                     offset=offset,
                     duration=duration,
                     dtype=dtype,
                     res_type=res_type,
+                    channel=channel,
+                    use_cache=use_cache
                 )
             # We apply the bandpass filter to the required audio here
             if name in FREQUENCY_BANDS.keys():
@@ -185,27 +190,31 @@ class OnsetMaker:
             self,
             name: str,
             fpath: str
-    ) -> str:
+    ) -> tuple[str, str | None]:
         """Gets the filepath for an item, with any channel overrides specified.
 
         For instance, if we wish to use only the left channel for the double bass (and have specified "bass": "l" in the
         "channel_overrides" dictionary for this item in the corpus), this function will return the correct filepath
-        pointing to the source-separated left channel file.
+        pointing to the source-separated left channel file. If this file is not present locally, the default (stereo)
+        filepath is returned alongside the channel, which should then be read directly from the stereo audio.
 
         Arguments:
             name (str): the name of the instrument
             fpath (str): the default filepath for the item (i.e. stereo audio)
 
         Returns:
-            str: the overriden filepath if this is required and present locally, or the default (stereo) filepath if not
+            tuple[str, str | None]: the filepath to load, and the channel (`"l"` or `"r"`) to read from it, or None if
+                the entire file should be loaded
 
         """
         if 'channel_overrides' in self.item.keys():
             if name in self.item['channel_overrides'].keys():
-                fp = fpath.replace(f'_{name}', f'-{self.item["channel_overrides"][name]}chan_{name}')
+                channel = self.item["channel_overrides"][name]
+                fp = fpath.replace(f'_{name}', f'-{channel}chan_{name}')
                 if utils.check_item_present_locally(fp):
-                    return fp
-        return fpath
+                    return fp, None
+                return fpath, channel
+        return fpath, None
 
     def beat_track_rnn(
             self,
@@ -860,9 +869,16 @@ class OnsetMaker:
         utils.save_json(self.item, dirpath, "metadata")
 
     def finalize_output(
-            self
+            self,
+            save: bool = True
     ) -> None:
-        """Finalizes the output by cleaning up leftover files and setting any final attributes"""
+        """Finalizes the output by cleaning up leftover files and setting any final attributes
+
+        Arguments:
+            save (bool): whether to save the annotations, defaults to True. When False, `save_annotations` should be
+                called separately once any later processing of this track has succeeded.
+
+        """
         # Match the detected onsets together with the detected beats to generate our summary dictionary
         self.summary_dict = self.generate_matched_onsets_dictionary(
             beats=self.ons['mix'],
@@ -878,7 +894,8 @@ class OnsetMaker:
         # Delete the raw audio as it will take up a lot of space when serialised
         del self.audio
         # Save the annotations
-        self.save_annotations()
+        if save:
+            self.save_annotations()
 
     @staticmethod
     def extract_downbeats(
@@ -901,7 +918,9 @@ class ClickTrackMaker:
         # Convert the input audio to mono, if we haven't done this already
         if len(audio.shape) == 2:
             audio = audio.mean(axis=1)
-        self.audio = audio
+        # Render the click track in the same precision as the input audio, unless told otherwise
+        self.dtype = kwargs.get('dtype', audio.dtype if np.issubdtype(audio.dtype, np.floating) else utils.AUDIO_DTYPE)
+        self.audio = audio.astype(self.dtype, copy=False)
         self.width = kwargs.get('width', 200)
         self.start_freq = kwargs.get('start_freq', 750)
         self.volume_threshold = kwargs.get('volume_threshold', 1 / 3)
@@ -929,7 +948,7 @@ class ClickTrackMaker:
         # Sum the click signals together and lower the volume by the given threshold
         clicks = sum(clicks) * self.volume_threshold
         # Sum the combined click signal with the audio and return
-        return self.audio + clicks
+        return (self.audio + clicks).astype(self.dtype, copy=False)
 
     def clicks_from_onsets(self, freq, onsets, **kwargs) -> np.array:
         """Renders detected onsets to a click sound with a given frequency"""
@@ -949,7 +968,7 @@ class ClickTrackMaker:
             order=self.order,
             # We don't need to apply any fading to our click track, it'll just take extra time
             fade_dur=0
-        )
+        ).astype(self.dtype, copy=False)
 
 
 def bandpass_filter(
@@ -973,9 +992,11 @@ def bandpass_filter(
         sample_rate (float): sample rate to use for processing audio, defaults to project default (44100)
 
     Returns:
-        np.array: the filtered audio array
+        np.array: the filtered audio array, with the same precision as the input (or `utils.AUDIO_DTYPE` if not float)
 
     """
+    # The filter is designed and applied in float64 for stability, but we return in the precision of the input
+    dtype = audio.dtype if np.issubdtype(audio.dtype, np.floating) else utils.AUDIO_DTYPE
     # Create the filter: we use a second-order butterworth filter here
     filt = signal.butter(
         N=order,
@@ -991,13 +1012,13 @@ def bandpass_filter(
         audio,
         padtype='constant',
         padlen=int(sample_rate * pad_len)
-    )
+    ).astype(dtype, copy=False)
     # If we don't want to apply any fading to the audio, return it straight away
     if fade_dur == 0:
         return filtered
     # Else, create the fade curve: we use a log curve so that the earliest events fade quickest
     dur = int(fade_dur * sample_rate)
-    fade_curve = 1.0 - np.logspace(0, -2, num=dur)
+    fade_curve = (1.0 - np.logspace(0, -2, num=dur)).astype(dtype)
     # Apply the fade to the start and end of the audio using the fade curve (fliped for a fade out)
     filtered[:dur] *= fade_curve
     filtered[-dur:] *= np.flip(fade_curve)
@@ -1026,7 +1047,7 @@ def create_silent_clicktrack(
     downbeats = beats[beats['metre_manual'] == 1]['beats'].to_numpy()
     others = beats[beats['metre_manual'] != 1]['beats'].to_numpy()
     # Create silent audio of equivalent length to the beats track
-    blank = np.zeros(int(beats.max().max() * utils.SAMPLE_RATE))
+    blank = np.zeros(int(beats.max().max() * utils.SAMPLE_RATE), dtype=utils.AUDIO_DTYPE)
     # Create the new `ClickTrackMaker` and generate source suadio
     ct = ClickTrackMaker(audio=blank)
     click_track_audio = ct.generate_audio([others, downbeats])
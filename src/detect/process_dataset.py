@@ -4,59 +4,201 @@
 """Process note onsets and piano MIDI for every track in the corpus"""
 
 import logging
+import os
+from concurrent.futures import FIRST_COMPLETED, wait
 from pathlib import Path
 from time import time
 
 import click
+import numpy as np
 from dotenv import find_dotenv, load_dotenv
-from joblib import Parallel, delayed
+from joblib.externals.loky import get_reusable_executor
 
 from src import utils
 from src.detect.onset_utils import OnsetMaker
 from src.detect.midi_utils import MIDIMaker
+from src.clean.clean_utils import return_timestamp
+
+# Fixed memory overhead of each processing stage (in bytes), i.e. the loaded models and libraries
+STAGE_OVERHEAD = {
+    'onsets': 1.0 * 1024 ** 3,    # madmom RNN/CNN processors and audio libraries
+    'midi': 2.0 * 1024 ** 3,    # piano transcription checkpoint (in torch)
+}
+# Number of samples held in memory per second of audio for each processing stage, multiplied by the item size
+STAGE_SAMPLES_PER_SEC = {
+    # Four 44.1 kHz streams (mix + three stems), plus two temporary float64 copies used when filtering
+    'onsets': 4 * utils.SAMPLE_RATE,
+    # 16 kHz piano audio, a full-length pitch-shifted copy, and its resampled intermediate
+    'midi': 3 * 16000,
+}
+# Bytes per second of audio used by intermediate float64 arrays that don't depend on the precision setting
+STAGE_FIXED_BYTES_PER_SEC = {
+    'onsets': 2 * utils.SAMPLE_RATE * 8,    # sosfiltfilt always runs in float64
+    'midi': 100 * 88 * 8 * 4,    # frame-wise (100 fps) piano rolls for onsets, offsets, frames, and velocities
+}
+# By default, we only allow ourselves to use this fraction of the total system memory
+MEMORY_BUDGET_FRACTION = 0.8
+# Total system memory (in bytes) to assume when it can't be determined, e.g. on Windows without psutil installed
+FALLBACK_TOTAL_MEMORY = 8 * 1024 ** 3
+
+
+def get_track_duration(corpus_item: dict) -> float:
+    """Returns the duration of a track (in seconds), from the local audio if present or from its timestamps if not"""
+    fpath = rf'{utils.get_project_root()}/data/raw/audio/{corpus_item["fname"]}.{utils.AUDIO_FILE_FMT}'
+    duration = utils.get_audio_duration(fpath)
+    if duration == 0.0:
+        start = return_timestamp(corpus_item['timestamps']['start'])
+        end = return_timestamp(corpus_item['timestamps']['end'])
+        if start is not None and end is not None:
+            duration = float(end - start)
+    return duration
+
+
+def estimate_peak_memory(duration: float, dtype: type = utils.AUDIO_DTYPE) -> float:
+    """Estimates the peak memory (in bytes) required to process a track of `duration` seconds.
+
+    Each stage of `process_item` is modelled as a fixed overhead plus a cost that scales linearly with the duration of
+    the audio. Stages run one after the other and release their audio when finished, so the peak is the largest stage.
+
+    """
+    itemsize = np.dtype(dtype).itemsize
+    return max(
+        STAGE_OVERHEAD[stage]
+        + duration * (STAGE_SAMPLES_PER_SEC[stage] * itemsize + STAGE_FIXED_BYTES_PER_SEC[stage])
+        for stage in STAGE_OVERHEAD.keys()
+    )
+
+
+def get_total_memory() -> float:
+    """Returns the total physical memory of this system in bytes, or `FALLBACK_TOTAL_MEMORY` if it can't be found"""
+    # psutil isn't a hard requirement, but it's the only reliable option across platforms
+    try:
+        import psutil
+    except ImportError:
+        pass
+    else:
+        return float(psutil.virtual_memory().total)
+    # Otherwise, use POSIX system configuration values, which aren't available on Windows
+    try:
+        return float(os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES'))
+    except (AttributeError, ValueError, OSError):
+        return float(FALLBACK_TOTAL_MEMORY)
+
+
+def get_memory_budget(fraction: float = MEMORY_BUDGET_FRACTION) -> float:
+    """Returns the given fraction of the total physical memory of this system, in bytes"""
+    return fraction * get_total_memory()
 
 
 def process_item(
         corpus_item: dict,
         generate_click: bool,
+        dtype: type = utils.AUDIO_DTYPE
 ) -> OnsetMaker:
-    """Process one item from the corpus, used in parallel contexts (i.e. called with joblib.Parallel)"""
+    """Process one item from the corpus, used in parallel contexts (i.e. called by `process_items_under_budget`)"""
     # We need to initialise the logger here again, otherwise it won't work with joblib
     fmt = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
     logger = logging.getLogger(__name__)
     logging.basicConfig(level=logging.INFO, format=fmt)
     # Create the OnsetMaker class instance for this item in the corpus
-    made = OnsetMaker(item=corpus_item)
+    made = OnsetMaker(item=corpus_item, dtype=dtype)
     # Run our processing on the mixed audio
     logger.info(f'processing audio mix for item {corpus_item["mbz_id"]}, track name {corpus_item["track_name"]} ...')
     made.process_mixed_audio(generate_click)
     # Run our processing on the separated audio
     logger.info(f'processing audio stems for item {corpus_item["mbz_id"]}, track name {corpus_item["track_name"]} ...')
     made.process_separated_audio(generate_click, remove_silence=False)
+    # Clean up the results for the OnsetMaker: this deletes the audio, so it isn't held during the MIDI stage. We don't
+    # save the annotations yet, as saved tracks are treated as done and would be skipped if the MIDI stage failed
+    made.finalize_output(save=False)
     # Create the MIDIMaker class instance for this item in the corpus
     logger.info(f'processing midi for item {corpus_item["mbz_id"]}, track name {corpus_item["track_name"]} ...')
-    mm = MIDIMaker(corpus_item)
+    mm = MIDIMaker(corpus_item, dtype=dtype)
     # Preprocess the audio by pitch correcting, but not filtering
     mm.preprocess_audio(filter_audio=False, pitch_correction=True)
     # Convert to MIDI
     mm.convert_to_midi()
-    # Clean up the results for both the MIDIMaker and OnsetMaker
-    made.finalize_output()
+    # Now that every stage has succeeded, save the annotations and clean up the results for the MIDIMaker
+    made.save_annotations()
     mm.finalize_output()
     logger.info(f'... item {corpus_item["mbz_id"]} done !')
     return made
 
 
+def process_items_under_budget(
+        tracks: list[dict],
+        generate_click: bool,
+        dtype: type = utils.AUDIO_DTYPE,
+        n_jobs: int = -1,
+        memory_budget: float = None,
+) -> list[OnsetMaker]:
+    """Processes tracks in parallel, only starting a new track when its estimated peak memory fits under the budget.
+
+    Tracks are submitted longest-first, to minimise the total time taken. Whenever a worker becomes free, the longest
+    remaining track that fits within the remaining budget is started. A track that would exceed the budget by itself is
+    only ever processed when nothing else is running.
+
+    Arguments:
+        tracks (list[dict]): the corpus items to process
+        generate_click (bool): whether to generate click tracks, passed to `process_item`
+        dtype (type): the precision to process audio in, passed to `process_item`
+        n_jobs (int): the maximum number of tracks to process at once, defaults to -1 (all CPU cores)
+        memory_budget (float): the memory (in bytes) available for processing, defaults to 80% of system memory
+
+    Returns:
+        list[OnsetMaker]: the processed tracks, in the same order as `tracks`
+
+    """
+    logger = logging.getLogger(__name__)
+    if n_jobs < 1:
+        n_jobs = max(os.cpu_count() + 1 + n_jobs, 1)
+    if memory_budget is None:
+        memory_budget = get_memory_budget()
+    # Estimate the peak memory of every track, then sort so that the longest tracks are processed first
+    estimates = [estimate_peak_memory(get_track_duration(track), dtype) for track in tracks]
+    pending = sorted(range(len(tracks)), key=lambda i: estimates[i], reverse=True)
+    running, res = {}, [None] * len(tracks)
+    executor = get_reusable_executor(max_workers=n_jobs)
+    while pending or running:
+        # Admit as many tracks as we can fit within our budget and number of workers
+        in_use = sum(estimates[i] for i in running.values())
+        for idx in list(pending):
+            if len(running) >= n_jobs:
+                break
+            if in_use + estimates[idx] <= memory_budget or not running:
+                pending.remove(idx)
+                in_use += estimates[idx]
+                running[executor.submit(process_item, tracks[idx], generate_click, dtype)] = idx
+        # Wait for at least one track to finish before trying to admit any more
+        done, _ = wait(running.keys(), return_when=FIRST_COMPLETED)
+        for fut in done:
+            res[running.pop(fut)] = fut.result()
+        in_use = sum(estimates[i] for i in running.values())
+        logger.info(f'... {len(tracks) - len(pending) - len(running)}/{len(tracks)} tracks done, '
+                    f'{len(running)} running ({round(in_use / 1024 ** 3, 1)} GB estimated)')
+    return res
+
+
 @click.command()
 @click.option("-corpus", "corpus_filename", type=str, default="corpus_updated", help='Name of the corpus to use')
 @click.option("-n_jobs", "n_jobs", type=click.IntRange(-1, clamp=True), default=-1, help='Number of CPU cores to use')
 @click.option("-no_click", "generate_click", is_flag=True, default=False, help='Suppress click track generation')
 @click.option("-ignore-cache", "ignore_cache", is_flag=True, default=False, help='Ignore any cached items')
+@click.option(
+    "-precision", "precision", type=click.Choice(['float32', 'float64']), default=np.dtype(utils.AUDIO_DTYPE).name,
+    help='Floating point precision to load and process audio with'
+)
+@click.option(
+    "-memory_budget", "memory_budget", type=float, default=None,
+    help='Memory (in GB) available for processing tracks, defaults to 80% of system memory'
+)
 def main(
         corpus_filename: str,
         n_jobs: int,
         generate_click: bool,
-        ignore_cache: bool
+        ignore_cache: bool,
+        precision: str,
+        memory_budget: float
 ) -> list[OnsetMaker]:
     """Runs scripts to detect onsets in audio from (../raw and ../processed) and generate data for modelling"""
     # Start the counter
@@ -73,7 +215,13 @@ def main(
         corpus.tracks = [track for track in corpus.tracks if track['mbz_id'] not in cached_ids]
     # Process each item in the corpus, using multiprocessing in job-lib
     logger.info(f"detecting onsets in {len(corpus.tracks)} tracks ({from_cache} from disc) using {n_jobs} CPUs ...")
-    res = Parallel(n_jobs=n_jobs)(delayed(process_item)(item, not generate_click) for item in corpus.tracks)
+    res = process_items_under_budget(
+        corpus.tracks,
+        not generate_click,
+        dtype=np.dtype(precision).type,
+        n_jobs=n_jobs,
+        memory_budget=memory_budget * 1024 ** 3 if memory_budget is not None else None
+    )
     # Log the completion time
     logger.info(f'onsets detected for all tracks in {corpus_filename} in {round(time() - start)} secs !')
     # Return the class instances
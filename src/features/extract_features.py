@@ -0,0 +1,298 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Extract features from the annotations for every track in the corpus, caching the results for each track"""
+
+import hashlib
+import json
+import logging
+import os
+from pathlib import Path
+from time import time
+from typing import Callable
+
+import click
+import numpy as np
+import pandas as pd
+from dotenv import find_dotenv, load_dotenv
+from joblib import Parallel, delayed
+
+from src import utils
+from src.features.features_utils import FeatureContext
+from src.features.rhythm_features import *
+
+__all__ = [
+    "FEATURES", "get_annotation_hash", "get_feature_key", "extract_features_from_context", "process_track",
+    "extract_corpus_features"
+]
+
+# The name of the directory (next to the corpus) where the features extracted for every track are cached
+FEATURE_CACHE_DIR = '.feature_cache'
+# The annotation files saved for every track by `OnsetMaker`: a track's cache is invalidated when any of them change
+ANNOTATION_FILES = ['metadata.json', 'beats.csv', *[f'{i}_onsets.csv' for i in utils.INSTRUMENTS_TO_PERFORMER_ROLES]]
+# Fields from the metadata of every track to include in the feature table
+METADATA_FIELDS = ['mbz_id', 'track_name']
+
+
+def extract_bur(context: FeatureContext, exog_ins: str, **kwargs) -> dict:
+    """Beat-upbeat ratio features for `exog_ins`"""
+    bur = BeatUpbeatRatio.from_grid(context, exog_ins, **kwargs)
+    return {k: v for k, v in bur.summary_dict.items() if k in ['bur_log_mean', 'bur_log_std', 'bur_log_count_nonzero']}
+
+
+def extract_phase_correction(context: FeatureContext, exog_ins: str, **kwargs) -> dict:
+    """Phase correction features for `exog_ins`, and for the coupling of each partner instrument to `exog_ins`"""
+    summary_df = context.summary_df
+    instrs = list(utils.INSTRUMENTS_TO_PERFORMER_ROLES.keys())
+    # The models for every instrument are all fitted together in one call, sharing asynchronies between models
+    pcs = PhaseCorrection.fit_batch(
+        [(summary_df[instr], summary_df[[i for i in instrs if i != instr]]) for instr in instrs],
+        context=context, **kwargs
+    )
+    res = {}
+    for instr, pc in zip(instrs, pcs):
+        # For the partner models, we only need to get a few columns
+        if instr == exog_ins:
+            cols, extra_str = ['self_coupling', *[f'coupling_{i}' for i in instrs if i != exog_ins], 'nobs'], ''
+        else:
+            cols, extra_str = [f'coupling_{exog_ins}', 'nobs'], f'_{instr}'
+        res.update({k + extra_str: v for k, v in pc.summary_dict.items() if k in cols})
+    return res
+
+
+def extract_proportional_asynchrony(context: FeatureContext, exog_ins: str, **kwargs) -> dict:
+    """Proportional asynchrony features between `exog_ins` and each partner instrument"""
+    pa = ProportionalAsynchrony.from_grid(context, exog_ins, **kwargs)
+    cols = ['prop_async_count_nonzero']
+    for instr in utils.INSTRUMENTS_TO_PERFORMER_ROLES.keys():
+        if instr != exog_ins:
+            cols.extend([f'{instr}_prop_async_nanmean', f'{instr}_prop_async_nanstd'])
+    return {k: v for k, v in pa.summary_dict.items() if k in cols}
+
+
+def extract_ioi_complexity(context: FeatureContext, exog_ins: str, **kwargs) -> dict:
+    """Complexity and density of the inter-onset intervals played by `exog_ins`"""
+    ioi = IOIComplexity.from_grid(context, exog_ins, **kwargs)
+    cols = ['lz77_mean', 'lz77_std', 'n_onsets_mean', 'n_onsets_std', 'window_count', 'ioi_count']
+    return {k: v for k, v in ioi.summary_dict.items() if k in cols}
+
+
+def extract_tempo_slope(context: FeatureContext, exog_ins: str, **kwargs) -> dict:
+    """Tempo slope and drift, from the mean position of every beat across all instruments"""
+    instrs = [exog_ins, *[i for i in utils.INSTRUMENTS_TO_PERFORMER_ROLES.keys() if i != exog_ins]]
+    ts = TempoSlope.from_context(context, instrs, **kwargs)
+    return {k: v for k, v in ts.summary_dict.items() if k in ['tempo_slope', 'tempo_drift']}
+
+
+def extract_tempo_stability(context: FeatureContext, exog_ins: str, **kwargs) -> dict:
+    """Tempo stability, from the rolling standard deviation of the onsets played by `exog_ins` matched to the beats"""
+    tstab = RollingIOISummaryStats.from_grid(context, exog_ins, **kwargs)
+    return {k: v for k, v in tstab.summary_dict.items() if k in ['rolling_std_count_nonzero', 'rolling_std_median']}
+
+
+def extract_tempo(context: FeatureContext, exog_ins: str, **kwargs) -> dict:
+    """The tempo of the track, in beats-per-minute"""
+    return dict(tempo=context.tempo)
+
+
+# Every feature we can extract, with the function used to extract it from a `FeatureContext` and its parameters
+FEATURES: dict[str, tuple[Callable, dict]] = {
+    'bur': (extract_bur, dict(clean_outliers=True)),
+    'phase_correction': (extract_phase_correction, dict(order=1)),
+    'proportional_asynchrony': (extract_proportional_asynchrony, dict()),
+    'ioi_complexity': (extract_ioi_complexity, dict(bar_period=4)),
+    'tempo_slope': (extract_tempo_slope, dict()),
+    'tempo_stability': (extract_tempo_stability, dict(order=4, matched=True)),
+    'tempo': (extract_tempo, dict()),
+}
+
+
+def get_feature_key(name: str, exog_ins: str, params: dict) -> str:
+    """Returns the key for a feature in the cache, which changes whenever the parameters used to extract it change"""
+    return f'{name}.{utils.hash_params(exog_ins=exog_ins, **params)}'
+
+
+def get_annotation_hash(dirpath: str) -> str:
+    """Returns a hash of the contents of every annotation file for the track in `dirpath`"""
+    h = hashlib.blake2b(digest_size=16)
+    for fname in ANNOTATION_FILES:
+        fpath = os.path.join(dirpath, fname)
+        if os.path.isfile(fpath):
+            h.update(f'{fname}:{utils.hash_file(fpath)}'.encode())
+    return h.hexdigest()
+
+
+def extract_features_from_context(context: FeatureContext, exog_ins: str, features: list[str] = None) -> dict:
+    """Extracts the given `features` (defaults to all in `FEATURES`) for `exog_ins`, sharing `context` between them"""
+    res = {}
+    for name in features if features is not None else FEATURES.keys():
+        func, params = FEATURES[name]
+        with context.track(name):
+            res.update(func(context, exog_ins, **params))
+    return res
+
+
+def _to_python(value):
+    """Converts numpy scalars to the equivalent Python types, so that they can be saved as JSON"""
+    return value.item() if isinstance(value, np.generic) else value
+
+
+def _load_cache(cache_dir: str, fname: str) -> dict | None:
+    """Loads the features cached for a track by `process_track`, or returns None if there is no valid cache.
+
+    A cache that can't be decoded or doesn't have the expected structure (e.g. one left by a process that was killed
+    while writing it) is treated the same as a missing one. As caches are always replaced atomically by
+    `utils.save_json`, we don't retry decoding them like `utils.load_json` does.
+
+    """
+    try:
+        with open(os.path.join(cache_dir, f'{fname}.json'), 'r') as in_file:
+            cache = json.load(in_file)
+    except (FileNotFoundError, json.JSONDecodeError, UnicodeDecodeError):
+        return None
+    valid = (
+        isinstance(cache, dict)
+        and 'annotation_hash' in cache
+        and isinstance(cache.get('features'), dict)
+        and isinstance(cache.get('metadata'), (dict, type(None)))
+    )
+    return cache if valid else None
+
+
+def process_track(
+        dirpath: str,
+        cache_dir: str,
+        exog_ins: str = 'piano',
+        features: list[str] = None,
+        ignore_cache: bool = False
+) -> dict:
+    """Extracts features for one track in `dirpath`, used in parallel contexts (i.e. by `extract_corpus_features`)
+
+    The features for each track are cached in a single JSON file inside `cache_dir`, along with a hash of the track's
+    annotations. Each feature is stored under a key made from its name and the parameters used to extract it, so only
+    features that have been added (or whose parameters have changed) since the cache was created need to be extracted.
+    The cache for a track is discarded entirely whenever its annotations change.
+
+    Arguments:
+        dirpath (str): the folder containing the annotations for a track, as created by `OnsetMaker`
+        cache_dir (str): the folder containing the cached features for every track
+        exog_ins (str, optional): the instrument to extract features for, defaults to "piano"
+        features (list[str], optional): the names of the features to extract, defaults to all features in `FEATURES`
+        ignore_cache (bool, optional): extract every feature again, even if it has been cached, defaults to False
+
+    Returns:
+        dict: metadata for the track, followed by every feature
+
+    """
+    # We need to initialise the logger here again, otherwise it won't work with joblib
+    logger = logging.getLogger(__name__)
+    fname = os.path.basename(os.path.normpath(dirpath))
+    features = list(features if features is not None else FEATURES.keys())
+    keys = {name: get_feature_key(name, exog_ins, FEATURES[name][1]) for name in features}
+    annotation_hash = get_annotation_hash(dirpath)
+    # Load the cache for this track, unless we're ignoring it or the annotations have changed since it was created
+    cache = _load_cache(cache_dir, fname)
+    if ignore_cache or cache is None or cache['annotation_hash'] != annotation_hash:
+        cache = dict(annotation_hash=annotation_hash, metadata=None, features={})
+    # Only load the annotations if there are features (or metadata) that we haven't cached yet
+    missing = [name for name in features if not isinstance(cache['features'].get(keys[name]), dict)]
+    if len(missing) > 0 or cache['metadata'] is None:
+        logger.info(f'extracting {len(missing)}/{len(features)} features for track {fname} ...')
+        track = utils.load_annotations_from_files(dirpath)
+        context = FeatureContext.from_onsetmaker(track, metre_col='metre_auto', downbeats_col='downbeats_auto')
+        for name in missing:
+            values = extract_features_from_context(context, exog_ins, [name])
+            cache['features'][keys[name]] = {k: _to_python(v) for k, v in values.items()}
+        cache['metadata'] = {k: track.item.get(k) for k in METADATA_FIELDS}
+        utils.save_json(cache, cache_dir, fname)
+    values = {k: v for name in features for k, v in cache['features'][keys[name]].items()}
+    return dict(fname=fname, **cache['metadata'], **values)
+
+
+def extract_corpus_features(
+        corpus_dir: str,
+        exog_ins: str = 'piano',
+        features: list[str] = None,
+        cache_dir: str = None,
+        n_jobs: int = -1,
+        ignore_cache: bool = False
+) -> pd.DataFrame:
+    """Extracts features for every track in `corpus_dir` in parallel, and returns a single table with one row per track
+
+    Arguments:
+        corpus_dir (str): the folder containing one folder of annotations for every track
+        exog_ins (str, optional): the instrument to extract features for, defaults to "piano"
+        features (list[str], optional): the names of the features to extract, defaults to all features in `FEATURES`
+        cache_dir (str, optional): the folder to cache features in, defaults to `FEATURE_CACHE_DIR` next to the corpus
+        n_jobs (int, optional): the number of processes to use, defaults to -1 (all CPU cores)
+        ignore_cache (bool, optional): extract every feature again, even if it has been cached, defaults to False
+
+    Returns:
+        pd.DataFrame: the feature table, with one column per feature
+
+    """
+    if cache_dir is None:
+        cache_dir = os.path.join(os.path.dirname(os.path.abspath(corpus_dir)), FEATURE_CACHE_DIR)
+    os.makedirs(cache_dir, exist_ok=True)
+    dirpaths = sorted(
+        os.path.join(corpus_dir, d) for d in os.listdir(corpus_dir) if os.path.isdir(os.path.join(corpus_dir, d))
+    )
+    # Each track is processed in a separate process, as feature extraction is mostly CPU-bound
+    with Parallel(n_jobs=n_jobs, backend='loky', verbose=1) as par:
+        rows = par(delayed(process_track)(dp, cache_dir, exog_ins, features, ignore_cache) for dp in dirpaths)
+    return pd.DataFrame(rows)
+
+
+@click.command()
+@click.option(
+    "-corpus_dir", "corpus_dir", type=click.Path(exists=True, file_okay=False),
+    default=rf"{utils.get_project_root()}/data/cambridge-jazz-trio-database-v02",
+    help='Folder containing the annotations for every track'
+)
+@click.option(
+    "-output", "output", type=click.Path(dir_okay=False), default=None,
+    help='File to save the feature table to, defaults to a .csv file next to the corpus'
+)
+@click.option("-instr", "exog_ins", default='piano', help='Extract features for this instrument (defaults to piano)')
+@click.option(
+    "-feature", "features", type=click.Choice(list(FEATURES.keys())), multiple=True, default=None,
+    help='Feature to extract (can be passed multiple times), defaults to all features'
+)
+@click.option("-n_jobs", "n_jobs", type=click.IntRange(-1, clamp=True), default=-1, help='Number of CPU cores to use')
+@click.option("-ignore-cache", "ignore_cache", is_flag=True, default=False, help='Ignore any cached features')
+def main(
+        corpus_dir: str,
+        output: str,
+        exog_ins: str,
+        features: tuple[str],
+        n_jobs: int,
+        ignore_cache: bool
+) -> pd.DataFrame:
+    """Extracts features from the annotations for every track in a corpus and saves them in a single table"""
+    # Start the counter
+    start = time()
+    # Initialise the logger
+    logger = logging.getLogger(__name__)
+    features = list(features) if len(features) > 0 else None
+    logger.info(f"extracting features from {corpus_dir} using {n_jobs} CPUs ...")
+    df = extract_corpus_features(corpus_dir, exog_ins, features, n_jobs=n_jobs, ignore_cache=ignore_cache)
+    if output is None:
+        output = f'{os.path.normpath(corpus_dir)}_features.csv'
+    df.to_csv(output, index=False)
+    # Log the completion time
+    logger.info(f'features extracted for {len(df)} tracks in {round(time() - start)} secs, saved to {output} !')
+    return df
+
+
+if __name__ == '__main__':
+    log_fmt = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+    logging.basicConfig(level=logging.INFO, format=log_fmt)
+
+    # not used in this stub but often useful for finding various files
+    project_dir = Path(__file__).resolve().parents[2]
+
+    # find .env automagically by walking up directories until it's found, then
+    # load up the .env entries as environment variables
+    load_dotenv(find_dotenv())
+
+    main()
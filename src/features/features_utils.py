@@ -4,12 +4,18 @@
 """Utility classes, functions, and variables used in the feature extraction process"""
 
 import json
+from contextlib import contextmanager
+from typing import Callable
 
 import numpy as np
 import pandas as pd
 
+from src import utils
 
-__all__ = ["BaseExtractor"]
+__all__ = [
+    "BaseExtractor", "BeatGrid", "FeatureContext", "OLSResults", "fit_ols", "fit_ols_batch", "get_window_bounds",
+    "summary_statistics", "rolling_summary_statistics"
+]
 
 
 class BaseExtractor:
@@ -28,8 +34,28 @@ class BaseExtractor:
             count=len,
             count_nonzero=self.count_nonzero,
         )
+        # The default functions are all calculated together in `summary_statistics`, rather than called one-by-one
+        self._fused_summary_funcs = dict(self.summary_funcs)
+        # Names of functions in `summary_funcs` that are called once on a 2D array of every array, see below
+        self._batched_summary_funcs = set()
         self.summary_dict = {}
 
+    def register_summary_func(self, name: str, func: Callable, batched: bool = False) -> None:
+        """Adds a function to `summary_funcs`, which will be called on every array passed to `update_summary_dict`.
+
+        Arguments:
+            name (str): the name of the function, used when creating keys in the summary dictionary
+            func (Callable): the function to add
+            batched (bool, optional): if True, `func` is called once on a 2D array with one (NaN-padded) row for every
+                array, and must return one value per row. Otherwise, `func` is called on each array in turn.
+
+        """
+        self.summary_funcs[name] = func
+        if batched:
+            self._batched_summary_funcs.add(name)
+        else:
+            self._batched_summary_funcs.discard(name)
+
     @staticmethod
     def count_nonzero(x) -> int:
         """Simple wrapper around `np.count_nonzero` that removes NaN values from an array"""
@@ -67,8 +93,19 @@ class BaseExtractor:
 
     def update_summary_dict(self, array_names, arrays, *args, **kwargs) -> None:
         """Update our summary dictionary with values from this feature. Can be overridden!"""
-        for name, df in zip(array_names, arrays):
-            self.summary_dict.update({f'{name}_{func_k}': func_v(df) for func_k, func_v in self.summary_funcs.items()})
+        array_names, arrays = list(array_names), list(arrays)
+        if len(arrays) == 0:
+            return
+        # Calculate the default and any batched functions for every array in one pass
+        batched = {k: v for k, v in self.summary_funcs.items() if k in self._batched_summary_funcs}
+        stats = summary_statistics(arrays, extra_funcs=batched)
+        for i, (name, arr) in enumerate(zip(array_names, arrays)):
+            for func_k, func_v in self.summary_funcs.items():
+                # Functions that have been replaced by the child class need to be called separately
+                if func_k in batched or self._fused_summary_funcs.get(func_k) is func_v:
+                    self.summary_dict[f'{name}_{func_k}'] = stats[func_k][i]
+                else:
+                    self.summary_dict[f'{name}_{func_k}'] = func_v(arr)
 
     @staticmethod
     def get_between(arr, i1, i2) -> np.array:
@@ -120,3 +157,570 @@ class BaseExtractor:
                 return arr.mask(~mask)
             else:
                 return arr[mask]
+
+
+class BeatGrid:
+    """Beat and bar segmentation for a single track, computed once and shared between all feature extractors.
+
+    Onsets are sorted and cleaned of missing values once, and the indices of the onsets falling within every window of
+    bars (or between every pair of beats) are obtained with `np.searchsorted` the first time they are requested and
+    cached thereafter. Extractors can then be created from the grid with their `from_grid` class methods.
+
+    Arguments:
+        beats (np.array): the position of every crotchet beat, typically tracked from the full mix
+        downbeats (np.array): the position of every downbeat, i.e. the first beat of each bar
+        metre (np.array, optional): the position of every beat within its bar, with 1 for downbeats
+        tempo (float, optional): the tempo of the track, in beats-per-minute
+        time_signature (int, optional): the number of beats in each bar, defaults to 4
+        onsets (dict[str, np.array], optional): the raw onsets for every instrument
+        summary_df (pd.DataFrame, optional): onsets for every instrument matched to `beats`, one row per beat
+        metre_col (str, optional): the name of the column in `summary_df` containing `metre`
+
+    """
+
+    def __init__(
+            self,
+            beats: np.array,
+            downbeats: np.array,
+            metre: np.array = None,
+            tempo: float = None,
+            time_signature: int = 4,
+            onsets: dict[str, np.array] = None,
+            summary_df: pd.DataFrame = None,
+            metre_col: str = 'metre_auto',
+    ):
+        self.beats = np.asarray(beats, dtype=float)
+        self.downbeats = np.asarray(downbeats, dtype=float)
+        self.metre = np.asarray(metre, dtype=float) if metre is not None else None
+        self.tempo = tempo
+        self.time_signature = time_signature
+        self.summary_df = summary_df
+        self.metre_col = metre_col
+        # The index of the bar that every beat belongs to, counting from the first downbeat: beats before this are -1
+        if self.metre is not None:
+            self.bar_ids = np.cumsum(self.metre == 1) - 1
+        else:
+            self.bar_ids = np.searchsorted(self.downbeats[~np.isnan(self.downbeats)], self.beats, side='right') - 1
+        # Sort and remove missing values from every array of onsets
+        self._onsets = {k: self._clean(v) for k, v in (onsets or {}).items()}
+        self._cache = {}
+
+    @classmethod
+    def from_onsetmaker(cls, om, metre_col: str = 'metre_auto', downbeats_col: str = 'downbeats_auto'):
+        """Creates the grid from a processed `OnsetMaker` instance"""
+        summary_df = pd.DataFrame(om.summary_dict)
+        return cls(
+            beats=summary_df['beats'],
+            downbeats=om.ons[downbeats_col],
+            metre=summary_df[metre_col],
+            tempo=om.tempo,
+            time_signature=om.item['time_signature'],
+            onsets={instr: om.ons[instr] for instr in utils.INSTRUMENTS_TO_PERFORMER_ROLES.keys()},
+            summary_df=summary_df,
+            metre_col=metre_col
+        )
+
+    def _memoise(self, key: tuple, func: Callable):
+        """Returns the cached value for `key`, calling `func` to compute and cache it the first time it is requested"""
+        if key not in self._cache:
+            self._cache[key] = func()
+        return self._cache[key]
+
+    @staticmethod
+    def _clean(arr: np.array) -> np.ndarray:
+        """Sorts an array and removes missing values"""
+        arr = np.sort(np.asarray(arr, dtype=float))
+        return arr[~np.isnan(arr)]
+
+    def get_onsets(self, instr: str, matched: bool = False) -> np.ndarray:
+        """Gets sorted onsets for an instrument without missing values, either raw or `matched` to the beats"""
+        if not matched:
+            return self._onsets[instr]
+        return self._memoise(('matched', instr), lambda: self._clean(self.summary_df[instr]))
+
+    def get_iois(self, instr: str, matched: bool = False) -> np.ndarray:
+        """Gets the inter-onset intervals between the sorted onsets returned by `get_onsets`"""
+        return self._memoise(('iois', instr, matched), lambda: np.diff(self.get_onsets(instr, matched)))
+
+    def get_matched_beats(self, instr: str) -> pd.Series:
+        """Gets the onsets for an instrument matched to every beat, with missing values where no onset was matched"""
+        return self.summary_df[instr]
+
+    def get_bar_bounds(self, instr: str, bar_period: int, matched: bool = False) -> tuple[np.ndarray, np.ndarray]:
+        """Gets the indices of the onsets within every window of `bar_period` bars, see `get_window_bounds`"""
+        n_windows = max(len(self.downbeats) - bar_period, 0)
+        return self._memoise(('bars', instr, bar_period, matched), lambda: get_window_bounds(
+            self.get_onsets(instr, matched),
+            self.downbeats[:n_windows],
+            self.downbeats[bar_period:bar_period + n_windows]
+        ))
+
+    def get_beat_bounds(self, instr: str) -> tuple[np.ndarray, np.ndarray]:
+        """Gets the indices of the raw onsets between each pair of consecutive matched beats, see `get_window_bounds`"""
+        def bounds() -> tuple[np.ndarray, np.ndarray]:
+            beats = self.get_matched_beats(instr).to_numpy(dtype=float)
+            return get_window_bounds(self.get_onsets(instr), beats[:-1], beats[1:])
+
+        return self._memoise(('beats', instr), bounds)
+
+
+class FeatureContext(BeatGrid):
+    """A `BeatGrid` that also memoises the beat-level intermediate arrays shared between feature extractors.
+
+    Inter-onset intervals, differenced inter-onset intervals, and asynchronies for the onsets matched to every beat (as
+    used in e.g. `PhaseCorrection`), and the mean position of every beat across instruments (as used in `TempoSlope`),
+    are computed lazily the first time they are requested and reused by every extractor thereafter. Every request for
+    an intermediate array is logged against the feature currently being extracted (set with `track`), so that
+    `dependency_report` can show which arrays each feature computed and which it reused.
+
+    Arguments:
+        *args: positional arguments passed to `BeatGrid`
+        **kwargs: keyword arguments passed to `BeatGrid`
+
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._feature = None
+        self._log = []
+
+    @contextmanager
+    def track(self, feature: str):
+        """Attributes every intermediate array requested within this context to `feature` in `dependency_report`"""
+        previous, self._feature = self._feature, feature
+        try:
+            yield self
+        finally:
+            self._feature = previous
+
+    def _memoise(self, key: tuple, func: Callable):
+        """Logs whether the value for `key` was computed or reused by the current feature, then returns it"""
+        self._log.append((self._feature, '_'.join(str(k) for k in key), 'reused' if key in self._cache else 'computed'))
+        return super()._memoise(key, func)
+
+    def dependency_report(self) -> pd.DataFrame:
+        """Returns a dataframe of every intermediate array requested by each feature, and whether it was reused"""
+        return pd.DataFrame(self._log, columns=['feature', 'intermediate', 'status'])
+
+    def get_beat_iois(self, instr: str) -> pd.Series:
+        """Gets the inter-onset intervals between the onsets matched to consecutive beats, with missing values"""
+        return self._memoise(('beat_iois', instr), lambda: self.get_matched_beats(instr).diff())
+
+    def get_differenced_iois(self, instr: str) -> pd.Series:
+        """Gets the first difference of the inter-onset intervals returned by `get_beat_iois`"""
+        return self._memoise(('differenced_iois', instr), lambda: self.get_beat_iois(instr).diff())
+
+    def get_asynchronies(self, instr: str, partner: str) -> pd.Series:
+        """Gets the asynchrony of `partner` with relation to `instr` at every beat, i.e. their onset minus my onset"""
+        # Asynchronies are antisymmetric, so we only need to compute them once for every pair of instruments
+        first, second = sorted([instr, partner])
+        asynchronies = self._memoise(
+            ('asynchronies', first, second),
+            lambda: self.get_matched_beats(second) - self.get_matched_beats(first)
+        )
+        return asynchronies if instr == first else -asynchronies
+
+    def get_beat_means(self, instrs: list[str] = None) -> pd.Series:
+        """Gets the mean position of every beat across the onsets matched to it by the given instruments"""
+        if instrs is None:
+            instrs = list(utils.INSTRUMENTS_TO_PERFORMER_ROLES.keys())
+        return self._memoise(('beat_means', *instrs), lambda: self.summary_df[list(instrs)].mean(axis=1))
+
+
+class OLSResults:
+    """A fitted ordinary least squares regression, with the same attributes as the `statsmodels` results we use.
+
+    Arguments:
+        params (pd.Series): coefficients, indexed by the name of each predictor
+        bse (pd.Series): standard errors of each coefficient
+        resid (np.ndarray): residuals for every observation used in fitting the model
+        centered_tss (float): total sum of squares of the dependent variable around its mean
+        rank (int): rank of the predictor matrix
+        endog_names (str, optional): the name of the dependent variable, defaults to "y"
+
+    """
+    # Every model we fit includes a constant term
+    k_constant = 1
+
+    def __init__(
+            self,
+            params: pd.Series,
+            bse: pd.Series,
+            resid: np.ndarray,
+            centered_tss: float,
+            rank: int,
+            endog_names: str = 'y'
+    ):
+        self.params = params
+        self.bse = bse
+        self.resid = resid
+        self.endog_names = endog_names
+        self.exog_names = list(params.index)
+        # We use numpy types here so that models with no residual degrees of freedom return NaN rather than raising
+        self.nobs = np.float64(len(resid))
+        self.ssr = np.float64(np.dot(resid, resid))
+        self.centered_tss = np.float64(centered_tss)
+        self.df_model = np.float64(rank - self.k_constant)
+        self.df_resid = self.nobs - rank
+        with np.errstate(divide='ignore', invalid='ignore'):
+            # These all follow the definitions used in `statsmodels`
+            self.rsquared = 1 - self.ssr / self.centered_tss
+            self.rsquared_adj = 1 - (self.nobs - self.k_constant) / self.df_resid * (1 - self.rsquared)
+            nobs2 = self.nobs / 2.
+            self.llf = -nobs2 * np.log(2 * np.pi) - nobs2 * np.log(self.ssr / self.nobs) - nobs2
+        self.aic = -2 * self.llf + 2 * (self.df_model + self.k_constant)
+        self.bic = -2 * self.llf + np.log(self.nobs) * (self.df_model + self.k_constant)
+
+    def __repr__(self) -> str:
+        """Overrides default string representation to print the model coefficients"""
+        return f'OLSResults(endog={self.endog_names}, nobs={int(self.nobs)}, params={self.params.to_dict()})'
+
+
+def _get_ols_arrays(endog, exog, add_constant: bool = True) -> tuple | None:
+    """Converts dependent and predictor variables to arrays, dropping any observations with missing values"""
+    endog_name = endog.name if isinstance(endog, pd.Series) and endog.name is not None else 'y'
+    if isinstance(exog, pd.DataFrame):
+        exog_names = [str(c) for c in exog.columns]
+    elif isinstance(exog, pd.Series):
+        exog_names = [str(exog.name) if exog.name is not None else 'x1']
+    else:
+        exog_names = [f'x{i + 1}' for i in range(np.atleast_2d(np.asarray(exog).T).shape[0])]
+    y = np.asarray(endog, dtype=float).ravel()
+    x = np.asarray(exog, dtype=float).reshape(len(y), -1)
+    if add_constant:
+        x = np.column_stack([np.ones(len(y)), x])
+        exog_names = ['const'] + exog_names
+    # Equivalent to `missing='drop'` in statsmodels: we only use rows without any missing values
+    valid = ~np.isnan(y) & ~np.isnan(x).any(axis=1)
+    if not valid.any():
+        return None
+    return y[valid], x[valid], endog_name, exog_names
+
+
+def _fit_ols_statsmodels(endog, exog, add_constant: bool = True) -> OLSResults | None:
+    """Fits a model using `statsmodels`, which is slower but can be used as a reference for `fit_ols_batch`"""
+    import statsmodels.api as sm
+
+    arrays = _get_ols_arrays(endog, exog, add_constant)
+    if arrays is None:
+        return None
+    y, x, endog_name, exog_names = arrays
+    res = sm.OLS(y, x).fit()
+    return OLSResults(
+        params=pd.Series(res.params, index=exog_names),
+        bse=pd.Series(res.bse, index=exog_names),
+        resid=np.asarray(res.resid),
+        centered_tss=res.centered_tss,
+        rank=res.model.rank,
+        endog_names=endog_name
+    )
+
+
+def fit_ols_batch(
+        endogs: list,
+        exogs: list,
+        add_constant: bool = True,
+        backend: str = 'numpy'
+) -> list[OLSResults | None]:
+    """Fits many ordinary least squares regressions, solving all models with the same number of predictors together.
+
+    Observations with missing values are dropped from each model, as with `missing='drop'` in `statsmodels`. Models are
+    then padded with rows of zeros (which do not change the solution) and stacked, so that coefficients for every model
+    can be obtained from a single batched singular value decomposition, in the same way as `statsmodels`.
+
+    Arguments:
+        endogs (list): the dependent variable for every model, as arrays or series
+        exogs (list): the predictor variables for every model, as arrays, series, or dataframes
+        add_constant (bool, optional): whether to add a constant term to every model, defaults to True
+        backend (str, optional): either "numpy" (default) or "statsmodels", which fits every model in turn
+
+    Returns:
+        list[OLSResults | None]: the fitted models, with None for any model without valid observations
+
+    """
+    if backend == 'statsmodels':
+        return [_fit_ols_statsmodels(y, x, add_constant) for y, x in zip(endogs, exogs)]
+    elif backend != 'numpy':
+        raise ValueError(f'`backend` must be one of "numpy" or "statsmodels", but got {backend}')
+    arrays = [_get_ols_arrays(y, x, add_constant) for y, x in zip(endogs, exogs)]
+    results = [None] * len(arrays)
+    for k in sorted({arr[1].shape[1] for arr in arrays if arr is not None}):
+        idxs = [i for i, arr in enumerate(arrays) if arr is not None and arr[1].shape[1] == k]
+        nobs = np.array([len(arrays[i][0]) for i in idxs])
+        ys, xs = np.zeros((len(idxs), nobs.max())), np.zeros((len(idxs), nobs.max(), k))
+        for j, i in enumerate(idxs):
+            ys[j, :nobs[j]], xs[j, :nobs[j]] = arrays[i][0], arrays[i][1]
+        # Get the pseudo-inverse of every predictor matrix, following `np.linalg.pinv`
+        u, s, vt = np.linalg.svd(xs, full_matrices=False)
+        smax = s.max(axis=1, keepdims=True)
+        s_inv = np.where(s > 1e-15 * smax, 1 / np.where(s > 0, s, 1), 0)
+        pinv = np.matmul(np.swapaxes(vt, 1, 2), s_inv[:, :, None] * np.swapaxes(u, 1, 2))
+        # Get the rank of every predictor matrix, following `np.linalg.matrix_rank`
+        rank = (s > smax * np.maximum(nobs, k)[:, None] * np.finfo(float).eps).sum(axis=1)
+        params = np.matmul(pinv, ys[:, :, None])[:, :, 0]
+        cov = np.matmul(pinv, np.swapaxes(pinv, 1, 2))
+        for j, i in enumerate(idxs):
+            y, x, endog_name, exog_names = arrays[i]
+            resid = y - x @ params[j]
+            with np.errstate(divide='ignore', invalid='ignore'):
+                scale = np.dot(resid, resid) / np.float64(nobs[j] - rank[j])
+                bse = np.sqrt(np.diag(cov[j]) * scale)
+            results[i] = OLSResults(
+                params=pd.Series(params[j], index=exog_names),
+                bse=pd.Series(bse, index=exog_names),
+                resid=resid,
+                centered_tss=np.sum((y - y.mean()) ** 2),
+                rank=rank[j],
+                endog_names=endog_name
+            )
+    return results
+
+
+def fit_ols(endog, exog, add_constant: bool = True, backend: str = 'numpy') -> OLSResults:
+    """Fits a single ordinary least squares regression, see `fit_ols_batch`
+
+    Raises:
+        ValueError: if there are no observations without missing values
+
+    """
+    res = fit_ols_batch([endog], [exog], add_constant=add_constant, backend=backend)[0]
+    if res is None:
+        raise ValueError('No observations without missing values')
+    return res
+
+
+def get_window_bounds(arr: np.ndarray, starts: np.ndarray, ends: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Gets indices such that `arr[lo[i]:hi[i]]` contains all values between `starts[i]` and `ends[i]` (inclusive).
+
+    Equivalent to calling `BaseExtractor.get_between` for every window, but uses `np.searchsorted` rather than masking
+    the whole array each time. `arr` must be sorted and contain no NaN values. Windows with a missing (NaN) start or end
+    are empty.
+
+    """
+    starts, ends = np.asarray(starts, dtype=float), np.asarray(ends, dtype=float)
+    lo = np.searchsorted(arr, starts, side='left')
+    hi = np.searchsorted(arr, ends, side='right')
+    # Empty windows have `lo == hi`: this also covers windows where the end is before the start
+    hi = np.where(np.isnan(starts) | np.isnan(ends), lo, np.maximum(hi, lo))
+    return lo, hi
+
+
+def _get_window_matrix(values: np.ndarray, lo: np.ndarray, hi: np.ndarray) -> np.ndarray:
+    """Gets a 2D array with one (NaN-padded) row for each window `values[lo[i]:hi[i]]`"""
+    lengths = hi - lo
+    width = int(lengths.max()) if len(lengths) > 0 else 0
+    cols = np.arange(width)
+    idx = np.minimum(lo[:, None] + cols[None, :], max(len(values) - 1, 0))
+    if len(values) == 0:
+        return np.full((len(lo), width), np.nan)
+    return np.where(cols[None, :] < lengths[:, None], values[idx], np.nan)
+
+
+def _nanquantile_sorted(sorted_mat: np.ndarray, counts: np.ndarray, q: float) -> np.ndarray:
+    """Equivalent to `np.nanquantile(row, q)` for every row of a matrix sorted along rows, with NaN values last"""
+    res = np.full(sorted_mat.shape[0], np.nan)
+    valid = counts > 0
+    if not valid.any():
+        return res
+    n = counts[valid]
+    rows = sorted_mat[valid]
+    # This follows the 'linear' method used in numpy, including its approach to interpolation
+    virtual = q * (n - 1)
+    previous = np.floor(virtual).astype(int)
+    following = np.minimum(previous + 1, n - 1)
+    gamma = virtual - previous
+    a = np.take_along_axis(rows, previous[:, None], axis=1)[:, 0]
+    b = np.take_along_axis(rows, following[:, None], axis=1)[:, 0]
+    diff_b_a = b - a
+    lerp = a + diff_b_a * gamma
+    above = gamma >= 0.5
+    lerp[above] = b[above] - diff_b_a[above] * (1 - gamma[above])
+    res[valid] = lerp
+    return res
+
+
+def _nanmedian_sorted(sorted_mat: np.ndarray, counts: np.ndarray) -> np.ndarray:
+    """Equivalent to `np.nanmedian(row)` for every row of a matrix sorted along rows, with NaN values last"""
+    res = np.full(sorted_mat.shape[0], np.nan)
+    valid = counts > 0
+    n = counts[valid]
+    rows = sorted_mat[valid]
+    a = np.take_along_axis(rows, ((n - 1) // 2)[:, None], axis=1)[:, 0]
+    b = np.take_along_axis(rows, (n // 2)[:, None], axis=1)[:, 0]
+    res[valid] = np.where(n % 2 == 0, (a + b) / 2, a)
+    return res
+
+
+def _stack_arrays(arrays) -> tuple[np.ndarray, np.ndarray]:
+    """Stacks a 2D array or an iterable of 1D arrays into a 2D float array with one (NaN-padded) row per array"""
+    if isinstance(arrays, np.ndarray) and arrays.ndim == 2:
+        mat = arrays.astype(float)
+        return mat, np.full(mat.shape[0], mat.shape[1])
+    rows = [np.asarray(arr, dtype=float).ravel() for arr in arrays]
+    lengths = np.array([len(row) for row in rows], dtype=int)
+    mat = np.full((len(rows), int(lengths.max()) if len(rows) > 0 else 0), np.nan)
+    for i, row in enumerate(rows):
+        mat[i, :len(row)] = row
+    return mat, lengths
+
+
+def summary_statistics(arrays, extra_funcs: dict[str, Callable] = None) -> dict[str, list]:
+    """Calculates the default summary statistics in `BaseExtractor` for many arrays in a single pass.
+
+    Every array is stacked into a 2D (NaN-padded) array, such that NaN values only need to be found once and all the
+    quantiles can be obtained from a single sort. This gives the same results as calling `np.nanmean`, `np.nanmedian`,
+    `np.nanstd`, `np.nanvar`, `np.nanquantile`, `len`, and `BaseExtractor.count_nonzero` on each array in turn. Note
+    that `count` includes NaN values, following `len`.
+
+    Arguments:
+        arrays (np.ndarray | Iterable): either a 2D array, with one row per array, or an iterable of 1D arrays
+        extra_funcs (dict[str, Callable], optional): additional functions, called once on the 2D (NaN-padded) array of
+            every array and returning one value per row
+
+    Returns:
+        dict[str, list]: values for `mean`, `median`, `std`, `var`, `quantile25`, `quantile75`, `count`,
+            `count_nonzero`, and any `extra_funcs`, each with one element per array
+
+    """
+    mat, lengths = _stack_arrays(arrays)
+    missing = np.isnan(mat)
+    counts = (~missing).sum(axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        # This follows the approach in `np.nanvar`, so that we get identical results
+        zeroed = np.where(missing, 0., mat)
+        mean = zeroed.sum(axis=1) / counts
+        dev = np.where(missing, 0., zeroed - mean[:, None])
+        var = (dev * dev).sum(axis=1) / counts
+        # Sorting puts NaN values last in each row
+        sorted_mat = np.sort(mat, axis=1)
+    res = dict(
+        mean=mean,
+        median=_nanmedian_sorted(sorted_mat, counts),
+        std=np.sqrt(var),
+        var=var,
+        quantile25=_nanquantile_sorted(sorted_mat, counts, 0.25),
+        quantile75=_nanquantile_sorted(sorted_mat, counts, 0.75),
+        count=lengths,
+        count_nonzero=counts,
+    )
+    if extra_funcs is not None:
+        for func_k, func_v in extra_funcs.items():
+            res[func_k] = np.asarray(func_v(mat)).reshape(-1)
+    # Convert to lists of python types, which can be serialised
+    return {k: v.tolist() for k, v in res.items()}
+
+
+def _blocked_window_sums(values: np.ndarray, lo: np.ndarray, hi: np.ndarray) -> np.ndarray:
+    """Gets the sum of every window `values[lo[i]:hi[i]]` from cumulative sums that restart every block.
+
+    The block size is set to the length of the longest window, so each window spans at most two blocks. This means we
+    never take the difference between two sums accumulated over the whole array, which would lose precision for
+    windows towards the end of long tracks.
+
+    """
+    size = max(int((hi - lo).max()), 1)
+    n_blocks = -(-len(values) // size)
+    padded = np.zeros(n_blocks * size)
+    padded[:len(values)] = values
+    # Cumulative sums within each block, including the current value
+    cs = np.cumsum(padded.reshape(n_blocks, size), axis=1).ravel()
+    first, last = lo // size, (hi - 1) // size
+    # Sum of values in the block before the start of the window
+    before = np.where(lo % size != 0, cs[np.maximum(lo - 1, 0)], 0.)
+    # If the window spans two blocks, add the end of the first block to the second block
+    end_first = cs[np.minimum(first * size + size - 1, len(cs) - 1)]
+    sums = np.where(first == last, cs[np.maximum(hi - 1, 0)] - before, end_first - before + cs[np.maximum(hi - 1, 0)])
+    return np.where(hi > lo, sums, 0.)
+
+
+def _rolling_moments(values: np.ndarray, lo: np.ndarray, hi: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Gets the mean and (population) variance of every window `values[lo[i]:hi[i]]` from cumulative sums.
+
+    `values` must be finite. We subtract the overall mean before summing, which limits the loss of precision when
+    calculating the variance from the sum of squares.
+
+    """
+    n = (hi - lo).astype(float)
+    if len(values) == 0 or not (n > 0).any():
+        return np.full(len(lo), np.nan), np.full(len(lo), np.nan)
+    shift = values.mean()
+    centred = values - shift
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean_c = _blocked_window_sums(centred, lo, hi) / n
+        var = np.maximum(_blocked_window_sums(centred ** 2, lo, hi) / n - mean_c ** 2, 0.)
+    # Windows with a single value have no variance
+    var[n == 1] = 0.
+    return np.where(n > 0, shift + mean_c, np.nan), np.where(n > 0, var, np.nan)
+
+
+def rolling_summary_statistics(
+        values: np.ndarray,
+        lo: np.ndarray,
+        hi: np.ndarray,
+        iqr_filter: bool = False,
+        extra_funcs: dict[str, Callable] = None
+) -> dict[str, np.ndarray]:
+    """Calculates the default summary statistics in `BaseExtractor` for every window `values[lo[i]:hi[i]]`.
+
+    Mean, variance, and count are obtained from cumulative sums over `values`, so the cost doesn't depend on the length
+    of each window. Quantiles are obtained from a single sort of a 2D (NaN-padded) array containing every window. If
+    `iqr_filter` is True, values in each window are filtered in the same way as `utils.iqr_filter` before calculating
+    statistics, in which case moments are calculated from the filtered 2D array instead.
+
+    Arguments:
+        values (np.ndarray): the array to calculate rolling statistics over, may contain NaN values
+        lo (np.ndarray): the index of the first value in each window
+        hi (np.ndarray): the index of one past the last value in each window
+        iqr_filter (bool, optional): whether to apply IQR filtering within each window, defaults to False
+        extra_funcs (dict[str, Callable], optional): additional functions, called on every window (with NaN values
+            removed) in turn
+
+    Returns:
+        dict[str, np.ndarray]: arrays of `mean`, `median`, `std`, `var`, `quantile25`, `quantile75`, `count_nonzero`,
+            and any `extra_funcs`, each with one element per window
+
+    """
+    values = np.asarray(values, dtype=float)
+    lo, hi = np.asarray(lo, dtype=int), np.asarray(hi, dtype=int)
+    mat = _get_window_matrix(values, lo, hi)
+    with np.errstate(invalid='ignore'):
+        # Sorting puts NaN values last in each row
+        sorted_mat = np.sort(mat, axis=1)
+        counts = (~np.isnan(mat)).sum(axis=1)
+        q25 = _nanquantile_sorted(sorted_mat, counts, 0.25)
+        q75 = _nanquantile_sorted(sorted_mat, counts, 0.75)
+        if iqr_filter:
+            iqr = q75 - q25
+            # If the upper and lower bounds are equal, the IQR will be 0.0, so we don't filter this window
+            bound_lo = np.where(iqr == 0, -np.inf, q25 - (1.5 * iqr))[:, None]
+            bound_hi = np.where(iqr == 0, np.inf, q75 + (1.5 * iqr))[:, None]
+            mat = np.where((bound_lo < mat) & (mat < bound_hi), mat, np.nan)
+            sorted_mat = np.sort(mat, axis=1)
+            counts = (~np.isnan(mat)).sum(axis=1)
+            q25 = _nanquantile_sorted(sorted_mat, counts, 0.25)
+            q75 = _nanquantile_sorted(sorted_mat, counts, 0.75)
+    # We can only use cumulative sums when every value will be included in every window
+    if not iqr_filter and np.isfinite(values).all():
+        mean, var = _rolling_moments(values, lo, hi)
+        # Windows where every value is identical have no variance: we set this explicitly to avoid rounding errors
+        if sorted_mat.shape[1] > 0:
+            last = np.take_along_axis(sorted_mat, np.maximum(counts - 1, 0)[:, None], axis=1)[:, 0]
+            var[(counts > 0) & (sorted_mat[:, 0] == last)] = 0.
+    else:
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = np.nansum(mat, axis=1) / counts
+            var = np.nansum((mat - mean[:, None]) ** 2, axis=1) / counts
+    res = dict(
+        mean=mean,
+        median=_nanmedian_sorted(sorted_mat, counts),
+        std=np.sqrt(var),
+        var=var,
+        quantile25=q25,
+        quantile75=q75,
+        count_nonzero=counts,
+    )
+    # Additional functions are called on each window in turn
+    if extra_funcs is not None:
+        for func_k, func_v in extra_funcs.items():
+            res[func_k] = np.array([func_v(row[~np.isnan(row)]) for row in mat], dtype=float)
+    return res
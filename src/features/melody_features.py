@@ -13,7 +13,9 @@ from src.detect.midi_utils import Note, MelodyMaker
 from src.features.features_utils import BaseExtractor
 
 __all__ = [
-    'MelodyChunkManager', 'PitchExtractor', 'IntervalExtractor', 'ContourExtractor', 'TonalityExtractor'
+    'MelodyChunkManager', 'MultiMelodyChunkManager', 'PitchExtractor', 'IntervalExtractor', 'ContourExtractor',
+    'TonalityExtractor', 'KEY_NAMES', 'key_correlations', 'tonality_kernel', 'make_ragged_batch', 'pitch_kernel',
+    'interval_kernel', 'contour_kernel', 'batch_normalized_entropy', 'batch_modal_interval'
 ]
 
 HURON_CONTOURS = dict(
@@ -30,20 +32,32 @@ HURON_CONTOURS = dict(
 )
 
 
-class MelodyChunkManager(BaseExtractor):
-    """For a given `MelodyMaker` instance, applies the given `extractor` to all chunks and averages the results"""
+class MultiMelodyChunkManager(BaseExtractor):
+    """For a given `MelodyMaker` instance, applies all `extractors` to every chunk and averages the results
+
+    The melody is extracted and chunked once, with every extractor then applied to the same chunks in a single pass.
+    The summary dictionary is the same as combining those from a `MelodyChunkManager` for every extractor.
+    """
     # A chunk requires at least two `Note` instances in order to be evaluated
     NOTE_LB = 2
 
-    def __init__(self, extractor, mm: MelodyMaker, **kwargs):
+    def __init__(self, extractors: list, mm: MelodyMaker, **kwargs):
         super().__init__()
-        mel = list(mm.extract_melody())
-        self.chunk_list = [
-            extractor(chunk, **kwargs).summary_dict for chunk in mm.chunk_melody(mel) if len(chunk) > self.NOTE_LB
-        ]
-        if len(self.chunk_list) > 0:
-            chunk_dict = {k: [dic[k] for dic in self.chunk_list] for k in self.chunk_list[0]}
-            self.update_summary_dict(chunk_dict.keys(), chunk_dict.values())
+        chunks = [chunk for chunk in mm.chunk_melody() if len(chunk) > self.NOTE_LB]
+        # Features for every chunk from each extractor, stored as a dictionary of feature name: value for each chunk
+        self.chunk_features = {extractor: self.extract_chunks(extractor, chunks, **kwargs) for extractor in extractors}
+        # Summarise the results from each extractor in turn
+        for chunk_dict in self.chunk_features.values():
+            if len(chunks) > 0:
+                self.update_summary_dict(chunk_dict.keys(), chunk_dict.values())
+
+    @staticmethod
+    def extract_chunks(extractor, chunks: list[tuple[Note]], **kwargs) -> dict[str, list]:
+        """Applies `extractor` to every chunk, using its `extract_chunks` method to process all chunks at once if any"""
+        if hasattr(extractor, 'extract_chunks'):
+            return {k: np.asarray(v).tolist() for k, v in extractor.extract_chunks(chunks, **kwargs).items()}
+        chunk_list = [extractor(chunk, **kwargs).summary_dict for chunk in chunks]
+        return {k: [dic[k] for dic in chunk_list] for k in chunk_list[0]} if len(chunk_list) > 0 else {}
 
     def update_summary_dict(self, array_names, arrays, *args, **kwargs):
         """Applies all the functions in `summary_funcs` to each array of values from the base `extractor`"""
@@ -56,31 +70,35 @@ class MelodyChunkManager(BaseExtractor):
                     self.summary_dict[f'{array_name}_{func_name}'] = np.nan
 
 
+class MelodyChunkManager(MultiMelodyChunkManager):
+    """For a given `MelodyMaker` instance, applies the given `extractor` to all chunks and averages the results"""
+
+    def __init__(self, extractor, mm: MelodyMaker, **kwargs):
+        super().__init__([extractor], mm, **kwargs)
+        chunk_dict = self.chunk_features[extractor]
+        self.chunk_list = [dict(zip(chunk_dict.keys(), vals)) for vals in zip(*chunk_dict.values())]
+
+
 class PitchExtractor(BaseExtractor):
     def __init__(self, my_notes: list[Note]):
         super().__init__()
-        pitches = [i.pitch for i in my_notes]
-        pitch_classes = [i.pitch_class for i in my_notes]
-        self.summary_dict = {
-            'pitch_range': max(pitches) - min(pitches) if len(pitches) > 1 else np.nan,
-            'pitch_std': np.nanstd(pitches),
-            'pitch_class_entropy': normalized_entropy(pitch_classes, 24)
-        }
+        self.summary_dict = {k: v.tolist()[0] for k, v in self.extract_chunks([my_notes]).items()}
+
+    @classmethod
+    def extract_chunks(cls, chunks: list[list[Note]]) -> dict[str, np.ndarray]:
+        """Extracts features for every chunk at once, from a ragged batch of the pitches in every chunk"""
+        return pitch_kernel(*make_ragged_batch(chunks))
 
 
 class IntervalExtractor(BaseExtractor):
     def __init__(self, my_notes: list[Note]):
         super().__init__()
-        intervals = [i2.pitch - i1.pitch for i2, i1 in zip(my_notes, my_notes[1:])]
-        abs_intervals = [abs(i) for i in intervals]
-        self.summary_dict = dict(
-            abs_interval_range=max(abs_intervals) - min(abs_intervals) if len(abs_intervals) > 1 else np.nan,
-            mean_abs_interval=np.nanmean(abs_intervals),
-            std_abs_interval=np.nanstd(abs_intervals),
-            # Per Mullensiefen (2009), we use a different value for normalizing interval entropy here
-            interval_entropy=normalized_entropy(intervals, norm=23),
-            modal_interval=self.modal_interval(intervals)
-        )
+        self.summary_dict = {k: v.tolist()[0] for k, v in self.extract_chunks([my_notes]).items()}
+
+    @classmethod
+    def extract_chunks(cls, chunks: list[list[Note]]) -> dict[str, np.ndarray]:
+        """Extracts features for every chunk at once, from a ragged batch of the pitches in every chunk"""
+        return interval_kernel(*make_ragged_batch(chunks))
 
     @staticmethod
     def modal_interval(intervals) -> int:
@@ -97,10 +115,12 @@ class IntervalExtractor(BaseExtractor):
 class ContourExtractor(BaseExtractor):
     def __init__(self, my_notes: list[Note]):
         super().__init__()
-        pitches = [i.pitch for i in my_notes]
-        self.summary_dict = dict(
-            huron_contour=self.huron_contour(pitches),
-        )
+        self.summary_dict = {k: v.tolist()[0] for k, v in self.extract_chunks([my_notes]).items()}
+
+    @classmethod
+    def extract_chunks(cls, chunks: list[list[Note]]) -> dict[str, np.ndarray]:
+        """Extracts features for every chunk at once, from a ragged batch of the pitches in every chunk"""
+        return contour_kernel(*make_ragged_batch(chunks))
 
     @staticmethod
     def huron_contour(pitches: list[int]) -> str:
@@ -118,20 +138,18 @@ class TonalityExtractor(BaseExtractor):
 
     def __init__(self, my_notes: list[Note]):
         super().__init__()
-        notes = [i.note for i in my_notes]
-        self.corrs = self.krumhansl_schmuckler(notes)
-        # Remove any duplicate correlations, sort in ascending order, and get the largest positive correlation
-        corrs_set = sorted(set(self.corrs.values()))
-        largest_corr = corrs_set[-1]
-        self.summary_dict = dict(
-            # Simply the largest correlation
-            tonalness=largest_corr,
-            # The largest correlation divided by the second-largest correlation
-            tonal_clarity=largest_corr / corrs_set[-2],
-            # The largest correlation divided by the sum of all positive correlations
-            tonal_spike=largest_corr / sum(i for i in corrs_set if i > 0),
-            mode=[c for c in self.corrs.keys() if self.corrs[c] == largest_corr][0].split(' ')[-1]
-        )
+        # Get our correlations with every key, then the features derived from these
+        self.corrs = self.krumhansl_schmuckler([i.note for i in my_notes])
+        tonality = tonality_kernel(np.array([list(self.corrs.values())]))
+        self.summary_dict = {k: v.tolist()[0] for k, v in tonality.items()}
+
+    @classmethod
+    def extract_chunks(cls, chunks: list[list[Note]]) -> dict[str, np.ndarray]:
+        """Extracts features for every chunk at once, from a matrix of pitch class histograms for all chunks"""
+        histograms = np.zeros((len(chunks), len(utils.ALL_PITCHES)))
+        chunk_idx = np.repeat(np.arange(len(chunks)), [len(chunk) for chunk in chunks])
+        np.add.at(histograms, (chunk_idx, [n.pitch_class for chunk in chunks for n in chunk]), 1)
+        return tonality_kernel(key_correlations(histograms))
 
     def krumhansl_schmuckler(self, notes: list[str]) -> dict:
         """
@@ -139,19 +157,233 @@ class TonalityExtractor(BaseExtractor):
 
         Returns a dictionary of tonalities and corresponding correlation coefficients for a given list of `notes`.
         """
-        len_pitches = len(utils.ALL_PITCHES)
-        # Calculate the relative frequency of each note in the input
-        relfreqs = {k: v / len(notes) for k, v in Counter(notes).items()}
-        # Sort the relative frequencies by the standard C-B pitch class
-        keyfreqs = {k: relfreqs[k] if k in relfreqs.keys() else 0 for k in utils.ALL_PITCHES}
-        corrs = {}
-        # Iterate through each note
-        for i in range(len_pitches):
-            key_test = [keyfreqs.get(utils.ALL_PITCHES[(i + m) % len_pitches]) for m in range(len_pitches)]
-            # Calculate the correlation coefficient against the major and minor profiles for this note
-            corrs[utils.ALL_PITCHES[i] + ' major'] = np.corrcoef(self.MAJ_PROFILE, key_test)[1, 0]
-            corrs[utils.ALL_PITCHES[i] + ' minor'] = np.corrcoef(self.MIN_PROFILE, key_test)[1, 0]
-        return corrs
+        # Get the number of each note in the input, sorted by the standard C-B pitch class
+        counts = Counter(notes)
+        histogram = np.array([[counts[k] for k in utils.ALL_PITCHES]], dtype=float)
+        return dict(zip(KEY_NAMES, key_correlations(histogram)[0]))
+
+
+# The names of all 24 keys, in the order used by `key_correlations`
+KEY_NAMES = [f'{pitch} {mode}' for pitch in utils.ALL_PITCHES for mode in ['major', 'minor']]
+
+
+def get_key_profiles() -> np.ndarray:
+    """Gets Krumhansl-Schmuckler profiles for all 24 keys, centred and normalised such that their dot product with a
+    centred and normalised pitch class histogram gives the Pearson correlation coefficient"""
+    n_pitches = len(utils.ALL_PITCHES)
+    # Element [i, j] is the weight given to pitch class j when the tonic is pitch class i
+    rotation = (np.arange(n_pitches)[None, :] - np.arange(n_pitches)[:, None]) % n_pitches
+    profiles = np.stack([
+        np.asarray(TonalityExtractor.MAJ_PROFILE)[rotation], np.asarray(TonalityExtractor.MIN_PROFILE)[rotation]
+    ], axis=1).reshape(-1, n_pitches)
+    profiles = profiles - profiles.mean(axis=1, keepdims=True)
+    return profiles / np.linalg.norm(profiles, axis=1, keepdims=True)
+
+
+def key_correlations(histograms: np.ndarray) -> np.ndarray:
+    """Correlates pitch class histograms with the Krumhansl-Schmuckler profiles for all 24 keys at once.
+
+    Arguments:
+        histograms (np.ndarray): counts (or relative frequencies) of every pitch class, with shape (n_chunks, 12)
+
+    Returns:
+        np.ndarray: Pearson correlation coefficients with shape (n_chunks, 24), with columns in the order of `KEY_NAMES`
+
+    """
+    histograms = np.asarray(histograms, dtype=float)
+    # Get relative frequencies, then centre and normalise them
+    with np.errstate(invalid='ignore', divide='ignore'):
+        relfreqs = histograms / histograms.sum(axis=1, keepdims=True)
+        centred = relfreqs - relfreqs.mean(axis=1, keepdims=True)
+        centred /= np.linalg.norm(centred, axis=1, keepdims=True)
+    return centred @ get_key_profiles().T
+
+
+def tonality_kernel(corrs: np.ndarray) -> dict[str, np.ndarray]:
+    """Gets tonalness, tonal clarity, tonal spike, and mode for many chunks from their correlations with every key.
+
+    Duplicate correlations are only counted once, such that the results for a chunk do not depend on the other chunks
+    it is batched with.
+
+    Arguments:
+        corrs (np.ndarray): correlations with every key, with shape (n_chunks, 24), in the order of `KEY_NAMES`
+
+    Returns:
+        dict[str, np.ndarray]: every feature, with shape (n_chunks,)
+
+    """
+    corrs = np.asarray(corrs, dtype=float)
+    # Sort the correlations in descending order and remove any duplicates
+    # Keys that fit a chunk equally well can differ by floating point error, so these count as duplicates too
+    desc = -np.sort(-corrs, axis=1)
+    distinct = np.ones(desc.shape, dtype=bool)
+    distinct[:, 1:] = ~np.isclose(desc[:, 1:], desc[:, :-1], rtol=1e-12, atol=1e-12)
+    # Get the largest and second-largest correlations
+    largest = desc[:, 0]
+    second = np.where(distinct & (np.arange(desc.shape[1]) > 0), desc, np.nan)
+    second = second[np.arange(len(desc)), np.argmax(~np.isnan(second), axis=1)]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return dict(
+            # Simply the largest correlation
+            tonalness=largest,
+            # The largest correlation divided by the second-largest correlation
+            tonal_clarity=largest / second,
+            # The largest correlation divided by the sum of all positive correlations
+            tonal_spike=largest / np.where(distinct & (desc > 0), desc, 0).sum(axis=1),
+            # Even-numbered keys are major, odd-numbered keys are minor
+            mode=np.where(np.argmax(corrs == largest[:, None], axis=1) % 2 == 0, 'major', 'minor'),
+        )
+
+
+def make_ragged_batch(chunks: list[list[Note]], attr: str = 'pitch') -> tuple[np.ndarray, np.ndarray]:
+    """Converts chunks of notes into a ragged batch: one array of values, and the offset of the start of each chunk
+
+    Arguments:
+        chunks (list[list[Note]]): the chunks of notes
+        attr (str, optional): the attribute to get from every note, defaults to "pitch"
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: the values, and offsets with shape (n_chunks + 1,), such that
+            `values[offsets[i]:offsets[i + 1]]` gives the values for chunk `i`
+
+    """
+    values = np.array([getattr(n, attr) for chunk in chunks for n in chunk], dtype=int)
+    offsets = np.concatenate([[0], np.cumsum([len(chunk) for chunk in chunks], dtype=int)])
+    return values, offsets
+
+
+def _segment_ids(offsets: np.ndarray) -> np.ndarray:
+    """Gets the index of the chunk containing every value in a ragged batch"""
+    return np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+
+
+def _segment_reduce(ufunc: np.ufunc, values: np.ndarray, offsets: np.ndarray) -> np.ndarray:
+    """Applies `ufunc.reduceat` to every chunk in a ragged batch, returning NaN for empty chunks"""
+    lengths = np.diff(offsets)
+    if len(values) == 0:
+        return np.full(len(lengths), np.nan)
+    res = ufunc.reduceat(values, np.minimum(offsets[:-1], len(values) - 1)).astype(float)
+    return np.where(lengths > 0, res, np.nan)
+
+
+def _integer_if_complete(res: np.ndarray, dtype: np.dtype) -> np.ndarray:
+    """Casts the result of a reduction over integer values back to integers, unless any chunks are missing"""
+    return res.astype(np.int64) if np.issubdtype(dtype, np.integer) and not np.isnan(res).any() else res
+
+
+def _segment_mean_std(values: np.ndarray, offsets: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Gets the mean and (population) standard deviation of every chunk in a ragged batch"""
+    ids, lengths = _segment_ids(offsets), np.diff(offsets)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = np.bincount(ids, weights=values, minlength=len(lengths)) / lengths
+        dev = values - mean[ids]
+        return mean, np.sqrt(np.bincount(ids, weights=dev * dev, minlength=len(lengths)) / lengths)
+
+
+def _segment_counts(values: np.ndarray, offsets: np.ndarray) -> np.ndarray:
+    """Counts the occurrences of every value in every chunk, with shape (n_chunks, max(values) - min(values) + 1)"""
+    n_chunks = len(offsets) - 1
+    if len(values) == 0:
+        return np.zeros((n_chunks, 1), dtype=int)
+    n_bins = values.max() - values.min() + 1
+    counts = np.bincount(_segment_ids(offsets) * n_bins + values - values.min(), minlength=n_chunks * n_bins)
+    return counts.reshape(n_chunks, n_bins)
+
+
+def batch_normalized_entropy(values: np.ndarray, offsets: np.ndarray, norm: int) -> np.ndarray:
+    """Calculates `normalized_entropy` for every chunk in a ragged batch of integer values at once"""
+    counts = _segment_counts(values, offsets)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        rel_freq = counts / np.diff(offsets)[:, None]
+        return -(np.where(counts > 0, rel_freq * np.log2(rel_freq), 0.).sum(axis=1) / np.log2(norm))
+
+
+def pitch_kernel(pitches: np.ndarray, offsets: np.ndarray) -> dict[str, np.ndarray]:
+    """Calculates the features in `PitchExtractor` for every chunk in a ragged batch of pitches at once"""
+    lengths = np.diff(offsets)
+    pitch_range = _segment_reduce(np.maximum, pitches, offsets) - _segment_reduce(np.minimum, pitches, offsets)
+    return dict(
+        pitch_range=_integer_if_complete(np.where(lengths > 1, pitch_range, np.nan), pitches.dtype),
+        pitch_std=_segment_mean_std(pitches, offsets)[1],
+        pitch_class_entropy=batch_normalized_entropy(pitches % 12, offsets, 24)
+    )
+
+
+def interval_kernel(pitches: np.ndarray, offsets: np.ndarray) -> dict[str, np.ndarray]:
+    """Calculates the features in `IntervalExtractor` for every chunk in a ragged batch of pitches at once"""
+    # Get the intervals between consecutive pitches in the same chunk, following the sign used in `IntervalExtractor`
+    ids = _segment_ids(offsets)
+    same_chunk = ids[:-1] == ids[1:]
+    intervals = (pitches[:-1] - pitches[1:])[same_chunk]
+    offsets = np.concatenate([[0], np.cumsum(np.maximum(np.diff(offsets) - 1, 0))])
+    abs_intervals = np.abs(intervals)
+    lengths = np.diff(offsets)
+    abs_max = _segment_reduce(np.maximum, abs_intervals, offsets)
+    abs_min = _segment_reduce(np.minimum, abs_intervals, offsets)
+    abs_mean, abs_std = _segment_mean_std(abs_intervals, offsets)
+    return dict(
+        abs_interval_range=_integer_if_complete(np.where(lengths > 1, abs_max - abs_min, np.nan), intervals.dtype),
+        mean_abs_interval=abs_mean,
+        std_abs_interval=abs_std,
+        # Per Mullensiefen (2009), we use a different value for normalizing interval entropy here
+        interval_entropy=batch_normalized_entropy(intervals, offsets, norm=23),
+        modal_interval=batch_modal_interval(intervals, offsets)
+    )
+
+
+def batch_modal_interval(intervals: np.ndarray, offsets: np.ndarray) -> np.ndarray:
+    """Calculates `IntervalExtractor.modal_interval` for every chunk in a ragged batch of intervals at once
+
+    Returns integers when every chunk has at least one interval, otherwise floats with NaN for chunks without intervals
+    """
+    n_chunks = len(offsets) - 1
+    res = np.full(n_chunks, np.nan)
+    if len(intervals) == 0:
+        return res
+    # Get the frequency and first occurrence of every interval in every chunk
+    ids = _segment_ids(offsets)
+    keys, first, counts = np.unique(
+        np.column_stack([ids, intervals]), axis=0, return_index=True, return_counts=True
+    )
+    # For every chunk, get the most frequent interval, then the largest absolute interval, then the first to appear
+    order = np.lexsort((first, -np.abs(keys[:, 1]), -counts, keys[:, 0]))
+    keys = keys[order]
+    is_first = np.ones(len(keys), dtype=bool)
+    is_first[1:] = keys[1:, 0] != keys[:-1, 0]
+    res[keys[is_first, 0]] = keys[is_first, 1]
+    # Intervals are whole numbers of semitones, so return integers (as with `modal_interval`) unless any are missing
+    return res if np.isnan(res).any() else res.astype(np.int64)
+
+
+def _get_contour_lookup() -> np.ndarray:
+    """Gets the Huron contour for every combination of the signs of (mean - first) and (last - mean) pitches"""
+    lookup = np.empty((3, 3), dtype=object)
+    for first_sign in [-1, 0, 1]:
+        for last_sign in [-1, 0, 1]:
+            names = [k for k, func in HURON_CONTOURS.items() if func(0, first_sign, first_sign + last_sign)]
+            lookup[first_sign + 1, last_sign + 1] = names[0]
+    return lookup
+
+
+def contour_kernel(pitches: np.ndarray, offsets: np.ndarray) -> dict[str, np.ndarray]:
+    """Calculates the features in `ContourExtractor` for every chunk in a ragged batch of pitches at once"""
+    lengths = np.diff(offsets)
+    valid = lengths > 0
+    huron_contour = np.full(len(lengths), None, dtype=object)
+    # Get the first and last pitch, and the mean of all pitches between the second and the third from last
+    starts, ends = offsets[:-1][valid], offsets[1:][valid]
+    first, last = pitches[starts].astype(float), pitches[ends - 1].astype(float)
+    cumsum = np.concatenate([[0.], np.cumsum(pitches, dtype=float)])
+    with np.errstate(invalid='ignore', divide='ignore'):
+        n_mean = ends - starts - 3
+        mean = np.where(n_mean > 0, (cumsum[np.maximum(ends - 2, starts + 1)] - cumsum[starts + 1]) / n_mean, np.nan)
+    # When we can't calculate a mean, we can't get a contour
+    has_mean = ~np.isnan(mean)
+    first_sign, last_sign = np.sign(mean - first)[has_mean], np.sign(last - mean)[has_mean]
+    contours = huron_contour[valid]
+    contours[has_mean] = _get_contour_lookup()[first_sign.astype(int) + 1, last_sign.astype(int) + 1]
+    huron_contour[valid] = contours
+    return dict(huron_contour=huron_contour)
 
 
 def normalized_entropy(
@@ -173,7 +405,8 @@ if __name__ == '__main__':
     fp = f'{utils.get_project_root()}\data\cambridge-jazz-trio-database-v01\corpus_chronology\evansb-ttttwelvetonetune-gomezemorellm-1971-360d7a67'
     track = utils.load_annotations_from_files(fp)
     maker = MelodyMaker(fp + '\piano_midi.mid', track)
-    # Create our MelodyChunkManager for each feature we want to extract and convert to a single dictionary
-    mel_list = [MelodyChunkManager(feature, maker) for feature in __all__]
-    mel_features = {k: v for d in mel_list for k, v in d.summary_dict.items()}
+    # Apply every feature we want to extract to the same chunks of melody, and convert to a single dictionary
+    mel_features = MultiMelodyChunkManager(
+        [PitchExtractor, IntervalExtractor, ContourExtractor, TonalityExtractor], maker
+    ).summary_dict
     print(mel_features)
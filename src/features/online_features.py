@@ -0,0 +1,521 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Online versions of rhythmic feature extractors, updated incrementally as new onsets and beats arrive.
+
+Every extractor in `rhythm_features.py` takes the complete arrays of onsets and beats for a track when it is created.
+The extractors in this module instead start empty and are updated with `update(new_onsets, new_beats)` every time a new
+chunk of a performance is processed (e.g. when monitoring a live recording). Features can be obtained at any point with
+`summary()`, which returns a dictionary with the same keys as the `summary_dict` of the equivalent batch extractor.
+
+Features are backed by running accumulators (Welford's algorithm for moments, and recursive least squares for
+regression models), so the cost of each update depends only on the size of the new chunk, not on how much of the
+performance has already been processed. Statistics that require every value to be stored (e.g. quantiles) are not
+available, except for the median of the rolling standard deviation in `OnlineRollingIOISummaryStats`.
+
+Chunks are assumed to arrive in chronological order, such that every onset and beat up to the last time contained in a
+chunk has been received once that chunk has been passed to `update`. Features that depend on a window of time (e.g.
+between two beats) are calculated once something has been received after the end of the window, or when `update` is
+called with `final=True` for the last chunk of a performance.
+
+"""
+
+import heapq
+from collections import Counter
+
+import numpy as np
+import pandas as pd
+
+from src import utils
+from src.features.features_utils import get_window_bounds, rolling_summary_statistics
+from src.features.rhythm_features import BeatUpbeatRatio, bur_kernel
+
+__all__ = [
+    "RunningMoments", "RunningMedian", "RecursiveLeastSquares", "OnlineBeatUpbeatRatio", "OnlineIOISummaryStats",
+    "OnlineRollingIOISummaryStats", "OnlineAsynchrony", "OnlinePhaseCorrection"
+]
+
+
+def _clean(arr) -> np.ndarray:
+    """Sorts an array and removes missing values"""
+    arr = np.sort(np.asarray(arr, dtype=float).ravel())
+    return arr[~np.isnan(arr)]
+
+
+class RunningMoments:
+    """Running count, mean, and variance of a stream of values, which may contain NaN values.
+
+    Each chunk of values is combined with the existing moments using the parallel form of Welford's algorithm (Chan et
+    al., 1979), so values never need to be stored. NaN values are included in `count` but not in any other statistic,
+    following `len` and the NaN-aware functions in numpy.
+
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.n = 0
+        self._mean = 0.
+        self._m2 = 0.
+
+    def update(self, values) -> None:
+        """Adds every value in `values` to the running moments"""
+        values = np.asarray(values, dtype=float).ravel()
+        self.count += len(values)
+        values = values[~np.isnan(values)]
+        n_new = len(values)
+        if n_new == 0:
+            return
+        mean_new = values.mean()
+        m2_new = ((values - mean_new) ** 2).sum()
+        n = self.n + n_new
+        delta = mean_new - self._mean
+        self._mean += delta * n_new / n
+        self._m2 += m2_new + delta ** 2 * self.n * n_new / n
+        self.n = n
+
+    @property
+    def mean(self) -> float:
+        """The mean of every non-NaN value, equivalent to `np.nanmean`"""
+        return self._mean if self.n > 0 else np.nan
+
+    @property
+    def sum_squares(self) -> float:
+        """The sum of the square of every non-NaN value"""
+        return self._m2 + self.n * self._mean ** 2
+
+    def var(self, ddof: int = 0) -> float:
+        """The variance of every non-NaN value, equivalent to `np.nanvar`"""
+        return self._m2 / (self.n - ddof) if self.n - ddof > 0 else np.nan
+
+    def std(self, ddof: int = 0) -> float:
+        """The standard deviation of every non-NaN value, equivalent to `np.nanstd`"""
+        return np.sqrt(self.var(ddof))
+
+    def summary(self, name: str) -> dict:
+        """Returns the running statistics with the same keys as `BaseExtractor.update_summary_dict`"""
+        return {
+            f'{name}_mean': self.mean,
+            f'{name}_std': self.std(),
+            f'{name}_var': self.var(),
+            f'{name}_count': self.count,
+            f'{name}_count_nonzero': self.n
+        }
+
+
+class RunningMedian:
+    """Running median of a stream of non-NaN values, using two heaps with O(log n) updates"""
+
+    def __init__(self):
+        # `_low` is a max-heap (of negated values) holding the smaller half of the values, `_high` the larger half
+        self._low, self._high = [], []
+
+    def update(self, values) -> None:
+        """Adds every non-NaN value in `values` to the heaps, keeping them balanced"""
+        for val in np.asarray(values, dtype=float).ravel():
+            if np.isnan(val):
+                continue
+            if len(self._low) == 0 or val <= -self._low[0]:
+                heapq.heappush(self._low, -val)
+            else:
+                heapq.heappush(self._high, val)
+            # The lower half should either have the same number of values as the upper half, or one more
+            if len(self._low) > len(self._high) + 1:
+                heapq.heappush(self._high, -heapq.heappop(self._low))
+            elif len(self._high) > len(self._low):
+                heapq.heappush(self._low, -heapq.heappop(self._high))
+
+    @property
+    def median(self) -> float:
+        """The median of every value, equivalent to `np.nanmedian`"""
+        if len(self._low) == 0:
+            return np.nan
+        elif len(self._low) > len(self._high):
+            return -self._low[0]
+        return (-self._low[0] + self._high[0]) / 2
+
+
+class RecursiveLeastSquares:
+    """Ordinary least squares regression, updated one observation at a time with recursive least squares (RLS).
+
+    Observations are accumulated into the normal equations until `X'X` has full rank, at which point the parameters and
+    the inverse of `X'X` are initialised exactly. Every later observation then updates both with a rank-one
+    (Sherman-Morrison) update in O(k^2), for `k` parameters. The sum of squared residuals is updated recursively, so
+    parameters, standard errors, and fit statistics match a batch OLS fit of every observation (see `fit_ols`) up to
+    floating point error, without storing the data. Observations containing NaN values are skipped.
+
+    Arguments:
+        n_params (int): the number of parameters in the model, including the intercept (if one is used)
+
+    """
+
+    def __init__(self, n_params: int):
+        self.n_params = n_params
+        self.nobs = 0
+        self.params = None
+        self.cov = None
+        self.ssr = np.nan
+        # The normal equations, used until we have enough observations to initialise the parameters
+        self._xtx = np.zeros((n_params, n_params))
+        self._xty = np.zeros(n_params)
+        self._yty = 0.
+
+    def update(self, exog: np.ndarray, endog: np.ndarray) -> None:
+        """Adds every row of `exog` (with the matching value in `endog`) to the model, skipping rows with NaN values"""
+        exog = np.atleast_2d(np.asarray(exog, dtype=float))
+        endog = np.asarray(endog, dtype=float).ravel()
+        valid = np.isfinite(exog).all(axis=1) & np.isfinite(endog)
+        for x, y in zip(exog[valid], endog[valid]):
+            self.nobs += 1
+            if self.params is None:
+                self._xtx += np.outer(x, x)
+                self._xty += x * y
+                self._yty += y * y
+                # Initialise the parameters exactly, as soon as the normal equations can be solved
+                if self.nobs >= self.n_params and np.linalg.matrix_rank(self._xtx) == self.n_params:
+                    self.cov = np.linalg.inv(self._xtx)
+                    self.params = self.cov @ self._xty
+                    self.ssr = max(self._yty - self.params @ self._xty, 0.)
+            else:
+                px = self.cov @ x
+                denom = 1 + x @ px
+                # The prediction error using the current parameters, before they are updated
+                err = y - x @ self.params
+                gain = px / denom
+                self.params = self.params + gain * err
+                self.cov = self.cov - np.outer(gain, px)
+                self.ssr += err * err / denom
+
+    @property
+    def df_resid(self) -> int:
+        """The residual degrees of freedom"""
+        return self.nobs - self.n_params
+
+    @property
+    def bse(self) -> np.ndarray:
+        """The standard error of every parameter"""
+        if self.params is None or self.df_resid <= 0:
+            return np.full(self.n_params, np.nan)
+        return np.sqrt(np.diag(self.cov) * self.ssr / self.df_resid)
+
+
+class OnlineBeatUpbeatRatio:
+    """Online version of `BeatUpbeatRatio`, updated with new onsets and crotchet beats (e.g. matched to the onsets).
+
+    A BUR is calculated for every pair of consecutive beats once the second beat has passed, i.e. once a later beat or
+    onset has been received, using `bur_kernel`. Only the onsets from the earliest pair of beats without a BUR onwards
+    are kept between updates.
+
+    Arguments:
+        clean_outliers (bool, optional): whether to set BURs outside the thresholds to NaN, defaults to True
+
+    """
+
+    def __init__(self, clean_outliers: bool = True):
+        self.clean_outliers = clean_outliers
+        self.bur = RunningMoments()
+        self.bur_log = RunningMoments()
+        self.n_beats = 0
+        self._onsets = np.array([], dtype=float)
+        self._beats = np.array([], dtype=float)
+
+    def update(self, new_onsets: np.array, new_beats: np.array, final: bool = False) -> None:
+        """Adds new onsets and beats, and updates the running statistics with the BUR for every completed beat"""
+        new_beats = np.asarray(new_beats, dtype=float).ravel()
+        self.n_beats += len(new_beats)
+        self._onsets = np.sort(np.concatenate([self._onsets, _clean(new_onsets)]))
+        self._beats = np.concatenate([self._beats, new_beats])
+        if len(self._beats) < 2:
+            return
+        # We know we have every onset for a pair of beats once we've received anything after the second beat
+        horizon = np.nanmax(np.concatenate([self._onsets[-1:], self._beats]))
+        n_done = len(self._beats) - 1 if final or self._beats[-1] < horizon else len(self._beats) - 2
+        if n_done <= 0:
+            return
+        burs, burs_log, outliers = bur_kernel(
+            self._onsets, self._beats[:n_done + 1], BeatUpbeatRatio.LOW_THRESH, BeatUpbeatRatio.HIGH_THRESH
+        )
+        # The final value is for the last beat, which we'll calculate once we have the next beat
+        burs, burs_log, outliers = burs[:-1], burs_log[:-1], outliers[:-1]
+        if self.clean_outliers:
+            burs[outliers] = np.nan
+            burs_log[outliers] = np.nan
+        self.bur.update(burs)
+        self.bur_log.update(burs_log)
+        # Drop any onsets before the first beat we haven't calculated a BUR for yet
+        self._beats = self._beats[n_done:]
+        remaining = self._beats[~np.isnan(self._beats)]
+        if len(remaining) > 0:
+            self._onsets = self._onsets[np.searchsorted(self._onsets, remaining[0], side='left'):]
+
+    def summary(self) -> dict:
+        """Returns the running statistics for raw and log2 BURs"""
+        res = {**self.bur.summary('bur'), **self.bur_log.summary('bur_log')}
+        # As with `BeatUpbeatRatio`, the count includes every beat, even those without a BUR
+        res['bur_count'] = res['bur_log_count'] = self.n_beats
+        return res
+
+
+class OnlineIOISummaryStats:
+    """Online version of `IOISummaryStats`, updated with new onsets.
+
+    Inter-onset intervals are obtained from the difference between consecutive onsets (including the last onset from
+    the previous update), as in `pd.Series.diff`. Alongside the running moments, the nPVI is obtained from a running sum
+    of the pairwise variability between consecutive IOIs, and the binary entropy from a running count of every IOI (in
+    milliseconds). Lempel-Ziv complexity requires the mean of every IOI in advance, so is not available online.
+
+    Arguments:
+        use_bpms (bool, optional): convert IOIs into beat-per-minute values, i.e. 60 / IOI (defaults to False)
+
+    """
+
+    def __init__(self, use_bpms: bool = False):
+        self.use_bpms = use_bpms
+        self.name = 'bpms' if use_bpms else 'iois'
+        self.moments = RunningMoments()
+        self._last_onset = np.nan
+        self._last_ioi = np.nan
+        self._pvi_sum = 0.
+        self._n_pvi = 0
+        self._ms_counts = Counter()
+        self._non_finite = False
+
+    def update(self, new_onsets: np.array, new_beats: np.array = None, final: bool = False) -> None:
+        """Adds new onsets, and updates the running statistics with the IOIs between them"""
+        new_onsets = np.asarray(new_onsets, dtype=float).ravel()
+        if len(new_onsets) == 0:
+            return
+        # The first IOI for the track is missing, as there is no previous onset
+        iois = np.diff(np.concatenate([[self._last_onset], new_onsets]))
+        self._last_onset = new_onsets[-1]
+        if self.use_bpms:
+            with np.errstate(divide='ignore'):
+                iois = 60 / iois
+        self.moments.update(iois)
+        valid = iois[~np.isnan(iois)]
+        if len(valid) == 0:
+            return
+        # The nPVI uses every pair of consecutive non-NaN IOIs, including the last IOI from the previous update
+        pairs = np.concatenate([[self._last_ioi], valid]) if not np.isnan(self._last_ioi) else valid
+        with np.errstate(divide='ignore', invalid='ignore'):
+            pvi = np.abs((pairs[:-1] - pairs[1:]) / ((pairs[:-1] + pairs[1:]) / 2))
+        self._pvi_sum += pvi.sum()
+        self._n_pvi += len(pvi)
+        self._last_ioi = valid[-1]
+        # Binary entropy uses the count of every IOI, in milliseconds
+        ms = valid * 1000
+        if not np.isfinite(ms).all():
+            self._non_finite = True
+        else:
+            self._ms_counts.update(ms.astype(int).tolist())
+
+    def binary_entropy(self) -> float:
+        """The Shannon entropy of every IOI in milliseconds, as in `IOISummaryStats.binary_entropy`"""
+        total = sum(self._ms_counts.values())
+        if self._non_finite or total == 0:
+            return np.nan
+        probabilities = np.array(list(self._ms_counts.values())) / total
+        return -np.sum(probabilities * np.log2(probabilities))
+
+    def npvi(self) -> float:
+        """The normalised pairwise variability index, as in `IOISummaryStats.npvi`"""
+        return self._pvi_sum * 100 / self._n_pvi if self._n_pvi > 0 else np.nan
+
+    def summary(self) -> dict:
+        """Returns the running statistics for every IOI"""
+        return {
+            **self.moments.summary(self.name),
+            f'{self.name}_binary_entropy': self.binary_entropy(),
+            f'{self.name}_npvi': self.npvi()
+        }
+
+
+class OnlineRollingIOISummaryStats:
+    """Online version of `RollingIOISummaryStats` for tempo stability, updated with new onsets and downbeats.
+
+    The standard deviation of the IOIs within every window of `order` bars is calculated once the final downbeat of the
+    window has passed, using `rolling_summary_statistics`. The running moments and median of these standard deviations
+    are then updated. Only the onsets from the earliest incomplete window onwards are kept between updates.
+
+    Arguments:
+        order (int, optional): the number of bars in each window, defaults to 4
+
+    """
+
+    def __init__(self, order: int = 4):
+        self.order = order
+        self.moments = RunningMoments()
+        self.median = RunningMedian()
+        self._onsets = np.array([], dtype=float)
+        self._downbeats = np.array([], dtype=float)
+
+    def update(self, new_onsets: np.array, new_beats: np.array, final: bool = False) -> None:
+        """Adds new onsets and downbeats (passed as `new_beats`), and updates statistics for every complete window"""
+        self._onsets = np.sort(np.concatenate([self._onsets, _clean(new_onsets)]))
+        self._downbeats = np.concatenate([self._downbeats, np.asarray(new_beats, dtype=float).ravel()])
+        n_windows = len(self._downbeats) - self.order
+        if n_windows <= 0:
+            return
+        # We know we have every onset for a window once we've received anything after its final downbeat
+        horizon = np.nanmax(np.concatenate([self._onsets[-1:], self._downbeats]))
+        n_done = n_windows if final or self._downbeats[-1] < horizon else n_windows - 1
+        if n_done <= 0:
+            return
+        lo, hi = get_window_bounds(
+            self._onsets, self._downbeats[:n_done], self._downbeats[self.order:self.order + n_done]
+        )
+        # The IOIs in each window run from its first onset up to one before its last onset
+        iois = np.diff(self._onsets)
+        lo = np.minimum(lo, len(iois))
+        stds = rolling_summary_statistics(iois, lo, np.maximum(hi - 1, lo))['std']
+        self.moments.update(stds)
+        self.median.update(stds)
+        # Drop any onsets before the first window we haven't calculated statistics for yet
+        self._downbeats = self._downbeats[n_done:]
+        remaining = self._downbeats[~np.isnan(self._downbeats)]
+        if len(remaining) > 0:
+            self._onsets = self._onsets[np.searchsorted(self._onsets, remaining[0], side='left'):]
+
+    def summary(self) -> dict:
+        """Returns the running statistics for the standard deviation of IOIs in every window"""
+        return {
+            'bar_period': self.order,
+            **self.moments.summary('rolling_std'),
+            'rolling_std_median': self.median.median
+        }
+
+
+class OnlineAsynchrony:
+    """Online version of `Asynchrony`, updated with the onsets of every instrument matched to new beats.
+
+    Pairwise asynchronization, groupwise asynchronization, and mean absolute and signed asynchrony are all obtained from
+    running moments of the asynchronies (and their absolute values) between `my_instr` and each partner instrument.
+
+    Arguments:
+        my_instr (str): the instrument to calculate asynchrony for
+
+    """
+
+    def __init__(self, my_instr: str):
+        self.my_instr = my_instr
+        self.partners = [i for i in utils.INSTRUMENTS_TO_PERFORMER_ROLES.keys() if i != my_instr]
+        self.moments = {partner: RunningMoments() for partner in self.partners}
+        self.abs_moments = {partner: RunningMoments() for partner in self.partners}
+        self.relative_moments = RunningMoments()
+
+    def update(self, new_onsets: pd.DataFrame, new_beats: np.array = None, final: bool = False) -> None:
+        """Adds the onsets matched to new beats, with one column for every instrument and one row for every beat"""
+        my_beats = new_onsets[self.my_instr].to_numpy(dtype=float)
+        for partner in self.partners:
+            # Calculate asynchrony: my_onset - partner_onset
+            asynchronies = my_beats - new_onsets[partner].to_numpy(dtype=float)
+            self.moments[partner].update(asynchronies)
+            self.abs_moments[partner].update(np.abs(asynchronies))
+        # Relative asynchrony only uses beats marked by every instrument
+        group = new_onsets[[self.my_instr, *self.partners]].to_numpy(dtype=float)
+        group = group[~np.isnan(group).any(axis=1)]
+        self.relative_moments.update(group[:, 0] - group.mean(axis=1))
+
+    def summary(self) -> dict:
+        """Returns the running statistics for asynchrony with every partner instrument"""
+        res = {}
+        for instr in utils.INSTRUMENTS_TO_PERFORMER_ROLES.keys():
+            # We can't have asynchrony to our own performance, so these remain NaN
+            if instr == self.my_instr:
+                continue
+            moments = self.moments[instr]
+            with np.errstate(invalid='ignore', divide='ignore'):
+                groupwise = np.sqrt(moments.sum_squares) / moments.n if moments.n > 0 else 0.
+            res.update({
+                **moments.summary(f'{instr}_async'),
+                f'{instr}_async_pairwise_asynchronization': moments.std(ddof=1),
+                f'{instr}_async_groupwise_asynchronization': groupwise,
+                f'{instr}_async_mean_absolute_asynchrony': self.abs_moments[instr].mean,
+                f'{instr}_async_mean_pairwise_asynchrony': moments.mean,
+            })
+        res['mean_relative_asynchrony'] = self.relative_moments.mean
+        return res
+
+
+class OnlinePhaseCorrection:
+    """Online version of `PhaseCorrection`, updated with the onsets of every instrument matched to new beats.
+
+    The model is the same as `PhaseCorrection` with default arguments: the next (differenced) IOI of `my_instr` is
+    predicted from its previous (differenced) IOIs and the asynchronies of each partner instrument, with `order` lags
+    of each. Only the last few beats are kept between updates, in order to calculate lagged and differenced values for
+    the next update. The model is fitted with `RecursiveLeastSquares`, so coefficients remain NaN until there are at
+    least as many observations as parameters (where `PhaseCorrection` would instead return the minimum-norm solution).
+
+    Arguments:
+        my_instr (str): the instrument to model
+        order (int, optional): the order of the model, defaults to 1 (i.e. 1st-order model, no lagged terms)
+
+    """
+
+    def __init__(self, my_instr: str, order: int = 1):
+        self.my_instr = my_instr
+        self.order = order
+        self.partners = [i for i in utils.INSTRUMENTS_TO_PERFORMER_ROLES.keys() if i != my_instr]
+        # Parameters are the intercept, then every lag of my previous IOIs, then every lag of each partner's asynchrony
+        self.model = RecursiveLeastSquares(1 + order * (1 + len(self.partners)))
+        self.endog = RunningMoments()
+        # Differencing twice and lagging requires this many previous beats, plus the beat we need the next IOI for
+        self._n_history = order + 2
+        self._history = np.empty((0, 1 + len(self.partners)))
+
+    def update(self, new_onsets: pd.DataFrame, new_beats: np.array = None, final: bool = False) -> None:
+        """Adds the onsets matched to new beats, with one column for every instrument and one row for every beat"""
+        new = new_onsets[[self.my_instr, *self.partners]].to_numpy(dtype=float)
+        if len(new) == 0:
+            return
+        n_prev = len(self._history)
+        data = np.concatenate([self._history, new])
+        my_beats = data[:, 0]
+        # My previous inter-onset intervals, differenced, as in `PhaseCorrection.get_model_inputs`
+        iois = np.concatenate([[np.nan], np.diff(my_beats)])
+        prev_iois = np.concatenate([[np.nan], np.diff(iois)])
+        # In the phase correction model, the asynchrony terms are partner_onset - my_onset
+        asynchronies = data[:, 1:] - my_beats[:, None]
+        # We can now get the next IOI for every beat apart from the last one, which we'll do in the next update
+        rows = np.arange(max(n_prev - 1, 0), len(data) - 1)
+        exog = [np.ones(len(rows))]
+        exog.extend(np.where(rows - lag >= 0, prev_iois[rows - lag], np.nan) for lag in range(self.order))
+        for col in range(asynchronies.shape[1]):
+            exog.extend(np.where(rows - lag >= 0, asynchronies[rows - lag, col], np.nan) for lag in range(self.order))
+        exog = np.column_stack(exog)
+        endog = prev_iois[rows + 1]
+        valid = np.isfinite(exog).all(axis=1) & np.isfinite(endog)
+        self.model.update(exog[valid], endog[valid])
+        self.endog.update(endog[valid])
+        # Keep only the beats we'll need for the next update
+        self._history = data[-self._n_history:]
+
+    def summary(self) -> dict:
+        """Returns the coefficients and fit statistics of the model"""
+        res = dict(phase_correction_order=self.order, phase_correction_lag=0)
+        model = self.model
+        params = model.params if model.params is not None else np.full(model.n_params, np.nan)
+        # Coefficients for the first lag of every partner's asynchrony, in instrument order
+        for instr in utils.INSTRUMENTS_TO_PERFORMER_ROLES.keys():
+            if instr in self.partners:
+                res[f'coupling_{instr}'] = params[1 + self.order * (1 + self.partners.index(instr))]
+            else:
+                res[f'coupling_{instr}'] = np.nan
+        res['self_coupling'] = params[1]
+        res['intercept'] = params[0]
+        # Fit statistics remain NaN until the model has been initialised, see `RecursiveLeastSquares`
+        nobs = np.float64(model.nobs)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            rsquared = 1 - model.ssr / (self.endog.var() * self.endog.n)
+            # The log-likelihood and information criteria are calculated in the same way as `OLSResults`
+            llf = -nobs / 2 * (np.log(2 * np.pi) + np.log(model.ssr / nobs) + 1)
+            res.update(
+                resid_std=np.sqrt(model.ssr / nobs),
+                resid_len=model.nobs,
+                nobs=nobs,
+                rsquared=rsquared,
+                rsquared_adj=1 - (nobs - 1) / model.df_resid * (1 - rsquared),
+                aic=-2 * llf + 2 * model.n_params,
+                bic=-2 * llf + np.log(nobs) * model.n_params,
+                llf=llf
+            )
+        return res
@@ -5,24 +5,24 @@
 
 import string
 import warnings
-from functools import reduce
-from itertools import pairwise
 from typing import Generator
 
+import numba as nb
 import numpy as np
 import pandas as pd
 import scipy.stats as stats
-import statsmodels.api as sm
-from statsmodels.regression.linear_model import RegressionResultsWrapper
 
 from src import utils
-from src.features.features_utils import BaseExtractor
+from src.features.features_utils import (
+    BaseExtractor, BeatGrid, FeatureContext, OLSResults, fit_ols, fit_ols_batch, get_window_bounds,
+    rolling_summary_statistics, summary_statistics
+)
 
 
 __all__ = [
     "PhaseCorrection", "BeatUpbeatRatio", "IOIComplexity", "TempoSlope",
     "ProportionalAsynchrony", "RollingIOISummaryStats", "Asynchrony",
-    "get_beats_from_matched_onsets"
+    "get_beats_from_matched_onsets", "asynchrony_kernel", "lagged_correlations"
 ]
 
 
@@ -68,12 +68,16 @@ class IOISummaryStats(BaseExtractor):
         self.update_summary_dict([name], [iois])
 
     @staticmethod
-    def binary_entropy(iois: pd.Series) -> float:
+    def binary_entropy(iois: pd.Series | np.ndarray) -> float:
         """Extract the Shannon entropy from an iterable"""
+        iois = np.asarray(iois, dtype=float)
         # We convert our IOIs into milliseconds here to prevent floating point numbers
-        ms_arr = (iois * 1000).dropna().astype(int).to_numpy()
+        ms_arr = iois[~np.isnan(iois)] * 1000
+        # Infinite values (e.g. BPMs from duplicate onsets) can't be converted to integers
+        if not np.isfinite(ms_arr).all():
+            raise ValueError('Cannot convert non-finite values to integer')
         # Get the counts and probabilities of our individual IOIs
-        _, counts = np.unique(ms_arr, return_counts=True)
+        _, counts = np.unique(ms_arr.astype(int), return_counts=True)
         probabilities = counts / len(ms_arr)
         # Calculate the entropy and return
         return -np.sum(probabilities * np.log2(probabilities))
@@ -81,171 +85,434 @@ class IOISummaryStats(BaseExtractor):
         # return stats.entropy((ioi * 1000).dropna().astype(int).value_counts().squeeze(), base=2)
 
     @staticmethod
-    def npvi(iois: pd.Series) -> float:
+    def npvi(iois: pd.Series | np.ndarray) -> float:
         """Extract the normalised pairwise variability index (nPVI) from an iterable"""
         # Drop NaN values and convert array to Numpy
-        dat = iois.dropna().to_numpy()
+        dat = np.asarray(iois, dtype=float)
+        dat = dat[~np.isnan(dat)]
         # If we only have one element in our array after dropping NaN values, we can't calculate nPVI, so return NaN
         if len(dat) <= 1:
             return np.nan
         # Otherwise, we can go ahead and return the nPVI value for the array
-        return sum([abs((k - k1) / ((k + k1) / 2)) for (k, k1) in zip(dat, dat[1:])]) * 100 / (sum(1 for _ in dat) - 1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            pvi = np.abs((dat[:-1] - dat[1:]) / ((dat[:-1] + dat[1:]) / 2))
+        # We sum sequentially with `cumsum` (rather than pairwise with `sum`) to match summing in pure Python
+        return np.cumsum(pvi)[-1] * 100 / (len(dat) - 1)
 
     @staticmethod
-    def lempel_ziv_complexity(iois: pd.Series) -> float:
+    def lempel_ziv_complexity(iois: pd.Series | np.ndarray) -> float:
         """Extract complexity from a binary sequence using Lempel-Ziv compression algorithm,"""
-        def lz(binary: np.array) -> int:
-            """Function code for Lempel-Ziv compression algorithm"""
-            # Convert our sequence into binary: values below mean = 0, above mean = 1
-            # Set starting values for complexity calculation
-            u, v, w = 0, 1, 1
-            v_max, complexity = 1, 1
-            # Begin calculating LZ complexity
-            while True:
-                if binary[u + v - 1] == binary[w + v - 1]:
-                    v += 1
-                    if w + v >= len(binary):
-                        complexity += 1
-                        break
-                else:
-                    if v > v_max:
-                        v_max = v
-                    u += 1
-                    if u == w:
-                        complexity += 1
-                        w += v_max
-                        if w > len(binary):
-                            break
-                        else:
-                            u = 0
-                            v = 1
-                            v_max = 1
-                    else:
-                        v = 1
-            return complexity
-
-        # Try and convert our sequence to binary
-        try:
-            binary_sequence = np.vectorize(lambda x: int(x > np.nanmean(iois)))(iois[~np.isnan(iois)])
-        # If we only have NaNs in our array we'll raise an error, so catch this and return NaN
-        except ValueError:
-            return np.nan
+        iois = np.asarray(iois, dtype=float)
+        clean = iois[~np.isnan(iois)]
         # We need a sequence with at least 3 items in to calculate LZ complexity, so catch this and return NaN
+        if len(clean) < 3:
+            return np.nan
+        # Convert our sequence into binary: values below mean = 0, above mean = 1
+        binary_sequence = (clean > np.nanmean(iois)).astype(np.int64)
+        # If we've passed all these checks, we should be able to calculate LZ complexity; do so now and return
+        complexity = _lempel_ziv_76(binary_sequence)
+        # The algorithm can try to compare past the end of some sequences, in which case we can't get a value
+        if complexity < 0:
+            raise IndexError('index out of bounds when calculating Lempel-Ziv complexity')
+        return complexity
+
+
+@nb.jit(nopython=True)
+def _lempel_ziv_76(binary: np.ndarray) -> int:
+    """Function code for Lempel-Ziv compression algorithm, compiled with numba. Returns -1 if indexing out of bounds"""
+    n = len(binary)
+    # Set starting values for complexity calculation
+    u, v, w = 0, 1, 1
+    v_max, complexity = 1, 1
+    # Begin calculating LZ complexity
+    while True:
+        # numba doesn't check bounds, so we need to do this ourselves
+        if w + v - 1 >= n:
+            return -1
+        if binary[u + v - 1] == binary[w + v - 1]:
+            v += 1
+            if w + v >= n:
+                complexity += 1
+                break
         else:
-            if len(binary_sequence) < 3:
-                return np.nan
-            # If we've passed all these checks, we should be able to calculate LZ complexity; do so now and return
+            if v > v_max:
+                v_max = v
+            u += 1
+            if u == w:
+                complexity += 1
+                w += v_max
+                if w > n:
+                    break
+                else:
+                    u = 0
+                    v = 1
+                    v_max = 1
             else:
-                return lz(binary_sequence)
+                v = 1
+    return complexity
 
 
 class RollingIOISummaryStats(IOISummaryStats):
     """Extracts the statistics in `IOISummaryStatsExtractor` on a rolling basis, window defaults to 4 bars length"""
 
     def __init__(self, my_onsets: pd.Series, downbeats, order: int = 4, **kwargs):
-        super().__init__(my_onsets=my_onsets, **kwargs)
-        if isinstance(my_onsets, np.ndarray):
-            my_onsets = pd.Series(my_onsets)
-        self.summary_dict.clear()
+        # We don't need the summary statistics for the whole track, so skip calculating them in `IOISummaryStats`
+        BaseExtractor.__init__(self)
         # TODO: implement a time-based window here!
         self.bar_period = order
         # We get our raw rolling statistics here
-        self.rolling_statistics = self.extract_rolling_statistics(my_onsets, downbeats, **kwargs)
-        # We redefine summary_funcs here, as we want to remove extra functions added in `IOISummaryStatsExtractor`
-        self.summary_funcs = BaseExtractor().summary_funcs
+        self.rolling_statistics = self.extract_rolling_statistics_multi(
+            my_onsets, downbeats, bar_periods=[order], **kwargs
+        )[order]
         # Update the summary dictionary
         self.summary_dict['bar_period'] = order
         self.update_summary_dict(self.rolling_statistics.keys(), self.rolling_statistics.values())
 
+    @classmethod
+    def from_grid(cls, grid: BeatGrid, instr: str, order: int = 4, matched: bool = False, **kwargs):
+        """Creates the extractor from a `BeatGrid`, reusing its bar windows for the onsets of `instr`
+
+        Arguments:
+            grid (BeatGrid): the beat grid for the track
+            instr (str): the instrument to extract features for
+            order (int, optional): the number of bars in each window, defaults to 4
+            matched (bool, optional): use onsets matched to the beats, rather than raw onsets, defaults to False
+            **kwargs: keyword arguments passed to `RollingIOISummaryStats`
+
+        """
+        return cls(
+            grid.get_onsets(instr, matched), grid.downbeats, order=order,
+            window_bounds={order: grid.get_bar_bounds(instr, order, matched)}, iois=grid.get_iois(instr, matched),
+            **kwargs
+        )
+
     def extract_rolling_statistics(self, my_onsets: pd.Series, downbeats: np.array, **kwargs) -> dict:
         """Extract rolling summary statistics across the given bar period"""
-        results = {f'rolling_{func_k}': [] for func_k in self.summary_funcs.keys()}
-        for bar_num, (i1, i2) in enumerate(zip(downbeats, downbeats[self.bar_period:]), 1):
-            iois_between = pd.Series(self.get_between(my_onsets.values, i1, i2)).diff()
-            # Divide 60 / IOI if we want to use BPM values instead
-            if kwargs.get('use_bpms', False):
-                iois_between = 60 / iois_between
-            # Filter our IOIs using an IQR filter, if required
-            if kwargs.get('iqr_filter', False):
-                iois_between = utils.iqr_filter(iois_between, fill_nans=True)
-            # Iterate through each of our summary functions
-            for func_k, func_v in self.summary_funcs.items():
-                # Try and apply the summary function to the IOIs, and return NaN on an error
-                try:
-                    results[f'rolling_{func_k}'].append(func_v(iois_between))
-                # These are all the errors that can result from our summary functions with NaN arrays
-                except (IndexError, ValueError, ZeroDivisionError):
-                    results[f'rolling_{func_k}'].append(np.nan)
-        return results
+        return self.extract_rolling_statistics_multi(
+            my_onsets, downbeats, bar_periods=[self.bar_period], **kwargs
+        )[self.bar_period]
+
+    @classmethod
+    def extract_rolling_statistics_multi(
+            cls,
+            my_onsets: pd.Series | np.ndarray,
+            downbeats: np.array,
+            bar_periods: list[int],
+            **kwargs
+    ) -> dict[int, dict]:
+        """Extract rolling summary statistics across several bar periods at once.
+
+        IOIs are calculated once for the whole track. The IOIs in each window are located with `np.searchsorted` on
+        the downbeats, and statistics are calculated with `rolling_summary_statistics`, rather than by creating a new
+        `pd.Series` for every window.
+
+        Arguments:
+            my_onsets (pd.Series | np.ndarray): onsets to compute rolling statistics for
+            downbeats (np.array): the position of downbeats
+            bar_periods (list[int]): the window sizes (in bars) to calculate rolling statistics for
+            **kwargs: `use_bpms` and `iqr_filter`, as in `IOISummaryStats`, `window_bounds`, a dictionary of
+                precomputed onset indices for each bar period (e.g. from `BeatGrid.get_bar_bounds`), and `iois`, the
+                precomputed IOIs between the sorted onsets (e.g. from `BeatGrid.get_iois`)
+
+        Returns:
+            dict[int, dict]: rolling statistics for every bar period, with one value per window for every function
+
+        """
+        ons = np.sort(np.asarray(my_onsets, dtype=float))
+        ons = ons[~np.isnan(ons)]
+        downbeats = np.asarray(downbeats, dtype=float)
+        iois = kwargs.get('iois', None)
+        if iois is None:
+            iois = np.diff(ons)
+        # Divide 60 / IOI if we want to use BPM values instead
+        if kwargs.get('use_bpms', False):
+            with np.errstate(divide='ignore'):
+                iois = 60 / iois
+        # In each window, IOIs are calculated by differencing the onsets, which gives a NaN value at the start
+        extra_funcs = {
+            func_k: cls._prepend_nan(func_v) for func_k, func_v in
+            [('binary_entropy', cls.binary_entropy), ('npvi', cls.npvi),
+             ('lempel_ziv_complexity', cls.lempel_ziv_complexity)]
+        }
+        window_bounds = kwargs.get('window_bounds', {})
+        res = {}
+        for bar_period in bar_periods:
+            n_windows = max(len(downbeats) - bar_period, 0)
+            # Get the first and last onset within each window, then the IOIs between these onsets
+            if bar_period in window_bounds:
+                lo, hi = window_bounds[bar_period]
+            else:
+                lo, hi = get_window_bounds(ons, downbeats[:n_windows], downbeats[bar_period:bar_period + n_windows])
+            n_onsets = hi - lo
+            # The IOIs in each window run from its first onset up to one before its last onset
+            lo = np.minimum(lo, len(iois))
+            stats = rolling_summary_statistics(
+                iois, lo, np.maximum(hi - 1, lo), iqr_filter=kwargs.get('iqr_filter', False), extra_funcs=extra_funcs
+            )
+            # The number of values in each window, including the first NaN value
+            stats['count'] = n_onsets
+            res[bar_period] = {
+                f'rolling_{func_k}': stats[func_k].tolist() for func_k in [
+                    'mean', 'median', 'std', 'var', 'quantile25', 'quantile75', 'count', 'count_nonzero',
+                    *extra_funcs.keys()
+                ]
+            }
+        return res
+
+    @staticmethod
+    def _prepend_nan(func):
+        """Wraps a summary function to prepend NaN to an array of IOIs and return NaN on an error"""
+        def wrapper(arr: np.ndarray) -> float:
+            try:
+                return func(np.concatenate([[np.nan], arr]))
+            # These are all the errors that can result from our summary functions with NaN arrays
+            except (IndexError, ValueError, ZeroDivisionError):
+                return np.nan
+        return wrapper
 
 
 class EventDensity(BaseExtractor):
     """Extract various features related to event density, on both a per-bar and per-second basis.
 
+    Several time and bar periods can be calculated at once by passing lists to `time_period` and `bar_period`. In this
+    case, `per_second` and `per_bar` are dictionaries of dataframes keyed by each period, and arrays in the summary
+    dictionary are named `ed_per_{time_period}_seconds` and `ed_per_{bar_period}_bars`.
+
     Args:
         my_onsets (pd.series): onsets to calculate event density for
         downbeats (np.array): array of times corresponding to the first beat of each bar
-        time_period (str, optional): the timeframe to calculate event density over, defaults to '1s' (one second)
-        bar_period (int, optional): the number of bars to calculate event density over, defaults to 1 (bar)
+        time_period (int | list[int], optional): the timeframe (in seconds) to calculate event density over, defaults
+            to 1 (second)
+        bar_period (int | list[int], optional): the number of bars to calculate event density over, defaults to 1 (bar)
 
     """
     def __init__(
             self,
             my_onsets: pd.Series,
             downbeats: np.array,
-            time_period: int = 1,
-            bar_period: int = 1
+            time_period: int | list[int] = 1,
+            bar_period: int | list[int] = 1,
+            **kwargs
     ):
         super().__init__()
-        if isinstance(my_onsets, np.ndarray):
-            my_onsets = pd.Series(my_onsets)
         # Set attributes
-        self.time_period = f'{time_period}s'
+        self.time_period = time_period
         self.bar_period = bar_period
-        # Extract event density
-        self.per_second = self.extract_ed_per_second(my_onsets)
-        self.per_bar = self.extract_ed_per_bar(my_onsets, downbeats)
+        time_periods = list(time_period) if isinstance(time_period, (list, tuple)) else [time_period]
+        bar_periods = list(bar_period) if isinstance(bar_period, (list, tuple)) else [bar_period]
+        # Extract event density for every period at once
+        per_second, per_bar = self.extract_event_density_multi(
+            my_onsets, downbeats, time_periods, bar_periods, window_bounds=kwargs.get('window_bounds', {})
+        )
+        per_second = {
+            tp: pd.DataFrame({'ts': pd.to_datetime(ts, unit='s'), 'density': density})
+            for tp, (ts, density) in per_second.items()
+        }
+        per_bar = {
+            bp: pd.DataFrame({'bars': self._get_bar_labels(len(density), bp), 'density': density})
+            for bp, density in per_bar.items()
+        }
         # Update our summary dictionary
-        self.summary_dict['time_period'] = time_period
-        self.summary_dict['bar_period'] = bar_period
-        self.update_summary_dict(['ed_per_second', 'ed_per_bar'], [self.per_second['density'], self.per_bar['density']])
+        if isinstance(time_period, (list, tuple)) or isinstance(bar_period, (list, tuple)):
+            self.per_second, self.per_bar = per_second, per_bar
+            self.update_summary_dict(
+                [f'ed_per_{tp}_seconds' for tp in per_second.keys()] + [f'ed_per_{bp}_bars' for bp in per_bar.keys()],
+                [df['density'] for df in per_second.values()] + [df['density'] for df in per_bar.values()]
+            )
+        else:
+            self.per_second, self.per_bar = per_second[time_period], per_bar[bar_period]
+            self.summary_dict['time_period'] = time_period
+            self.summary_dict['bar_period'] = bar_period
+            self.update_summary_dict(
+                ['ed_per_second', 'ed_per_bar'], [self.per_second['density'], self.per_bar['density']]
+            )
+
+    @classmethod
+    def from_grid(cls, grid: BeatGrid, instr: str, time_period: int | list[int] = 1, bar_period: int | list[int] = 1):
+        """Creates the extractor from a `BeatGrid`, reusing its bar windows for the onsets of `instr`"""
+        bar_periods = list(bar_period) if isinstance(bar_period, (list, tuple)) else [bar_period]
+        return cls(
+            grid.get_onsets(instr), grid.downbeats, time_period=time_period, bar_period=bar_period,
+            window_bounds={bp: grid.get_bar_bounds(instr, bp) for bp in bar_periods}
+        )
+
+    @staticmethod
+    def _get_bar_labels(n_windows: int, bar_period: int) -> list[str]:
+        """Gets the string label for each window, i.e. the first and last bar it spans"""
+        return [f'{bar_num}-{bar_num + bar_period}' for bar_num in range(1, n_windows + 1)]
+
+    @staticmethod
+    def extract_event_density_multi(
+            my_onsets: pd.Series | np.ndarray,
+            downbeats: np.array,
+            time_periods: list[int],
+            bar_periods: list[int],
+            **kwargs
+    ) -> tuple[dict, dict]:
+        """Extract the number of notes played in every window, for several time and bar periods at once.
+
+        For time periods, every onset is assigned to a window with `np.floor` and windows are counted with
+        `np.bincount`, giving windows starting at multiples of the time period (as with `pd.DataFrame.resample`). For
+        bar periods, the number of onsets in each window is the difference between the indices returned by
+        `np.searchsorted` for the first and last downbeat (inclusive).
+
+        Arguments:
+            my_onsets (pd.Series | np.ndarray): onsets to calculate event density for, may contain NaN values
+            downbeats (np.array): the position of downbeats
+            time_periods (list[int]): the window sizes (in seconds) to calculate event density for
+            bar_periods (list[int]): the window sizes (in bars) to calculate event density for
+            **kwargs: `window_bounds`, a dictionary of precomputed onset indices for each bar period (e.g. from
+                `BeatGrid.get_bar_bounds`)
+
+        Returns:
+            tuple[dict, dict]: for each time period, the start of every window (in seconds) and its event density; and
+                for each bar period, the event density of every window
+
+        """
+        ons = np.sort(np.asarray(my_onsets, dtype=float))
+        ons = ons[~np.isnan(ons)]
+        downbeats = np.asarray(downbeats, dtype=float)
+        per_second = {}
+        for time_period in time_periods:
+            if len(ons) == 0:
+                per_second[time_period] = (np.array([], dtype=float), np.array([], dtype=np.int64))
+                continue
+            # Onsets are sorted, so the first window is the window of the first onset
+            windows = np.floor(ons / time_period).astype(np.int64)
+            density = np.bincount(windows - windows[0])
+            per_second[time_period] = ((windows[0] + np.arange(len(density))) * time_period, density)
+        window_bounds = kwargs.get('window_bounds', {})
+        per_bar = {}
+        for bar_period in bar_periods:
+            if bar_period in window_bounds:
+                lo, hi = window_bounds[bar_period]
+            else:
+                n_windows = max(len(downbeats) - bar_period, 0)
+                lo, hi = get_window_bounds(ons, downbeats[:n_windows], downbeats[bar_period:bar_period + n_windows])
+            per_bar[bar_period] = hi - lo
+        return per_second, per_bar
 
     def extract_ed_per_second(self, my_onsets) -> pd.DataFrame:
         """For every second in a performance, extract the number of notes played"""
-        return (
-            pd.DataFrame({'ts': pd.to_datetime(my_onsets, unit='s'), 'density': my_onsets})
-            .set_index('ts')
-            .resample(self.time_period, label='left')
-            .count()
-            .reset_index(drop=False)
-        )
+        per_second, _ = self.extract_event_density_multi(my_onsets, [], [self.time_period], [])
+        ts, density = per_second[self.time_period]
+        return pd.DataFrame({'ts': pd.to_datetime(ts, unit='s'), 'density': density})
 
     def extract_ed_per_bar(self, my_onsets, quarter_note_downbeats) -> pd.DataFrame:
         """Extract the number of notes played within each specified bar period"""
-        sequential_downbeats = zip(quarter_note_downbeats, quarter_note_downbeats[self.bar_period:])
-        my_onsets_arr = my_onsets.to_numpy()
-        matches = [
-            {f'bars': f'{bar_num}-{bar_num + self.bar_period}', 'density': len(self.get_between(my_onsets_arr, i1, i2))}
-            for bar_num, (i1, i2) in enumerate(sequential_downbeats, 1)
-        ]
-        return pd.DataFrame(matches)
+        _, per_bar = self.extract_event_density_multi(my_onsets, quarter_note_downbeats, [], [self.bar_period])
+        density = per_bar[self.bar_period]
+        return pd.DataFrame({'bars': self._get_bar_labels(len(density), self.bar_period), 'density': density})
+
+
+def bur_kernel(
+        my_onsets: np.array,
+        my_beats: np.array,
+        low_thresh: float = 0.25,
+        high_thresh: float = 4,
+        bounds: tuple[np.ndarray, np.ndarray] = None
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Calculates raw and log2 beat-upbeat ratios for every pair of consecutive beats, alongside an outlier mask.
+
+    Onsets in each beat interval (inclusive of both beats) are located with `np.searchsorted` on the sorted onsets,
+    rather than by masking the whole array once for each beat. A BUR is only calculated for intervals containing
+    exactly three onsets (i.e. both beats and one upbeat).
+
+    Arguments:
+        my_onsets (np.array): the array of raw onsets, may contain NaN values
+        my_beats (np.array): the array of crotchet beat positions, may contain NaN values
+        low_thresh (float): BURs below this value are marked as outliers, defaults to 0.25
+        high_thresh (float): BURs above this value are marked as outliers, defaults to 4
+        bounds (tuple, optional): precomputed indices of the onsets between every pair of consecutive beats, e.g.
+            from `BeatGrid.get_beat_bounds`
+
+    Returns:
+        tuple[np.ndarray, np.ndarray, np.ndarray]: the raw BURs, the log2 BURs, and a boolean mask that is True for
+            outlying BURs. Each array has the same length as `my_beats`, with NaN values where no BUR can be calculated
+
+    """
+    ons = np.sort(np.asarray(my_onsets, dtype=float))
+    ons = ons[~np.isnan(ons)]
+    beats = np.asarray(my_beats, dtype=float)
+    burs = np.full(beats.shape[0], np.nan)
+    if beats.shape[0] > 1 and ons.shape[0] > 2:
+        b1, b2 = beats[:-1], beats[1:]
+        # Get the index of the first onset after the first beat, and the first onset after the second beat
+        lo, hi = get_window_bounds(ons, b1, b2) if bounds is None else bounds
+        # We need exactly three onsets between both beats, and both beats to be present
+        valid = ((hi - lo) == 3) & ~np.isnan(b1) & ~np.isnan(b2)
+        idx = lo[valid]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            burs[:-1][valid] = (ons[idx + 1] - ons[idx]) / (ons[idx + 2] - ons[idx + 1])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        burs_log = np.log2(burs)
+        outliers = (burs > high_thresh) | (burs < low_thresh)
+    return burs, burs_log, outliers
 
 
 class BeatUpbeatRatio(BaseExtractor):
     LOW_THRESH, HIGH_THRESH = 0.25, 4
 
     """Extract various features related to beat-upbeat ratios (BURs)"""
-    def __init__(self, my_onsets, my_beats, clean_outliers: bool = True):
+    def __init__(self, my_onsets, my_beats, clean_outliers: bool = True, **kwargs):
         super().__init__()
         if isinstance(my_onsets, np.ndarray):
             my_onsets = pd.Series(my_onsets)
         self.clean_outliers = clean_outliers
-        # Extract our burs here, so we can access them as instance properties
-        self.bur = self.extract_burs(my_onsets, my_beats, use_log_burs=False)
-        self.bur_log = self.extract_burs(my_onsets, my_beats, use_log_burs=True)
+        # Extract our raw and log burs together, so we can access them as instance properties
+        burs, burs_log = self.extract_burs_batch(
+            [my_onsets], [my_beats], clean_outliers=clean_outliers, bounds_list=[kwargs.get('window_bounds', None)]
+        )[0]
+        beats = pd.to_datetime(my_beats, unit='s')
+        self.bur = pd.DataFrame({'beat': beats, 'burs': burs})
+        self.bur_log = pd.DataFrame({'beat': beats, 'burs': burs_log})
         # Update our summary dictionary
         self.update_summary_dict(['bur', 'bur_log'], [self.bur['burs'], self.bur_log['burs']])
 
+    @classmethod
+    def from_grid(cls, grid: BeatGrid, instr: str, clean_outliers: bool = True):
+        """Creates the extractor from a `BeatGrid`, reusing its onset windows between the matched beats of `instr`"""
+        return cls(
+            grid.get_onsets(instr), grid.get_matched_beats(instr), clean_outliers=clean_outliers,
+            window_bounds=grid.get_beat_bounds(instr)
+        )
+
+    @classmethod
+    def extract_burs_batch(
+            cls,
+            onsets_list: list[np.array],
+            beats_list: list[np.array],
+            clean_outliers: bool = True,
+            bounds_list: list[tuple] = None
+    ) -> list[tuple[np.ndarray, np.ndarray]]:
+        """Extracts raw and log2 BURs for multiple arrays of onsets and beats (e.g. several instruments or tracks).
+
+        Each pair of arrays is still passed to `bur_kernel` in turn, as almost all of its time is spent in
+        `np.searchsorted` calls which are already vectorised within each array. Concatenating every array and searching
+        once would require keys that keep arrays apart (e.g. ranking every value with another sort), which was found to
+        be several times slower than this loop for both a few instruments and a whole corpus of tracks.
+
+        Arguments:
+            onsets_list (list[np.array]): arrays of raw onsets
+            beats_list (list[np.array]): arrays of crotchet beat positions, matching `onsets_list`
+            clean_outliers (bool, optional): whether to set BURs outside the thresholds to NaN, defaults to True
+            bounds_list (list[tuple], optional): precomputed onset indices for each pair, see `bur_kernel`
+
+        Returns:
+            list[tuple[np.ndarray, np.ndarray]]: the raw and log2 BURs for each pair of onset and beat arrays
+
+        """
+        if bounds_list is None:
+            bounds_list = [None] * len(onsets_list)
+        res = []
+        for my_onsets, my_beats, bounds in zip(onsets_list, beats_list, bounds_list):
+            burs, burs_log, outliers = bur_kernel(my_onsets, my_beats, cls.LOW_THRESH, cls.HIGH_THRESH, bounds)
+            if clean_outliers:
+                burs[outliers] = np.nan
+                burs_log[outliers] = np.nan
+            res.append((burs, burs_log))
+        return res
+
     def extract_burs(
             self,
             my_onsets: np.array,
@@ -275,64 +542,33 @@ class BeatUpbeatRatio(BaseExtractor):
                 Distributions with the Weimar Jazz Database. Music Perception, 38(4), 372–385.
 
         """
-
-        # Use log2 burs if specified
-        func = lambda a: a
-        if use_log_burs:
-            from math import log2 as func
-
-        def bur(a: float, b: float) -> float:
-            """BUR calculation function"""
-            # Get the onsets between our first and second beat (a and b)
-            match = self.get_between(my_onsets, a, b)
-            # If we have a group of three notes (i.e. three quavers), including a and b
-            if len(match) == 3:
-                bur_val = func((match[1] - match[0]) / (match[2] - match[1]))
-                # If we're cleaning outliers
-                if self.clean_outliers:
-                    # If the BUR is above or high threshold, or below our low threshold, return NaN
-                    if bur_val > func(self.HIGH_THRESH) or bur_val < func(self.LOW_THRESH):
-                        return np.nan
-                    # Otherwise, return the BUR
-                    else:
-                        return bur_val
-                # If we're not cleaning outliers, just return the BUR
-                else:
-                    return bur_val
-            # If we don't have a match in the first place, return NaN
-            else:
-                return np.nan
-
-        # If we're using Pandas, convert our onsets array to numpy for processing
-        if isinstance(my_onsets, pd.Series):
-            my_onsets = my_onsets.to_numpy()
-        # Iterate through consecutive pairs of beats and get the BUR
-        burs = [bur(i1, i2) for i1, i2 in zip(my_beats, my_beats[1:])]
-        # We can't know the BUR for the final beat, so append NaN
-        burs.append(np.nan)
-        return pd.DataFrame({'beat': pd.to_datetime(my_beats, unit='s'), 'burs': burs})
+        burs, burs_log = self.extract_burs_batch([my_onsets], [my_beats], clean_outliers=self.clean_outliers)[0]
+        return pd.DataFrame({'beat': pd.to_datetime(my_beats, unit='s'), 'burs': burs_log if use_log_burs else burs})
 
 
 class TempoSlope(BaseExtractor):
     """Extract features related to tempo slope, i.e. instantaneous tempo change (in beats-per-minute) per second"""
-    def __init__(self, my_beats: pd.Series):
+    def __init__(self, my_beats: pd.Series, **kwargs):
         super().__init__()
         my_bpms = 60 / my_beats.diff()
-        self.model = self.extract_tempo_slope(my_beats, my_bpms)
+        self.model = self.extract_tempo_slope(my_beats, my_bpms, backend=kwargs.get('ols_backend', 'numpy'))
         self.update_summary_dict([], [])
 
+    @classmethod
+    def from_context(cls, context: FeatureContext, instrs: list[str] = None, **kwargs):
+        """Creates the extractor from the mean position of every beat across `instrs`, reusing it from `context`"""
+        return cls(context.get_beat_means(instrs), **kwargs)
+
     @staticmethod
-    def extract_tempo_slope(my_beats: np.array, my_bpms: np.array) -> RegressionResultsWrapper | None:
+    def extract_tempo_slope(my_beats: np.array, my_bpms: np.array, backend: str = 'numpy') -> OLSResults | None:
         """Create the tempo slope regression model"""
         # Dependent variable: the BPM measurements
-        y = my_bpms
-        # Predictor variable: the onset time (with an added intercept
-        x = sm.add_constant(my_beats)
+        # Predictor variable: the onset time (an intercept is added when fitting)
         # Fit the model and return
         try:
-            return sm.OLS(y, x, missing='drop').fit()
-        # These are all the different error types that can emerge when fitting to data with too many NaNs
-        except (ValueError, IndexError, KeyError):
+            return fit_ols(my_bpms, my_beats, backend=backend)
+        # This error will be raised when fitting to data with too many NaNs
+        except ValueError:
             return None
 
     def update_summary_dict(self, array_names, arrays, *args, **kwargs) -> None:
@@ -347,93 +583,154 @@ class Asynchrony(BaseExtractor):
     """Extracts various features relating to asynchrony of onsets.
 
     Many of these features rely on the definitions established in the `onsetsync` package (Eerola & Clayton, 2023),
-    and are ported to Python here with minimal changes.
+    and are ported to Python here with minimal changes. Every feature is calculated for all pairs of instruments at
+    once with `asynchrony_kernel`: use `from_matrix` to create the extractor for every instrument in a performance from
+    a single call.
 
     """
     # TODO: implement some sort of way of calculating circular statistics here?
 
-    def __init__(self, my_beats: pd.Series, their_beats: pd.DataFrame | pd.Series):
+    def __init__(self, my_beats: pd.Series, their_beats: pd.DataFrame | pd.Series, **kwargs):
         super().__init__()
         # For many summary functions, we just need the asynchrony columns themselves
-        self.summary_funcs.update(dict(
-            pairwise_asynchronization=self.pairwise_asynchronization,
-            groupwise_asynchronization=self.groupwise_asynchronization,
-            mean_absolute_asynchrony=self.mean_absolute_asynchrony,
-            mean_pairwise_asynchrony=self.mean_pairwise_asynchrony
-        ))
-        self.extract_asynchronies(my_beats, their_beats)
-        # We calculate mean relative asynchrony slightly differently to other variables
-        mra = self.mean_relative_asynchrony(my_beats, their_beats)
-        self.summary_dict.update({'mean_relative_asynchrony': mra})
+        # These are all calculated for every pair of instruments in one go, so we register them as batched
+        for func_k, func_v in self.kernel_funcs().items():
+            self.register_summary_func(func_k, func_v, batched=True)
+        if isinstance(their_beats, pd.Series):
+            their_beats = their_beats.to_frame()
+        # Get asynchrony statistics for every pair of instruments, unless these have been calculated already
+        instruments = kwargs.get('instruments', [my_beats.name, *their_beats.columns])
+        summary = kwargs.get('summary', None)
+        if summary is None:
+            summary = asynchrony_kernel(pd.concat([my_beats, their_beats], axis=1).to_numpy(dtype=float))
+        self.extract_asynchronies(summary, instruments, my_beats.name)
+
+    @classmethod
+    def from_matrix(cls, beats: pd.DataFrame) -> list:
+        """Creates the extractor for every instrument (column) in `beats`, calculating statistics for all in one call"""
+        summary = asynchrony_kernel(beats.to_numpy(dtype=float))
+        instruments = list(beats.columns)
+        return [
+            cls(beats[instr], beats[[i for i in instruments if i != instr]], summary=summary, instruments=instruments)
+            for instr in instruments
+        ]
+
+    @classmethod
+    def kernel_funcs(cls) -> dict:
+        """Functions calculated on every pair of instruments by `asynchrony_kernel`, in addition to the defaults"""
+        return dict(
+            pairwise_asynchronization=cls.pairwise_asynchronization,
+            groupwise_asynchronization=cls.groupwise_asynchronization,
+            mean_absolute_asynchrony=cls.mean_absolute_asynchrony,
+            mean_pairwise_asynchrony=cls.mean_pairwise_asynchrony
+        )
 
     @staticmethod
-    def pairwise_asynchronization(asynchronies: pd.Series) -> float:
+    def pairwise_asynchronization(asynchronies: pd.Series | np.ndarray) -> float | np.ndarray:
         """Extract the standard deviation of the asynchronies of a pair of instruments.
 
         Eerola & Clayton (2023) use the sample standard deviation rather than the population standard deviation, so we
-        are required to set the correction term `ddof` in `np.nanstd` to 1 to correct this.
+        are required to set the correction term `ddof` in `np.nanstd` to 1 to correct this. If `asynchronies` is 2D,
+        one value is returned for every row.
 
         Parameters:
             asynchronies (np.array): the onset time differences between two instruments
 
         Returns:
-            float
+            float | np.ndarray
 
         """
-        return np.nanstd(asynchronies.dropna(), ddof=1)
+        return np.nanstd(np.asarray(asynchronies, dtype=float), ddof=1, axis=-1)
 
     @staticmethod
-    def groupwise_asynchronization(asynchronies: pd.Series) -> float:
+    def groupwise_asynchronization(asynchronies: pd.Series | np.ndarray) -> float | np.ndarray:
         """Extract the root-mean-square (RMS) of the pairwise asynchronizations."""
-        # Convert to a list for use in functools
-        asynchronies_ = asynchronies.dropna().to_list()
+        asynchronies = np.asarray(asynchronies, dtype=float)
         # We define the function (d^i/n)^2 here, for asynchrony d at the ith time point, with n total asynchrony values
-        func = lambda total, asy: total + ((asy / len(asynchronies_)) ** 2)
-        # Calculate all function values, then take the square root
-        return np.sqrt(reduce(func, [0] + asynchronies_))
+        n = np.count_nonzero(~np.isnan(asynchronies), axis=-1)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            # Calculate all function values, then take the square root
+            return np.sqrt(np.nansum((asynchronies / np.expand_dims(n, -1)) ** 2, axis=-1))
 
     @staticmethod
-    def mean_absolute_asynchrony(asynchronies: pd.Series) -> float:
+    def mean_absolute_asynchrony(asynchronies: pd.Series | np.ndarray) -> float | np.ndarray:
         """Extract the mean of all unsigned asynchrony values."""
-        return asynchronies.dropna().abs().mean()
+        return np.nanmean(np.abs(np.asarray(asynchronies, dtype=float)), axis=-1)
         # Alternative, should lead to identical results
         # return (1 / len(asynchronies)) * sum([abs(a) for a in asynchronies])
 
     @staticmethod
-    def mean_pairwise_asynchrony(asynchronies: pd.Series) -> float:
+    def mean_pairwise_asynchrony(asynchronies: pd.Series | np.ndarray) -> float | np.ndarray:
         """Extract the mean of all signed asynchrony values."""
-        return asynchronies.dropna().mean()
+        return np.nanmean(np.asarray(asynchronies, dtype=float), axis=-1)
         # Alternative, should lead to identical results
         # return (1 / len(asynchronies)) * sum(asynchronies)
 
     def mean_relative_asynchrony(self, my_beats, their_beats: pd.Series | pd.DataFrame) -> float:
         """Extract the mean position of an instrument's onsets relative to the average position of the group"""
         # TODO: if one instrument is all NaN, this seems to result in a NaN result even if the other instrument is there
-        # Get the average position of the whole group
-        average_group_position = pd.concat([my_beats, their_beats], axis=1).dropna().mean(axis=1)
-        # Get the relative position in comparison to the average: my_onset - average_onsets
-        my_relative_asynchrony = my_beats - average_group_position
-        # Return the mean asynchrony from our relative asynchrony
-        return self.mean_pairwise_asynchrony(my_relative_asynchrony)
-
-    def extract_asynchronies(self, my_beats: pd.Series, their_beats: pd.DataFrame | pd.Series) -> dict:
-        """Extract asynchrony between an instrument of interest and all other instruments and calculate functions"""
-        if isinstance(their_beats, pd.Series):
-            their_beats = pd.DataFrame
-        # Iterate through all instruments in the ensemble
+        their_beats = their_beats.to_frame() if isinstance(their_beats, pd.Series) else their_beats
+        beats = pd.concat([my_beats, their_beats], axis=1).to_numpy(dtype=float)
+        return asynchrony_kernel(beats)['mean_relative_asynchrony'][0]
+
+    def extract_asynchronies(self, summary: dict, instruments: list[str], my_instr: str) -> dict:
+        """Updates our summary dictionary with asynchrony statistics between `my_instr` and all other instruments"""
+        me = instruments.index(my_instr)
+        # Add keys in instrument order: we can't have asynchrony to our own performance, so these will remain NaN
         for partner_instrument in utils.INSTRUMENTS_TO_PERFORMER_ROLES.keys():
-            # We can't have asynchrony to our own performance, so append NaN in these cases
-            if partner_instrument == my_beats.name:
-                for func_k, func_v in self.summary_funcs.items():
-                    self.summary_dict[f'{partner_instrument}_async_{func_k}'] = np.nan
-            # Otherwise, calculate the asynchrony to this instrument
-            else:
-                partner_beats = their_beats[partner_instrument]
-                # Calculate asynchrony: my_onset - partner_onset, then drop NaN values
-                asynchronies = my_beats - partner_beats
-                # Update our summary dictionary
-                for func_k, func_v in self.summary_funcs.items():
-                    self.summary_dict[f'{partner_instrument}_async_{func_k}'] = func_v(asynchronies)
+            them = instruments.index(partner_instrument) if partner_instrument in instruments else None
+            for func_k in self.summary_funcs.keys():
+                val = summary[func_k][me, them] if them is not None and them != me else np.nan
+                self.summary_dict[f'{partner_instrument}_async_{func_k}'] = float(val)
+        # We calculate mean relative asynchrony slightly differently to other variables
+        self.summary_dict['mean_relative_asynchrony'] = float(summary['mean_relative_asynchrony'][me])
+        return self.summary_dict
+
+
+def asynchrony_kernel(beats: np.ndarray) -> dict[str, np.ndarray]:
+    """Calculates asynchrony statistics between every pair of instruments, for one or more performances at once.
+
+    Asynchronies (my_onset - partner_onset) are obtained for every ordered pair of instruments by broadcasting, then
+    every statistic in `BaseExtractor.summary_funcs` and `Asynchrony.kernel_funcs` is calculated for all pairs (and all
+    performances) with a single call to `summary_statistics`. Mean relative asynchrony uses only beats where every
+    instrument has an onset.
+
+    Arguments:
+        beats (np.ndarray): onsets with shape (n_beats, n_instruments), or a stack of performances with shape
+            (n_performances, n_beats, n_instruments), with NaN values for missing onsets
+
+    Returns:
+        dict[str, np.ndarray]: arrays with shape (n_instruments, n_instruments) (or (n_performances, n_instruments,
+            n_instruments)) for every statistic, where element [i, j] is for instrument i relative to instrument j (and
+            the diagonal is missing), and an array with shape (n_instruments,) (or (n_performances, n_instruments))
+            for `mean_relative_asynchrony`
+
+    """
+    beats = np.asarray(beats, dtype=float)
+    single = beats.ndim == 2
+    if single:
+        beats = beats[None, :, :]
+    n_perfs, n_beats, n_instrs = beats.shape
+    # Asynchrony for every ordered pair of instruments: element [p, i, j, t] is beats[p, t, i] - beats[p, t, j]
+    by_instr = beats.transpose(0, 2, 1)
+    asynchronies = by_instr[:, :, None, :] - by_instr[:, None, :, :]
+    # We can't have asynchrony to our own performance, so these will always be missing
+    diagonal = np.arange(n_instrs)
+    asynchronies[:, diagonal, diagonal, :] = np.nan
+    with warnings.catch_warnings():
+        # Missing asynchronies (e.g. on the diagonal) will raise warnings about empty slices, which we can ignore
+        warnings.simplefilter('ignore', RuntimeWarning)
+        # We give the number of rows explicitly, so that performances without any beats can still be reshaped
+        summary = summary_statistics(
+            asynchronies.reshape(n_perfs * n_instrs * n_instrs, n_beats), extra_funcs=Asynchrony.kernel_funcs()
+        )
+    res = {k: np.asarray(v).reshape(n_perfs, n_instrs, n_instrs) for k, v in summary.items()}
+    # The position of each instrument relative to the average position of the group, only where everyone has played
+    complete = ~np.isnan(beats).any(axis=2, keepdims=True)
+    with np.errstate(invalid='ignore'):
+        relative = np.where(complete, beats - beats.mean(axis=2, keepdims=True), np.nan)
+        res['mean_relative_asynchrony'] = Asynchrony.mean_pairwise_asynchrony(relative.transpose(0, 2, 1))
+    return {k: v[0] for k, v in res.items()} if single else res
 
 
 class PhaseCorrection(BaseExtractor):
@@ -445,6 +742,11 @@ class PhaseCorrection(BaseExtractor):
         order (int, optional): the order of the model to create, defaults to 1 (i.e. 1st-order model, no lagged terms)
         iqr_filter (bool, optional): whether to apply an iqr filter to data, defaults to False
         difference_iois (bool, optional): whether to take the first difference of IOI values, defaults to True
+        ols_backend (str, optional): fit models with "numpy" (default) or "statsmodels", see `fit_ols_batch`
+        context (FeatureContext, optional): reuse inter-onset intervals and asynchronies from this context when
+            `my_beats` and `their_beats` are columns of its `summary_df` and no thresholds are set, defaults to None
+        fit (bool, optional): whether to fit the model when the instance is created, defaults to True. Set to False
+            when many models are fitted together afterwards, as in `fit_batch`: `model` is then None until set
 
     """
     warnings.filterwarnings('ignore', category=RuntimeWarning)
@@ -461,17 +763,76 @@ class PhaseCorrection(BaseExtractor):
         self.iqr_filter = kwargs.get('iqr_filter', False)
         self.difference_iois = kwargs.get('difference_iois', True)
         self.standardize = kwargs.get('standardize', False)
+        # Whether to fit models with our own `numpy` implementation (default) or with `statsmodels`
+        self.ols_backend = kwargs.get('ols_backend', 'numpy')
+        # A per-track context to get inter-onset intervals and asynchronies from, rather than computing them again
+        self.context = kwargs.get('context', None)
         # Threshold dataframe based on provided low and high threshold
         self.low_threshold, self.high_threshold = kwargs.get('low_threshold', None), kwargs.get('high_threshold', None)
         # Create an empty variable to hold the data actually going into the model
         self.model_data = None
-        # Create the model
-        self.model = self.generate_model(my_beats, their_beats)
+        self.model = None
+        # Create the model, unless we're going to fit many models together with `fit_batch`
+        if kwargs.get('fit', True):
+            self.model = self.generate_model(my_beats, their_beats)
+            self.update_summary_dict([], [])
+
+    @classmethod
+    def fit_batch(
+            cls,
+            beats: list[tuple[pd.Series, pd.DataFrame | pd.Series | None]],
+            order: int = 1,
+            **kwargs
+    ) -> list:
+        """Creates models for every `(my_beats, their_beats)` pair, fitting all regressions in a single call
+
+        Arguments:
+            beats (list[tuple]): pairs of onsets for the instrument to model and the other instrument(s)
+            order (int, optional): the order of every model to create, defaults to 1
+            **kwargs: keyword arguments passed to `PhaseCorrection`
+
+        Returns:
+            list[PhaseCorrection]: one instance for every pair in `beats`, in the same order
+
+        """
+        pcs = [cls(my_beats, their_beats, order=order, fit=False, **kwargs) for my_beats, their_beats in beats]
+        inputs = [pc.get_model_inputs(my_beats, their_beats) for pc, (my_beats, their_beats) in zip(pcs, beats)]
+        models = fit_ols_batch(
+            [y for y, _ in inputs], [x for _, x in inputs], backend=kwargs.get('ols_backend', 'numpy')
+        )
+        for pc, model in zip(pcs, models):
+            pc.model = model
+            pc.update_summary_dict([], [])
+        return pcs
+
+    def update_summary_dict(self, array_names, arrays, *args, **kwargs) -> None:
+        """Update the summary dictionary with coefficients from the phase correction model"""
         # Create the dataframe and model summary information
         self.df = pd.DataFrame(self.extract_model_coefficients())
         # TODO: why are we subsetting here?
         self.summary_dict = self.df.to_dict(orient='records')[0]
 
+    def _use_context(self, my_beats: pd.Series, their_beats: pd.DataFrame | pd.Series | None = None) -> bool:
+        """Returns whether intermediate arrays can be reused from our context.
+
+        This is only the case when our input data isn't truncated and every input is a column of the context's
+        `summary_df`, found by name and with the same index. Otherwise (e.g. for unnamed series, or series from another
+        track), we fall back to calculating every array from the input data.
+
+        """
+        if self.context is None or self.low_threshold is not None or self.high_threshold is not None:
+            return False
+        if their_beats is None:
+            names = []
+        elif isinstance(their_beats, pd.Series):
+            names = [their_beats.name]
+        else:
+            names = list(their_beats.columns)
+        summary_df = self.context.summary_df
+        return all(name in summary_df.columns for name in [my_beats.name, *names]) and all(
+            arr.index.equals(summary_df.index) for arr in [my_beats, their_beats] if arr is not None
+        )
+
     def truncate(self, my_beats, their_beats) -> tuple:
         """Truncates our input data between given low and high thresholds"""
         # If we haven't set a lower and upper threshold, don't threshold the data
@@ -501,16 +862,20 @@ class PhaseCorrection(BaseExtractor):
         # If we've only passed in one asynchrony term as a series, convert it to a dataframe
         elif isinstance(their_beats, pd.Series):
             their_beats = pd.DataFrame(their_beats)
+        use_context = self._use_context(my_beats, their_beats)
         results = []
         for partner_instrument in their_beats.columns:
             partner_onsets = their_beats[partner_instrument]
             # In the phase correction model, the asynchrony terms are our partner's asynchrony with relation to us,
             # i.e. their_onset - my_onset (from their perspective, this is my_onset - their_onset).
             # Normally we would calculate asynchrony instead as my_onset - their_onset.
-            asynchronies = partner_onsets - my_beats
+            if use_context:
+                asynchronies = self.context.get_asynchronies(my_beats.name, partner_instrument)
+            else:
+                asynchronies = partner_onsets - my_beats
             # Format our asynchrony array by adding IQR filter, etc.; we don't want to difference them, though
             asynchronies_fmt = self.format_array(asynchronies, difference_iois=False)
-            asynchronies_fmt.name = f'{my_beats.name}_{partner_instrument}_asynchrony'
+            asynchronies_fmt = asynchronies_fmt.rename(f'{my_beats.name}_{partner_instrument}_asynchrony')
             # Shift our formatted asynchronies variable by the correct amount and extend the list
             results.extend(list(self.shifter(asynchronies_fmt)))
         return pd.concat(results, axis=1)
@@ -559,14 +924,35 @@ class PhaseCorrection(BaseExtractor):
             self,
             my_beats: pd.Series,
             their_beats: pd.DataFrame | pd.Series | None
-    ) -> RegressionResultsWrapper:
+    ) -> OLSResults | None:
         """Generate the phase correction linear regression model"""
+        y, x = self.get_model_inputs(my_beats, their_beats)
+        # Fit the regression model and return
+        try:
+            return fit_ols(y, x, backend=self.ols_backend)
+        # This error will be raised when fitting to data with too many NaNs
+        except ValueError:
+            return None
+
+    def get_model_inputs(
+            self,
+            my_beats: pd.Series,
+            their_beats: pd.DataFrame | pd.Series | None
+    ) -> tuple[pd.Series, pd.DataFrame]:
+        """Get the dependent and predictor variables for the phase correction model"""
         # Truncate incoming data based on set thresholds
         my_beats, their_beats = self.truncate(my_beats, their_beats)
         # Get my previous inter-onset intervals from my onsets and format
-        my_prev_iois = my_beats.diff()
-        my_prev_iois = self.format_array(my_prev_iois)
-        my_prev_iois.name = f'{my_beats.name}_prev_ioi'
+        if self._use_context(my_beats, their_beats):
+            # The context has already taken the first difference of the IOIs, if we need it
+            my_prev_iois = self.format_array(
+                self.context.get_differenced_iois(my_beats.name) if self.difference_iois
+                else self.context.get_beat_iois(my_beats.name),
+                difference_iois=False
+            )
+        else:
+            my_prev_iois = self.format_array(my_beats.diff())
+        my_prev_iois = my_prev_iois.rename(f'{my_beats.name}_prev_ioi')
         # Get my next inter-onset intervals by shifting my previous intervals (dependent variable)
         y = my_prev_iois.shift(-1)
         y.name = f'{my_beats.name}_next_ioi'
@@ -574,23 +960,17 @@ class PhaseCorrection(BaseExtractor):
         my_prev_iois = pd.concat(list(self.shifter(my_prev_iois)), axis=1)
         # Get arrays of asynchrony values (independent variables #2, #3)
         async_arrs = self.format_async_arrays(their_beats, my_beats)
-        # Combine independent variables into one dataframe and add constant term
+        # Combine independent variables into one dataframe: the constant term is added when fitting
         x = pd.concat([my_prev_iois, async_arrs], axis=1)
-        x = sm.add_constant(x)
         # Update our instance attribute here, so we can debug the data going into the model, if needed
         self.model_data = pd.concat([my_beats, their_beats, x, y], axis=1)
-        # Fit the regression model and return
-        try:
-            return sm.OLS(y, x, missing='drop').fit()
-        # These are all the different error types that can emerge when fitting to data with too many NaNs
-        except (ValueError, KeyError, IndexError):
-            return None
+        return y, x
 
     def extract_model_coefficients(self) -> Generator:
         """Extracts coefficients from linear phase correction model and format them correctly"""
         def extract_endog_instrument() -> str:
             """Returns name of instrument used in dependent variable of the model"""
-            ei = self.model.model.endog_names.split('_')[0].lower()
+            ei = self.model.endog_names.split('_')[0].lower()
             # Check that the value we've returned is contained within our list of possible instruments
             assert ei in utils.INSTRUMENTS_TO_PERFORMER_ROLES.keys()
             return ei
@@ -602,7 +982,7 @@ class PhaseCorrection(BaseExtractor):
             except KeyError:
                 return np.nan
 
-        # These are all basic statsmodels attributes we can extract easily from the model
+        # These are all basic attributes we can extract easily from the model
         attributes = ['nobs', 'rsquared', 'rsquared_adj', 'aic', 'bic', 'llf']
         # If the model did not compile, return a dictionary filled with NaNs for every variable
         if self.model is None:
@@ -643,6 +1023,8 @@ class GrangerCausality(BaseExtractor):
         my_beats (pd.Series): onsets of instrument to model
         their_beats (pd.DataFrame | pd.Series): onsets of remaining instrument(s)
         order (int, optional): the order of the model to create, defaults to 1 (i.e. 1st-order model, no lagged terms)
+        max_order (int, optional): if provided, Granger indexes are also computed for every order up to this value and
+            stored in `sweep`, which can be used with `select_order`
         **kwargs: keyword arguments passed to `PhaseCorrectionExtractor`
 
     """
@@ -656,40 +1038,187 @@ class GrangerCausality(BaseExtractor):
     ):
         super().__init__()
         self.order = order
+        # Compute Granger indexes for every order we need in a single pass
+        orders = range(1, max(kwargs.get('max_order') or order, order) + 1) if 'max_order' in kwargs else [order]
+        self.sweep = self.compute_granger_sweep(my_beats, their_beats, orders=orders, **kwargs)
         # Update the summary dictionary
-        self.summary_dict = self.compute_granger_indexes(my_beats, their_beats, **kwargs)
+        self.summary_dict = self.compute_granger_indexes(my_beats, their_beats, sweep=self.sweep, **kwargs)
 
-    def compute_fisher_test(self, var_restricted: float, var_unrestricted: float, n: int) -> float:
+    def compute_fisher_test(self, var_restricted: float, var_unrestricted: float, n: int, order: int = None) -> float:
         """Evaluate statistical significance of Granger test with Fisher test"""
+        if order is None:
+            order = self.order
         # Calculate degrees of freedom for the F-test
-        df1 = self.order
-        df2 = n - 2 * self.order
+        df1 = order
+        df2 = n - 2 * order
         # Calculate the F-statistic and associated p-value for the F-test
         f_statistic = ((var_restricted - var_unrestricted) / df1) / (var_unrestricted / df2)
         return float(1 - stats.f.cdf(f_statistic, df1, df2))
 
+    @staticmethod
+    def _orthonormal_basis(x: np.ndarray, scale: float) -> np.ndarray | None:
+        """Gets an orthonormal basis for the columns of `x` from a QR decomposition, or None if `x` is rank-deficient"""
+        q, r = np.linalg.qr(x)
+        diag = np.abs(np.diag(r))
+        if len(diag) == 0 or diag.min() <= scale * max(x.shape) * np.finfo(float).eps:
+            return None
+        return q
+
+    @staticmethod
+    def _least_squares_residuals(y: np.ndarray, x: np.ndarray) -> np.ndarray:
+        """Gets residuals from a least squares fit using the pseudo-inverse, which also handles rank-deficient `x`"""
+        return y - x @ (np.linalg.pinv(x) @ y)
+
+    def _restricted_residuals(self, y: np.ndarray, x: np.ndarray) -> tuple[np.ndarray, np.ndarray | None]:
+        """Fits the restricted (self) model, returning the residuals and orthonormal basis of the predictors"""
+        q = self._orthonormal_basis(x, np.linalg.norm(x, axis=0).max())
+        if q is None:
+            return self._least_squares_residuals(y, x), None
+        return y - q @ (q.T @ y), q
+
+    def _unrestricted_residuals(
+            self,
+            resid_restricted: np.ndarray,
+            q: np.ndarray | None,
+            y: np.ndarray,
+            x_restricted: np.ndarray,
+            x_partner: np.ndarray
+    ) -> np.ndarray:
+        """Adds partner terms to a fitted restricted model, updating its QR decomposition with Gram-Schmidt"""
+        if q is not None:
+            # Orthogonalise the partner terms against the restricted model: we do this twice for numerical stability
+            z = x_partner - q @ (q.T @ x_partner)
+            z -= q @ (q.T @ z)
+            qz = self._orthonormal_basis(z, np.linalg.norm(x_partner, axis=0).max())
+            # Remove the part of the restricted residuals that can be explained by the partner terms
+            if qz is not None:
+                return resid_restricted - qz @ (qz.T @ resid_restricted)
+        # If any of our predictors are collinear, fit the unrestricted model from scratch
+        return self._least_squares_residuals(y, np.column_stack([x_restricted, x_partner]))
+
+    @staticmethod
+    def _information_criteria(resid: np.ndarray, k: int) -> tuple[float, float]:
+        """Gets the Akaike and Bayesian information criteria for a linear model with `k` parameters"""
+        n = len(resid)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            llf = -n / 2 * np.log(2 * np.pi) - n / 2 * np.log(np.dot(resid, resid) / n) - n / 2
+        return -2 * llf + 2 * k, -2 * llf + np.log(n) * k
+
+    def compute_granger_sweep(
+            self,
+            my_beats: pd.Series,
+            their_beats: pd.DataFrame | pd.Series,
+            orders: list[int] = None,
+            **kwargs
+    ) -> pd.DataFrame:
+        """Compute Granger indexes for every partner instrument and model order in a single pass.
+
+        Data is formatted once for the highest order, with lower orders using a subset of the lagged terms. For every
+        order, the restricted (self) model is fitted once, and the partner terms for each instrument are added to it by
+        updating its QR decomposition. If a partner has missing values, the unrestricted model uses fewer observations
+        than the restricted model, and is instead fitted separately.
+
+        Arguments:
+            my_beats (pd.Series): onsets of instrument to model
+            their_beats (pd.DataFrame | pd.Series): onsets of remaining instrument(s)
+            orders (list[int], optional): the model orders to compute, defaults to `[self.order]`
+            **kwargs: keyword arguments passed to `PhaseCorrection`
+
+        Returns:
+            pd.DataFrame: Granger index, p-value, number of observations, and information criteria for the restricted
+                and unrestricted models, with one row for every combination of order and partner instrument
+
+        """
+        if isinstance(their_beats, pd.Series):
+            their_beats = pd.DataFrame(their_beats)
+        orders = [self.order] if orders is None else sorted(orders)
+        # Format the data for the highest order model once: this includes all the lagged terms for lower orders
+        pc = PhaseCorrection(my_beats, their_beats, order=max(orders), fit=False, **kwargs)
+        y, x = pc.get_model_inputs(my_beats, their_beats)
+        y = y.to_numpy(dtype=float)
+
+        def get_lags(prefix: str, order: int) -> np.ndarray:
+            """Gets an array of all lagged terms up to the given order"""
+            return x[[f'{prefix}_lag{i}' for i in range(order)]].to_numpy(dtype=float)
+
+        res = []
+        for order in orders:
+            xr = np.column_stack([np.ones(len(y)), get_lags(f'{my_beats.name}_prev_ioi', order)])
+            valid_r = ~np.isnan(y) & ~np.isnan(xr).any(axis=1)
+            # Fit the restricted (self) model once for all partner instruments
+            if valid_r.any():
+                resid_r, q = self._restricted_residuals(y[valid_r], xr[valid_r])
+                aic_r, bic_r = self._information_criteria(resid_r, xr.shape[1])
+            for partner_instrument in their_beats.columns:
+                xp = get_lags(f'{my_beats.name}_{partner_instrument}_asynchrony', order)
+                valid_u = valid_r & ~np.isnan(xp).any(axis=1)
+                # In the case of either model breaking (i.e. if we have no values), return NaN for everything
+                if not valid_u.any():
+                    res.append(dict(order=order, instrument=partner_instrument))
+                    continue
+                # We can only update the restricted model when both models use the same observations
+                if valid_u.sum() == valid_r.sum():
+                    resid_u = self._unrestricted_residuals(resid_r, q, y[valid_u], xr[valid_u], xp[valid_u])
+                else:
+                    resid_u = self._least_squares_residuals(y[valid_u], np.column_stack([xr, xp])[valid_u])
+                aic_u, bic_u = self._information_criteria(resid_u, xr.shape[1] + xp.shape[1])
+                # Extract the variance from both models
+                var_restricted, var_unrestricted = np.var(resid_r), np.var(resid_u)
+                res.append(dict(
+                    order=order,
+                    instrument=partner_instrument,
+                    # The log of the ratio between the variance of the model residuals
+                    granger_causality_i=np.log(var_restricted / var_unrestricted),
+                    # Carry out the Fisher test and obtain a p-value
+                    granger_causality_p=self.compute_fisher_test(
+                        var_restricted, var_unrestricted, int(valid_r.sum()), order=order
+                    ),
+                    nobs_restricted=int(valid_r.sum()),
+                    nobs_unrestricted=int(valid_u.sum()),
+                    aic_restricted=aic_r,
+                    aic_unrestricted=aic_u,
+                    bic_restricted=bic_r,
+                    bic_unrestricted=bic_u,
+                ))
+        return pd.DataFrame(res, columns=[
+            'order', 'instrument', 'granger_causality_i', 'granger_causality_p', 'nobs_restricted',
+            'nobs_unrestricted', 'aic_restricted', 'aic_unrestricted', 'bic_restricted', 'bic_unrestricted'
+        ])
+
+    @staticmethod
+    def select_order(sweep: pd.DataFrame, criterion: str = 'aic') -> pd.Series:
+        """Selects the order with the lowest information criterion for the unrestricted model of every partner
+
+        Arguments:
+            sweep (pd.DataFrame): the output from `compute_granger_sweep`
+            criterion (str, optional): either "aic" (default) or "bic"
+
+        Returns:
+            pd.Series: the selected order, indexed by partner instrument
+
+        """
+        col = f'{criterion}_unrestricted'
+        sweep = sweep.dropna(subset=[col])
+        return sweep.loc[sweep.groupby('instrument')[col].idxmin()].set_index('instrument')['order']
+
     def compute_granger_index(self, my_beats, their_beats, **kwargs) -> tuple[float, float]:
         """Compute the Granger index between a restricted (self) and unrestricted (joint) model"""
         # TODO: think about whether we want to compute GCI at every lag UP TO self.order and use smallest,
         #  or just at self.order (current)
-        # Create the restricted (self) model: just the self-coupling term(s)
-        restricted_model = PhaseCorrection(my_beats, order=self.order, **kwargs).model
-        # Create the unrestricted (joint) model: the self-coupling and partner-coupling terms
-        unrestricted_model = PhaseCorrection(my_beats, their_beats, order=self.order, **kwargs).model
-        # In the case of either model breaking (i.e. if we have no values), return NaN for both GCI and p
-        if restricted_model is None or unrestricted_model is None:
-            return np.nan, np.nan
-        # Otherwise, extract the variance from both models
-        var_restricted = np.nanvar(restricted_model.resid)
-        var_unrestricted = np.nanvar(unrestricted_model.resid)
-        # Calculate the Granger-causality index: the log of the ratio between the variance of the model residuals
-        gci = np.log(var_restricted / var_unrestricted)
-        # Carry out the Fisher test and obtain a p-value
-        p = self.compute_fisher_test(var_restricted, var_unrestricted, restricted_model.nobs)
-        return gci, p
-
-    def compute_granger_indexes(self, my_beats, their_beats: pd.DataFrame, **kwargs) -> dict:
+        sweep = self.compute_granger_sweep(my_beats, their_beats, **kwargs)
+        return sweep['granger_causality_i'].iloc[0], sweep['granger_causality_p'].iloc[0]
+
+    def compute_granger_indexes(
+            self,
+            my_beats,
+            their_beats: pd.DataFrame,
+            sweep: pd.DataFrame = None,
+            **kwargs
+    ) -> dict:
         """Compute Granger indexes for given input array and all async arrays, i.e. for both possible leaders in trio"""
+        if sweep is None:
+            sweep = self.compute_granger_sweep(my_beats, their_beats, **kwargs)
+        sweep = sweep[sweep['order'] == self.order].set_index('instrument')
         di = {'granger_causality_order': self.order}
         for instrument in utils.INSTRUMENTS_TO_PERFORMER_ROLES.keys():
             # We can't compute Granger causality in relation to our own performance, so we yield an empty dictionary
@@ -699,14 +1228,92 @@ class GrangerCausality(BaseExtractor):
                     f'granger_causality_{my_beats.name}_p': np.nan,
                 })
             else:
-                gci, p = self.compute_granger_index(my_beats, their_beats[instrument], **kwargs)
                 di.update({
-                    f'granger_causality_{instrument}_i': gci,
-                    f'granger_causality_{instrument}_p': p,
+                    f'granger_causality_{instrument}_i': sweep.loc[instrument, 'granger_causality_i'],
+                    f'granger_causality_{instrument}_p': sweep.loc[instrument, 'granger_causality_p'],
                 })
         return di
 
 
+def lagged_correlations(
+        x: np.ndarray,
+        ys: np.ndarray,
+        lags: list[int],
+        z: np.ndarray = None,
+        x_lag: int = 0
+) -> dict[str, np.ndarray]:
+    """Correlates `x` with lagged values of every column of `ys`, at every lag, from one set of covariance matrices.
+
+    For every lag `k` and column `j`, this correlates `x[t + x_lag]` with `ys[t - k, j]`. If `z` is provided, the
+    partial correlation is calculated instead, controlling for `z[t - k]`. Every correlation only uses observations
+    where all of its variables are present (i.e. as if calling `pd.DataFrame.dropna` first). The lagged variables are
+    stacked into one array, such that the (masked) covariance matrices for every lag and column are obtained together.
+
+    Arguments:
+        x (np.ndarray): dependent variable, with shape (n_observations,)
+        ys (np.ndarray): independent variables, with shape (n_observations, n_columns)
+        lags (list[int]): lags to calculate correlations at
+        z (np.ndarray, optional): control variable, with shape (n_observations,), lagged in the same way as `ys`
+        x_lag (int, optional): lead applied to `x`, e.g. 1 to predict the next value, defaults to 0
+
+    Returns:
+        dict[str, np.ndarray]: correlation coefficients (`r`), p-values (`p`) and number of observations (`n`), each
+            with shape (n_lags, n_columns)
+
+    """
+    def shift(arr: np.ndarray, periods: int) -> np.ndarray:
+        """Shifts an array forwards by a number of periods (or backwards, if negative), like `pd.Series.shift`"""
+        shifted = np.full(arr.shape, np.nan)
+        n = len(arr)
+        if abs(periods) < n:
+            if periods >= 0:
+                shifted[periods:] = arr[:n - periods]
+            else:
+                shifted[:periods] = arr[-periods:]
+        return shifted
+
+    x = shift(np.asarray(x, dtype=float), -x_lag)
+    ys = np.asarray(ys, dtype=float)
+    # We give the number of columns explicitly, so that empty series can still be reshaped
+    ys = ys.reshape(len(x), ys.shape[1] if ys.ndim > 1 else 1)
+    n_lags, n_cols = len(lags), ys.shape[1]
+    # Stack our variables, with shape (n_variables, n_lags, n_observations, n_columns)
+    variables = [
+        np.broadcast_to(x[None, :, None], (n_lags, len(x), n_cols)),
+        np.stack([shift(ys, lag) for lag in lags])
+    ]
+    if z is not None:
+        z = np.asarray(z, dtype=float)
+        variables.append(np.broadcast_to(np.stack([shift(z, lag) for lag in lags])[:, :, None], variables[1].shape))
+    variables = np.stack(variables)
+    # Only use observations where every variable is present
+    valid = ~np.isnan(variables).any(axis=0)
+    n = valid.sum(axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        # Centre every variable on its mean, then get covariance matrices with shape (n_lags, n_cols, n_vars, n_vars)
+        means = np.where(valid, variables, 0.).sum(axis=2) / n
+        centred = np.where(valid, variables - means[:, :, None, :], 0.)
+        cov = np.einsum('alnc,blnc->lcab', centred, centred)
+        sd = np.sqrt(np.diagonal(cov, axis1=2, axis2=3))
+        corr = cov / (sd[..., :, None] * sd[..., None, :])
+        xy = corr[..., 0, 1]
+        # Following `scipy.stats.pearsonr`, we clip correlations to account for floating point errors
+        if z is None:
+            r, k = np.clip(xy, -1., 1.), 0
+        # The results here should be identical to those given by the `pingouin.partial_corr` function
+        else:
+            xz, yz = corr[..., 0, 2], corr[..., 1, 2]
+            r, k = (xy - (xz * yz)) / np.sqrt((1 - xz ** 2) * (1 - yz ** 2)), 1
+        # Get p-values from a t-test, with degrees of freedom reduced by the number of control variables
+        dof = n - k - 2
+        tval = r * np.sqrt(dof / (1 - r ** 2))
+        p = np.where(dof > 0, 2 * stats.t.sf(np.abs(tval), np.maximum(dof, 1)), np.nan)
+    # Following `scipy.stats.pearsonr`, a perfect correlation from two observations has a p-value of 1
+    if z is None:
+        p = np.where((dof == 0) & ~np.isnan(r), 1., p)
+    return dict(r=np.where(n >= 2, r, np.nan), p=np.where(n >= 2, p, np.nan), n=n)
+
+
 class PartialCorrelation(BaseExtractor):
     """Extracts various features related to partial correlation between inter-onset intervals and onset asynchrony.
 
@@ -718,6 +1325,8 @@ class PartialCorrelation(BaseExtractor):
         my_beats (pd.Series): onsets of instrument to model
         their_beats (pd.DataFrame | pd.Series): onsets of remaining instrument(s)
         order (int, optional): number of lag terms to calculate, defaults to 1
+        max_order (int, optional): if provided, partial correlations are also computed for every order up to this value
+            and stored in `sweep`
         iqr_filter (bool, optional): apply an iqr filter to inter-onset intervals, defaults to False
         difference_iois (bool, optional): whether to detrend inter-onset intervals via differencing, defaults to True
 
@@ -732,7 +1341,10 @@ class PartialCorrelation(BaseExtractor):
     def __init__(self, my_beats: pd.Series, their_beats: pd.DataFrame | pd.Series, order: int = 1, **kwargs):
         super().__init__()
         self.order = order
-        self.summary_dict = self.extract_partial_correlations(my_beats, their_beats, **kwargs)
+        # Compute partial correlations for every order we need in a single pass
+        orders = range(1, max(kwargs.get('max_order') or order, order) + 1) if 'max_order' in kwargs else [order]
+        self.sweep = self.compute_partial_correlation_sweep(my_beats, their_beats, orders=orders, **kwargs)
+        self.summary_dict = self.extract_partial_correlations(my_beats, their_beats, sweep=self.sweep, **kwargs)
 
     @staticmethod
     def partial_correlation(x: pd.Series, y: pd.Series, z: pd.Series):
@@ -759,22 +1371,65 @@ class PartialCorrelation(BaseExtractor):
         tval = r * np.sqrt(dof / (1 - r ** 2))
         return 2 * stats.t.sf(np.abs(tval), dof)
 
+    def get_differenced_iois(self, my_beats: pd.Series, **kwargs) -> np.ndarray:
+        """Gets (differenced) inter-onset intervals from onsets, applying any filtering as required"""
+        # Get our initial inter-onset interval values
+        my_differenced_iois = my_beats.diff()
+        # Apply any filtering and further differencing as required
+        if kwargs.get('difference_iois', self.difference_iois):
+            my_differenced_iois = my_differenced_iois.diff()
+        if kwargs.get('iqr_filter', self.iqr_filter):
+            my_differenced_iois = utils.iqr_filter(my_differenced_iois, fill_nans=True)
+        return np.asarray(my_differenced_iois, dtype=float)
+
+    def compute_partial_correlation_sweep(
+            self,
+            my_beats: pd.Series,
+            their_beats: pd.DataFrame | pd.Series,
+            orders: list[int] = None,
+            **kwargs
+    ) -> pd.DataFrame:
+        """Compute partial correlations for every partner instrument and lag in a single pass.
+
+        Arguments:
+            my_beats (pd.Series): onsets of instrument to model
+            their_beats (pd.DataFrame | pd.Series): onsets of remaining instrument(s)
+            orders (list[int], optional): the lags to compute, defaults to `[self.order]`
+            **kwargs: keyword arguments passed to `get_differenced_iois`
+
+        Returns:
+            pd.DataFrame: partial correlation coefficient, p-value, and number of observations, with one row for every
+                combination of lag and partner instrument
+
+        """
+        if isinstance(their_beats, pd.Series):
+            their_beats = pd.DataFrame(their_beats)
+        orders = [self.order] if orders is None else sorted(orders)
+        my_differenced_iois = self.get_differenced_iois(my_beats, **kwargs)
+        # Get the asynchrony values between every other instrument and ours
+        my_asynchronies = their_beats.to_numpy(dtype=float) - my_beats.to_numpy(dtype=float)[:, None]
+        # TODO: think about labelling of lag terms: is lag 0 really lag 0?
+        # We predict our next inter-onset intervals from our lagged asynchronies, controlling for our lagged intervals
+        corr = lagged_correlations(my_differenced_iois, my_asynchronies, orders, z=my_differenced_iois, x_lag=1)
+        return pd.DataFrame(dict(
+            order=np.repeat(orders, their_beats.shape[1]),
+            instrument=np.tile(their_beats.columns, len(orders)),
+            partial_corr_r=corr['r'].ravel(),
+            partial_corr_p=corr['p'].ravel(),
+            partial_corr_n=corr['n'].ravel(),
+        ))
+
     def extract_partial_correlations(
             self,
             my_beats: pd.Series,
             their_beats: pd.DataFrame | pd.Series,
+            sweep: pd.DataFrame = None,
             **kwargs
     ) -> dict:
         """Extracts partial correlation between inter-onset intervals and onset asynchrony at required lags"""
-        # Get our initial inter-onset interval values
-        my_differenced_iois = my_beats.diff()
-        # Apply any filtering and further differencing as required
-        if kwargs.get('difference_iois', self.difference_iois):
-            my_differenced_iois = my_differenced_iois.diff()
-        if kwargs.get('iqr_filter', self.iqr_filter):
-            my_differenced_iois = pd.Series(utils.iqr_filter(my_differenced_iois, fill_nans=True))
-        # Get our next inter-onset intervals: this is what we'll be predicting
-        my_next_iois = my_differenced_iois.shift(-1)
+        if sweep is None:
+            sweep = self.compute_partial_correlation_sweep(my_beats, their_beats, **kwargs)
+        sweep = sweep[sweep['order'] == self.order].set_index('instrument')
         di = {'partial_corr_order': self.order}
         # Iterate through all instruments played by the other instruments in our group
         for instrument in utils.INSTRUMENTS_TO_PERFORMER_ROLES.keys():
@@ -785,30 +1440,27 @@ class PartialCorrelation(BaseExtractor):
                     f'partial_corr_{instrument}_n': np.nan,
                 })
             else:
-                # Get the asynchrony values between that instrument and ours
-                my_asynchronies = their_beats[instrument] - my_beats
-                # TODO: think about labelling of lag terms: is lag 0 really lag 0?
-                # Shift our asynchronies and interval variables by the required lag term
-                my_prev_asynchronies = my_asynchronies.shift(self.order)    # Independent variable
-                my_prev_iois = my_differenced_iois.shift(self.order)    # Control variable
-                # Construct the dataframe, drop NaN values, and set column titles
-                df = pd.concat([my_next_iois, my_prev_asynchronies, my_prev_iois], axis=1).dropna()
-                df.columns = ['my_next_iois', 'my_prev_asynchronies', 'my_prev_iois']
-                # Create the partial correlation matrix and extract p-value
-                # The results here should be identical to those given by the `pingouin.partial_corr` function
-                pcorr = self.partial_correlation(x=df.my_next_iois, y=df.my_prev_asynchronies, z=df.my_prev_iois)
-                pval = self.pvalue(df.shape[0], df.shape[1] - 2, pcorr)
-                # Yield the results in a nice dictionary format
                 di.update({
-                    f'partial_corr_{instrument}_r': pcorr,
-                    f'partial_corr_{instrument}_p': pval,
-                    f'partial_corr_{instrument}_n': df.shape[0],
+                    f'partial_corr_{instrument}_r': sweep.loc[instrument, 'partial_corr_r'],
+                    f'partial_corr_{instrument}_p': sweep.loc[instrument, 'partial_corr_p'],
+                    f'partial_corr_{instrument}_n': int(sweep.loc[instrument, 'partial_corr_n']),
                 })
         return di
 
 
 class CrossCorrelation(BaseExtractor):
-    """Extract features related to the cross-correlation of inter-onset intervals and onset asynchrony"""
+    """Extract features related to the cross-correlation of inter-onset intervals and onset asynchrony
+
+    Args:
+        my_beats (pd.Series): onsets of instrument to model
+        their_beats (pd.DataFrame | pd.Series): onsets of remaining instrument(s)
+        order (int, optional): lag to calculate cross-correlation at, defaults to 1
+        max_order (int, optional): if provided, cross-correlations are also computed for every lag up to this value and
+            stored in `sweep`
+        iqr_filter (bool, optional): apply an iqr filter to inter-onset intervals, defaults to False
+        difference_iois (bool, optional): whether to detrend inter-onset intervals via differencing, defaults to True
+
+    """
     difference_iois = True
     iqr_filter = False
 
@@ -817,16 +1469,60 @@ class CrossCorrelation(BaseExtractor):
         if not isinstance(their_beats, pd.DataFrame):
             their_beats = pd.DataFrame(their_beats)
         self.order = order
-        self.summary_dict = self.extract_cross_correlations(my_beats, their_beats, **kwargs)
+        # Compute cross-correlations for every lag we need in a single pass
+        orders = range(1, max(kwargs.get('max_order') or order, order) + 1) if 'max_order' in kwargs else [order]
+        self.sweep = self.compute_cross_correlation_sweep(my_beats, their_beats, orders=orders, **kwargs)
+        self.summary_dict = self.extract_cross_correlations(my_beats, their_beats, sweep=self.sweep, **kwargs)
+
+    def compute_cross_correlation_sweep(
+            self,
+            my_beats: pd.Series,
+            their_beats: pd.DataFrame,
+            orders: list[int] = None,
+            **kwargs
+    ) -> pd.DataFrame:
+        """Compute cross-correlations for every partner instrument and lag in a single pass.
+
+        Arguments:
+            my_beats (pd.Series): onsets of instrument to model
+            their_beats (pd.DataFrame): onsets of remaining instrument(s)
+            orders (list[int], optional): the lags to compute, defaults to `[self.order]`
+            **kwargs: can include `difference_iois` and `iqr_filter`
 
-    def extract_cross_correlations(self, my_beats: pd.Series, their_beats: pd.DataFrame, **kwargs) -> dict:
-        """Extract cross correlation coefficients at all lags up to `self.order`"""
+        Returns:
+            pd.DataFrame: correlation coefficient, p-value, and number of observations, with one row for every
+                combination of lag and partner instrument
+
+        """
+        orders = [self.order] if orders is None else sorted(orders)
         # Get inter-onset intervals from onsets and apply any additional filtering needed
         my_iois = my_beats.diff()
         if kwargs.get('difference_iois', self.difference_iois):
             my_iois = my_iois.diff()
         if kwargs.get('iqr_filter', self.iqr_filter):
-            my_iois = pd.Series(utils.iqr_filter(my_iois, fill_nans=True))
+            my_iois = utils.iqr_filter(my_iois, fill_nans=True)
+        # Get the asynchronies between us and every other instrument, then correlate them with our IOIs at every lag
+        asynchronies = their_beats.to_numpy(dtype=float) - my_beats.to_numpy(dtype=float)[:, None]
+        corr = lagged_correlations(np.asarray(my_iois, dtype=float), asynchronies, orders)
+        return pd.DataFrame(dict(
+            order=np.repeat(orders, their_beats.shape[1]),
+            instrument=np.tile(their_beats.columns, len(orders)),
+            cross_corr_r=corr['r'].ravel(),
+            cross_corr_p=corr['p'].ravel(),
+            cross_corr_n=corr['n'].ravel(),
+        ))
+
+    def extract_cross_correlations(
+            self,
+            my_beats: pd.Series,
+            their_beats: pd.DataFrame,
+            sweep: pd.DataFrame = None,
+            **kwargs
+    ) -> dict:
+        """Extract cross correlation coefficients at lag `self.order`"""
+        if sweep is None:
+            sweep = self.compute_cross_correlation_sweep(my_beats, their_beats, **kwargs)
+        sweep = sweep[sweep['order'] == self.order].set_index('instrument')
         di = {'cross_corr_order': self.order}
         # Iterate through each instrument
         for instrument in utils.INSTRUMENTS_TO_PERFORMER_ROLES.keys():
@@ -838,22 +1534,12 @@ class CrossCorrelation(BaseExtractor):
                     f'cross_corr_{instrument}_p': np.nan,
                     f'cross_corr_{instrument}_n': np.nan,
                 })
+            # If we have fewer than 2 values, we can't calculate r, so we'll return NaN
             else:
-                # Get the asynchronies between us and this instrument
-                asynchronies = their_beats[instrument] - my_beats
-                # Lag the asynchronies, concatenate with IOIs, and drop NaN values
-                combined = pd.concat([my_iois, asynchronies.shift(self.order)], axis=1).dropna()
-                combined.columns = ['iois', 'asynchronies']
-                # If, after dropping NaN values, we have fewer than 2 values, we can't calculate r, so return NaN
-                if len(combined) < 2:
-                    r, p = np.nan, np.nan
-                # Otherwise, compute the correlation and return the necessary statistics
-                else:
-                    r, p = stats.pearsonr(combined['iois'], combined['asynchronies'])
                 di.update({
-                    f'cross_corr_{instrument}_r': r,
-                    f'cross_corr_{instrument}_p': p,
-                    f'cross_corr_{instrument}_n': int(combined.shape[0]),
+                    f'cross_corr_{instrument}_r': sweep.loc[instrument, 'cross_corr_r'],
+                    f'cross_corr_{instrument}_p': sweep.loc[instrument, 'cross_corr_p'],
+                    f'cross_corr_{instrument}_n': int(sweep.loc[instrument, 'cross_corr_n']),
                 })
         return di
 
@@ -871,25 +1557,45 @@ class IOIComplexity(BaseExtractor):
             tempo: float,
             time_signature: int,
             bar_period: int = 4,
+            **kwargs
     ):
         super().__init__()
         # Set attributes
         self.bar_period = bar_period
         self.quarter_note = 60 / tempo
         self.time_signature = time_signature
-        # Extract event density
-        self.binned_iois = pd.DataFrame(self.bin_iois(my_onsets, downbeats))
-        self.complexity_df = pd.DataFrame(self.extract_complexity(self.binned_iois), columns=self.col_names)
+        # Bin every IOI once, then get the start and end of every window of `bar_period` bars
+        codes, lo, hi = self.get_windowed_codes(
+            my_onsets, downbeats, bounds=kwargs.get('window_bounds', None), iois=kwargs.get('iois', None)
+        )
+        self.binned_iois = self.bin_iois(codes, lo, hi)
+        # Extract complexity and density for every window
+        windows, lz77, n_onsets = self.extract_complexity(codes, lo, hi)
+        self.complexity_df = pd.DataFrame(
+            dict(zip(self.col_names, (self._get_bar_ranges(windows), lz77, n_onsets)))
+        ) if len(windows) > 0 else pd.DataFrame([], columns=self.col_names)
         # Update our summary dictionary
         self.summary_dict['bar_period'] = bar_period
         self.summary_dict['window_count'] = len(self.complexity_df)
         self.summary_dict['ioi_count'] = len(np.diff(my_onsets))
         self.summary_dict.update(**self._get_summary_dict())
 
+    @classmethod
+    def from_grid(cls, grid: BeatGrid, instr: str, bar_period: int = 4):
+        """Creates the extractor from a `BeatGrid`, reusing its bar windows for the onsets of `instr`"""
+        return cls(
+            grid.get_onsets(instr), grid.downbeats, grid.tempo, grid.time_signature, bar_period=bar_period,
+            window_bounds=grid.get_bar_bounds(instr, bar_period), iois=grid.get_iois(instr)
+        )
+
     def _get_summary_dict(self) -> dict:
         """Gets summary variables for this feature"""
         return utils.flatten_dict(self.complexity_df[['lz77', 'n_onsets']].agg(['mean', 'std']).to_dict())
 
+    def _get_bar_ranges(self, windows: np.array) -> list[str]:
+        """Gets the string label for each window, i.e. the first and last bar it spans"""
+        return [f'{i + 1}_{i + self.bar_period + 1}' for i in windows]
+
     def _bin_ioi(self, ioi: float) -> float:
         """Bins an IOI as a proportion of a quarter note at the given time signature"""
         proportional_ioi = (ioi / self.quarter_note) / self.time_signature
@@ -900,61 +1606,162 @@ class IOIComplexity(BaseExtractor):
         else:
             return min(self.fracs, key=lambda x: abs(x - proportional_ioi))
 
-    def bin_iois(self, my_onsets: np.array, downbeats: np.array) -> list:
-        """Bins all IOIs within `my_onsets` according to the beats in `downbeats`"""
-        # Iterate over
-        for i in range(len(downbeats) - self.bar_period):
-            first_bar = downbeats[i]
-            last_bar = downbeats[i + self.bar_period]
-            iois_bar = np.ediff1d(self.get_between(my_onsets, first_bar, last_bar))
-            binned_iois = np.array([self._bin_ioi(i) for i in iois_bar])
-            binned_iois_clean = binned_iois[~np.isnan(binned_iois)]
-            for binned_ioi in binned_iois_clean:
-                yield dict(
-                    bar_range=f'{i + 1}_{i + self.bar_period + 1}',
-                    binned_ioi=binned_ioi,
-                    binned_ascii=self.alphabet[self.fracs.index(binned_ioi)]
-                )
+    def bin_ioi_codes(self, iois: np.array) -> np.ndarray:
+        """Bins an array of IOIs, returning the index of the nearest value in `fracs` for each, or -1 if invalid"""
+        proportional_iois = (np.asarray(iois, dtype=float) / self.quarter_note) / self.time_signature
+        # `argmin` returns the first index in case of ties, same as calling `min` on `fracs`
+        codes = np.abs(np.array(self.fracs)[None, :] - proportional_iois[:, None]).argmin(axis=1)
+        # If somehow the IOI is greater than one measure, it is invalid
+        codes[~(proportional_iois <= 1)] = -1
+        return codes
+
+    def get_windowed_codes(
+            self,
+            my_onsets: np.array,
+            downbeats: np.array,
+            bounds: tuple[np.ndarray, np.ndarray] = None,
+            iois: np.array = None
+    ) -> tuple[np.ndarray, ...]:
+        """Bins every IOI in `my_onsets` once, and gets the IOIs spanned by every window of `bar_period` downbeats.
+
+        Arguments:
+            my_onsets (np.array): the array of onsets, may contain NaN values
+            downbeats (np.array): the array of downbeats, may contain NaN values
+            bounds (tuple, optional): precomputed indices of the onsets within every window, e.g. from
+                `BeatGrid.get_bar_bounds`
+            iois (np.array, optional): precomputed IOIs between the sorted onsets, e.g. from `BeatGrid.get_iois`
+
+        Returns:
+            tuple[np.ndarray, ...]: the binned code for every IOI (-1 for invalid IOIs), and the index of the first
+                and (one past the) last IOI in each window, such that the codes for window `i` are `codes[lo[i]:hi[i]]`
+
+        """
+        ons = np.sort(np.asarray(my_onsets, dtype=float))
+        ons = ons[~np.isnan(ons)]
+        downbeats = np.asarray(downbeats, dtype=float)
+        codes = self.bin_ioi_codes(np.diff(ons) if iois is None else iois)
+        # Get the indices of the first and last onset within each window, inclusive of both downbeats
+        # Windows with missing downbeats don't contain any onsets
+        if bounds is None:
+            n_windows = max(len(downbeats) - self.bar_period, 0)
+            bounds = get_window_bounds(
+                ons, downbeats[:n_windows], downbeats[self.bar_period:self.bar_period + n_windows]
+            )
+        lo, hi = bounds
+        # IOIs within each window are those between consecutive onsets, so we end one before the final onset
+        return codes, lo, np.maximum(hi - 1, lo)
+
+    def bin_iois(self, codes: np.array, lo: np.array, hi: np.array) -> pd.DataFrame:
+        """Creates a dataframe of all valid binned IOIs in every window, from the output of `get_windowed_codes`"""
+        lengths = hi - lo
+        # Get the index of every IOI in every window, with the window it belongs to
+        windows = np.repeat(np.arange(len(lo)), lengths)
+        idx = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths) + np.repeat(lo, lengths)
+        window_codes = codes[idx]
+        valid = window_codes >= 0
+        windows, window_codes = windows[valid], window_codes[valid]
+        return pd.DataFrame(dict(
+            bar_range=self._get_bar_ranges(windows),
+            binned_ioi=np.array(self.fracs)[window_codes],
+            binned_ascii=np.array(self.alphabet)[window_codes].astype(object)
+        ))
 
     @staticmethod
     def lz77_compress(data: np.array, window_size: int = 4096) -> list:
-        """Runs the LZ77 compression algorithm over the input `data`, with given `window_size`"""
+        """Runs the LZ77 compression algorithm over the input `data`, with given `window_size`.
+
+        At every position we need the longest substring starting here that also occurs entirely within the preceding
+        window, preferring the most recent occurrence when there are several. Rather than testing every possible length
+        with `str.rfind`, we keep a hash chain mapping each symbol to the positions it occurs at, and only extend
+        matches from those candidate positions, walking backwards from the most recent.
+
+        Arguments:
+            data (str): the string (or any other indexable sequence of symbols) to compress
+            window_size (int, optional): the size of the sliding window, defaults to 4096
+
+        Returns:
+            list: (offset, length, next_character) tuples
+
+        """
+        n = len(data)
         compressed = []
+        # Hash chain: maps each symbol to the (ascending) positions where it occurs in the data we've already seen
+        chains = {}
+        inserted = 0
         index = 0
-        while index < len(data):
-            best_offset = -1
-            best_length = -1
-            best_match = ''
-            # Search for the longest match in the sliding window
-            for length in range(1, min(len(data) - index, window_size)):
-                substring = data[index:index + length]
-                offset = data.rfind(substring, max(0, index - window_size), index)
-                if offset != -1 and length > best_length:
-                    best_offset = index - offset
-                    best_length = length
-                    best_match = substring
-            if best_match:
-                # Add the (offset, length, next_character) tuple to the compressed data
-                compressed.append((best_offset, best_length, data[index + best_length]))
-                index += best_length + 1
-            else:
-                # No match found, add a zero-offset tuple
-                compressed.append((0, 0, data[index]))
-                index += 1
+        while index < n:
+            # Add every position before the current one into the hash chain
+            while inserted < index:
+                chains.setdefault(data[inserted], []).append(inserted)
+                inserted += 1
+            # The match must leave room for the next character and must lie entirely within the window
+            max_length = min(n - index, window_size) - 1
+            start = max(0, index - window_size)
+            best_offset, best_length = 0, 0
+            if max_length > 0:
+                # Iterate through candidates from the most recent, so we keep the closest of any equal-length matches
+                for pos in reversed(chains.get(data[index], ())):
+                    if pos < start:
+                        break
+                    # The match can't overlap the current position
+                    limit = min(max_length, index - pos)
+                    if limit <= best_length:
+                        continue
+                    length = 1
+                    while length < limit and data[pos + length] == data[index + length]:
+                        length += 1
+                    if length > best_length:
+                        best_offset, best_length = index - pos, length
+                        if best_length == max_length:
+                            break
+            # Add the (offset, length, next_character) tuple to the compressed data: offset is zero if no match found
+            compressed.append((best_offset, best_length, data[index + best_length]))
+            index += best_length + 1
         return compressed
 
-    def extract_complexity(self, binned_iois: np.array) -> Generator:
-        """Extracts complexity scores for all inter-onset intervals in `binned_iois`"""
-        # If we don't have any inter-onset intervals, return empty lists
-        if len(binned_iois) == 0:
-            return [], [], [], []
-        # Otherwise, calculate the LZ77 and density scores for each of our windows
-        for idx, grp in binned_iois.groupby('bar_range', sort=False):
-            # This converts all the ascii representations to a single string
-            ascii_ = ''.join(grp['binned_ascii'].to_list())
-            # lz77 compression
-            compressed = self.lz77_compress(ascii_)
-            yield idx, len(compressed), len(ascii_)
+    @classmethod
+    def lz77_compress_batch(cls, windows: list, window_size: int = 4096) -> list[list]:
+        """Runs LZ77 compression over every window in `windows`, compressing each distinct window only once.
+
+        Overlapping windows from the same track frequently contain identical sequences of binned IOIs, so results are
+        memoised for the duration of the call.
+
+        Arguments:
+            windows (list): strings (or other hashable sequences of symbols) to compress
+            window_size (int, optional): the size of the sliding window, defaults to 4096
+
+        Returns:
+            list[list]: the (offset, length, next_character) tuples for each window, in the same order as `windows`
+
+        """
+        cache = {}
+        res = []
+        for window in windows:
+            if window not in cache:
+                cache[window] = cls.lz77_compress(window, window_size)
+            res.append(cache[window])
+        return res
+
+    def extract_complexity(self, codes: np.array, lo: np.array, hi: np.array) -> tuple[np.ndarray, ...]:
+        """Extracts complexity scores for every window of binned IOIs, from the output of `get_windowed_codes`
+
+        Returns:
+            tuple[np.ndarray, ...]: the index of each window containing valid IOIs, the number of LZ77 triples in each
+                window (complexity), and the number of valid IOIs in each window (density)
+
+        """
+        alphabet = np.array(self.alphabet)
+        windows, strings = [], []
+        for i, (start, end) in enumerate(zip(lo, hi)):
+            # This converts all the valid codes in this window to a single ascii string
+            window_codes = codes[start:end]
+            window_codes = window_codes[window_codes >= 0]
+            if len(window_codes) > 0:
+                windows.append(i)
+                strings.append(''.join(alphabet[window_codes]))
+        # Calculate the LZ77 scores for all of our windows together
+        lz77 = np.array([len(c) for c in self.lz77_compress_batch(strings)], dtype=np.int64)
+        return np.array(windows, dtype=np.int64), lz77, np.array([len(s_) for s_ in strings], dtype=np.int64)
 
 
 class ProportionalAsynchrony(BaseExtractor):
@@ -963,10 +1770,10 @@ class ProportionalAsynchrony(BaseExtractor):
     LOWER_BOUND = 1/32
     REF_INSTR = 'drums'
 
-    def __init__(self, summary_df: pd.DataFrame, my_instr_name: str, metre_col: str = 'metre_manual'):
+    def __init__(self, summary_df: pd.DataFrame, my_instr_name: str, metre_col: str = 'metre_manual', **kwargs):
         super().__init__()
         self.metre_col = metre_col
-        asy = pd.DataFrame(self._extract_proportional_durations(summary_df))
+        asy = self._extract_proportional_durations(summary_df, bar_ids=kwargs.get('bar_ids', None))
         self.asynchronies = self._format_async_df(asy)
         mean_async = self.asynchronies.groupby('instr')['asynchrony_adjusted_offset'].agg([np.nanmean, np.nanstd])
         async_count = len(self.asynchronies[self.asynchronies['instr'] == my_instr_name].dropna())
@@ -976,6 +1783,11 @@ class ProportionalAsynchrony(BaseExtractor):
             **self._extract_async_stats(mean_async, my_instr_name)
         }
 
+    @classmethod
+    def from_grid(cls, grid: BeatGrid, instr: str):
+        """Creates the extractor from a `BeatGrid`, reusing its bar ids for every beat"""
+        return cls(grid.summary_df, instr, metre_col=grid.metre_col, bar_ids=grid.bar_ids)
+
     @staticmethod
     def _extract_async_stats(mean_async: np.array, my_instr_name: str) -> dict:
         """Extracts asynchrony stats from all pairwise combinations of instruments and returns a dictionary"""
@@ -1002,28 +1814,44 @@ class ProportionalAsynchrony(BaseExtractor):
         async_df['asynchrony_adjusted_offset'] = (async_df['asynchrony_offset'] / 360) - ((async_df['beat'] - 1) * 1/4)
         return async_df
 
-    def _extract_proportional_durations(self, summary_df: pd.DataFrame) -> Generator:
-        """Extracts proportional beat values for all instruments"""
-        idx = summary_df[summary_df[self.metre_col] == 1].index
-        for downbeat1, downbeat2 in pairwise(idx):
-            # Get all the beats marked between our two downbeats (beat 1 bar 1, beat 1 bar 2)
-            bw = summary_df[(downbeat1 <= summary_df.index) & (summary_df.index < downbeat2)]
-            sub = bw[utils.INSTRUMENTS_TO_PERFORMER_ROLES.keys()]
-            # Get the first downbeat of the first bar, and the last downbeat of the second
-            first = summary_df[summary_df.index == downbeat1]['beats'].iloc[0]
-            last = summary_df[summary_df.index == downbeat2]['beats'].iloc[0]
-            # Scale our onsets to be proportional with our first and last values
-            prop = (sub - first) / (last - first)
-            # Drop values after 1/16th note or before 1/32nd note
-            upper_bound = (((bw[self.metre_col] - 1) * 1/4) + self.UPPER_BOUND)
-            lower_bound = ((bw[self.metre_col] - 1) * 1/4) - self.LOWER_BOUND
-            # Set values below upper and lower bound to NaN
-            for col in prop.columns:
-                prop[col][(prop[col] < lower_bound) | (prop[col] > upper_bound)] = np.nan
-            # Convert values to degrees
-            prop *= 360
-            prop = pd.concat([prop, bw[self.metre_col]], axis=1)
-            # Iterate through all instruments
-            for instr in utils.INSTRUMENTS_TO_PERFORMER_ROLES.keys():
-                for _, val in prop[[instr, self.metre_col]].iterrows():
-                    yield dict(instr=instr, asynchrony=val[instr], beat=val[self.metre_col])
+    def _extract_proportional_durations(self, summary_df: pd.DataFrame, bar_ids: np.array = None) -> pd.DataFrame:
+        """Extracts proportional beat values for all instruments.
+
+        Every beat is assigned to the bar starting at the most recent downbeat, such that proportional positions for
+        every instrument can be calculated in one go. Beats before the first downbeat or after the last downbeat are not
+        included. Rows are returned ordered by bar, then by instrument, then by beat. Assumes that `summary_df` is
+        sorted by time.
+
+        """
+        instrs = list(utils.INSTRUMENTS_TO_PERFORMER_ROLES.keys())
+        metre = summary_df[self.metre_col].to_numpy(dtype=float)
+        beats = summary_df['beats'].to_numpy(dtype=float)
+        onsets = summary_df[instrs].to_numpy(dtype=float)
+        # Get the position of every downbeat, and the index of the bar that every beat belongs to
+        downbeats = np.flatnonzero(metre == 1)
+        bar = np.cumsum(metre == 1) - 1 if bar_ids is None else np.asarray(bar_ids)
+        # We only want beats that fall between two downbeats (beat 1 bar 1, beat 1 bar 2)
+        keep = (bar >= 0) & (bar < len(downbeats) - 1)
+        bar, metre, onsets = bar[keep], metre[keep], onsets[keep]
+        # Get the first downbeat of the first bar, and the last downbeat of the second
+        first = beats[downbeats[bar]]
+        last = beats[downbeats[np.minimum(bar + 1, len(downbeats) - 1)]]
+        # Scale our onsets to be proportional with our first and last values
+        with np.errstate(invalid='ignore', divide='ignore'):
+            prop = (onsets - first[:, None]) / (last - first)[:, None]
+        # Set values after 1/16th note or before 1/32nd note to NaN
+        upper_bound = ((metre - 1) * 1/4) + self.UPPER_BOUND
+        lower_bound = ((metre - 1) * 1/4) - self.LOWER_BOUND
+        with np.errstate(invalid='ignore'):
+            prop[(prop < lower_bound[:, None]) | (prop > upper_bound[:, None])] = np.nan
+        # Convert values to degrees
+        prop *= 360
+        # Order every value by bar, then instrument, then beat, and create the dataframe
+        bar_ = np.repeat(bar, len(instrs))
+        instr_idx = np.tile(np.arange(len(instrs)), len(bar))
+        order = np.lexsort((np.arange(len(bar_)), instr_idx, bar_))
+        return pd.DataFrame(dict(
+            instr=np.array(instrs, dtype=object)[instr_idx[order]],
+            asynchrony=prop.ravel()[order],
+            beat=np.repeat(metre, len(instrs))[order]
+        ))
@@ -92,11 +92,10 @@ class Simulation:
         init_dict['my_prev_ioi_diff'][1] = np.nan
         return init_dict
 
-    def _get_async_cls(self) -> Asynchrony:
+    def _get_async_cls(self) -> list[Asynchrony]:
         """Gets all `src.features.features_utils.Asynchrony` classes for all instruments"""
-        get_other = lambda me: [i_ for i_ in utils.INSTRUMENTS_TO_PERFORMER_ROLES.keys() if i_ != me]
-        for i in utils.INSTRUMENTS_TO_PERFORMER_ROLES.keys():
-            yield Asynchrony(my_beats=self.sim_df[i], their_beats=self.sim_df[get_other(i)])
+        # Asynchrony between all pairs of instruments is calculated in a single call
+        return Asynchrony.from_matrix(self.sim_df[list(utils.INSTRUMENTS_TO_PERFORMER_ROLES.keys())])
 
     def _get_async_rms(self) -> float:
         """Gets root-mean-square of all pairwise asynchrony values"""
@@ -18,73 +18,26 @@ from joblib import load
 from src import utils
 from src.clean.clean_utils import ItemMaker, return_timestamp
 from src.detect.onset_utils import OnsetMaker
+from src.features.extract_features import extract_features_from_context
 from src.features.features_utils import *
 
 
-def extract_track_features(track: OnsetMaker, exog_ins) -> dict:
-    """Processes a single track, extracting all required features, and returns a dictionary"""
-    def get_feature_data(feature_cls, cols, extra_str='', **cls_kwargs):
-        """Creates a class with given kwargs and returns the desired key-value pairs from its summary dictionary"""
-        cls = feature_cls(**cls_kwargs)
-        return {k + extra_str: v for k, v in cls.summary_dict.items() if k in cols}
+def extract_track_features(track: OnsetMaker, exog_ins, context: FeatureContext = None) -> dict:
+    """Processes a single track, extracting all required features, and returns a dictionary
 
-    # Convert the summary dictionary (dictionary of arrays) to a dataframe
-    summary_dict = pd.DataFrame(track.summary_dict)
-    # These are the positions of downbeats, i.e. the first beat of a measure
-    downbeats = track.ons['downbeats_auto']
-    # The tempo and time signature of the track
-    tempo = track.tempo
-    time_signature = track.item['time_signature']
-    # Subset to get my onsets and partner onsets as separate dataframes
-    my_onsets = track.ons[exog_ins]
-    my_beats = summary_dict[exog_ins]
-    their_beats = summary_dict[[i for i in utils.INSTRUMENTS_TO_PERFORMER_ROLES.keys() if i != exog_ins]]
-    # BEAT-UPBEAT RATIO
-    bur = get_feature_data(
-        BeatUpbeatRatio, ['bur_log_mean', 'bur_log_std', 'bur_log_count_nonzero'],
-        my_onsets=my_onsets, my_beats=my_beats, clean_outliers=True
-    )
-    # PHASE CORRECTION
-    pc = get_feature_data(
-        PhaseCorrection, ['self_coupling', 'coupling_bass', 'coupling_drums', 'nobs'],
-        my_beats=my_beats, their_beats=their_beats, order=1
-    )
-    # PHASE CORRECTION - PARTNER
-    # In comparison to the 'full' phase correction model, we only need to get a few columns here
-    pcb = get_feature_data(
-        PhaseCorrection, ['coupling_piano', 'nobs'], extra_str='_bass',
-        my_beats=summary_dict['bass'], their_beats=summary_dict[['piano', 'drums']], order=1
-    )
-    pcd = get_feature_data(
-        PhaseCorrection, ['coupling_piano', 'nobs'], extra_str='_drums',
-        my_beats=summary_dict['drums'], their_beats=summary_dict[['piano', 'bass']], order=1
-    )
-    # PROPORTIONAL ASYNCHRONY
-    pa = get_feature_data(
-        ProportionalAsynchrony, [
-            'prop_async_count_nonzero', 'bass_prop_async_nanmean',
-            'drums_prop_async_nanmean', 'bass_prop_async_nanstd',
-            'drums_prop_async_nanstd'
-        ],
-        summary_df=summary_dict, my_instr_name=exog_ins, metre_col='metre_auto'
-    )
-    # IOI COMPLEXITY
-    ioi = get_feature_data(
-        IOIComplexity, ['lz77_mean', 'lz77_std', 'n_onsets_mean', 'n_onsets_std', 'window_count', 'ioi_count'],
-        my_onsets=my_onsets, downbeats=downbeats, tempo=tempo, time_signature=time_signature
-    )
-    # TEMPO SLOPE
-    ts = get_feature_data(
-        TempoSlope, ['tempo_slope', 'tempo_drift'],
-        my_beats=pd.concat([my_beats, their_beats], axis=1).mean(axis=1)
-    )
-    # TEMPO STABILITY
-    tstab = get_feature_data(
-        RollingIOISummaryStats, ['rolling_std_count_nonzero', 'rolling_std_median'],
-        my_onsets=my_beats, downbeats=downbeats, bar_period=4
-    )
+    Arguments:
+        track (OnsetMaker): the processed track
+        exog_ins (str): the instrument to extract features for
+        context (FeatureContext, optional): the context to share intermediate arrays between features, created from
+            `track` if not provided. After extracting features, `context.dependency_report()` shows which arrays were
+            computed and which were reused by each feature
+
+    """
+    # Segment the track into beats and bars once: this, and any other intermediate arrays, are shared between features
+    if context is None:
+        context = FeatureContext.from_onsetmaker(track, metre_col='metre_auto', downbeats_col='downbeats_auto')
     # Return a single dictionary that combines the summary dictionary for all the features
-    return dict(**track.item, **bur, **pc, **pcb, **pcd, **pa, **ioi, **ts, **tstab, tempo=tempo)
+    return dict(**track.item, **extract_features_from_context(context, exog_ins))
 
 
 def get_track_dictionary(filename: str, start: str, stop: str, json_location: str = '') -> dict:
@@ -4,6 +4,7 @@
 """Utility classes, functions, and variables used across the entire pipeline"""
 
 import csv
+import hashlib
 import inspect
 import json
 import os
@@ -25,6 +26,7 @@ import audioread
 import dill
 import numpy as np
 import pandas as pd
+import soundfile as sf
 
 # Set options in pandas and numpy here, so they carry through whenever this file is imported by another
 # This disables scientific notation and forces all rows/columns to be printed: helps with debugging!
@@ -35,6 +37,8 @@ np.set_printoptions(suppress=True)
 # Define variables used across many files
 ALL_PITCHES = ['C', 'C#', 'D', 'D#', 'E', 'F', 'F#', 'G', 'G#', 'A', 'A#', 'B']
 SAMPLE_RATE = 44100
+# Precision used when loading, filtering, and rendering audio: float32 halves memory use versus float64
+AUDIO_DTYPE = np.float32
 HOP_LENGTH = 128
 FPS = 100
 AUDIO_FILE_FMT = 'wav'
@@ -44,6 +48,12 @@ INSTRUMENTS_TO_PERFORMER_ROLES = {
     'drums': 'drummer'
 }
 PERFORMER_ROLES_TO_INSTRUMENTS = {v: k for k, v in INSTRUMENTS_TO_PERFORMER_ROLES.items()}
+# Maps the channel names used in `channel_overrides` onto column indexes in a stereo audio array
+AUDIO_CHANNELS = {'l': 0, 'r': 1}
+# Number of frames to read from or write to an audio file at once when working with individual channels
+AUDIO_BLOCKSIZE = 2 ** 16
+# Name of the directory, created next to the source audio, used to store decoded audio
+AUDIO_CACHE_DIR = '.audio_cache'
 SILENCE_THRESHOLD = 1/3
 MIN_TEMPO, MAX_TEMPO = 100, 300
 
@@ -748,5 +758,225 @@ def construct_audio_fpath_with_channel_overrides(
     return root_fname + ext + f'.{AUDIO_FILE_FMT}'
 
 
+def read_audio_channel(
+        fpath: str,
+        channel: str,
+        dtype: type = AUDIO_DTYPE,
+        blocksize: int = AUDIO_BLOCKSIZE,
+        start: int = 0,
+        stop: int = None
+) -> tuple[np.ndarray, int]:
+    """Reads a single channel (`"l"` or `"r"`) from an audio file, without decoding the other channel into memory.
+
+    The file is read block-by-block, with only the requested channel of each block kept, such that the peak memory
+    required is one block of the stereo audio plus the single output channel. Mono files are returned as-is.
+
+    Arguments:
+        fpath (str): the path to the audio file
+        channel (str): the channel to read, either `"l"` or `"r"`
+        dtype (type): the data type to return the audio in, defaults to `AUDIO_DTYPE`
+        blocksize (int): the number of frames to read at once, defaults to `AUDIO_BLOCKSIZE`
+        start (int): the frame to start reading from, defaults to 0
+        stop (int): the frame to stop reading at, defaults to None (end of file)
+
+    Returns:
+        tuple[np.ndarray, int]: the audio for the requested channel and the sample rate of the file
+
+    """
+    with sf.SoundFile(fpath) as f:
+        # Mono files only have a single channel, so we clamp our index to this
+        idx = min(AUDIO_CHANNELS[channel], f.channels - 1)
+        stop = f.frames if stop is None else min(stop, f.frames)
+        # Pre-allocate the output array, so we don't need to concatenate blocks later
+        out = np.empty(max(stop - start, 0), dtype=dtype)
+        pos = 0
+        f.seek(min(start, f.frames))
+        for block in f.blocks(blocksize=blocksize, frames=out.shape[0], dtype=np.dtype(dtype).name, always_2d=True):
+            out[pos:pos + block.shape[0]] = block[:, idx]
+            pos += block.shape[0]
+        return out[:pos], f.samplerate
+
+
+def write_audio_channel(
+        in_fpath: str,
+        out_fpath: str,
+        channel: str,
+        blocksize: int = AUDIO_BLOCKSIZE
+) -> None:
+    """Writes a single channel (`"l"` or `"r"`) of an audio file to a new mono file, block-by-block.
+
+    Replaces calling `ffmpeg -map_channel` in a subprocess: the sample rate and subtype of the input are preserved.
+
+    Arguments:
+        in_fpath (str): the path to the (stereo) input audio file
+        out_fpath (str): the path to write the mono output to
+        channel (str): the channel to write, either `"l"` or `"r"`
+        blocksize (int): the number of frames to process at once, defaults to `AUDIO_BLOCKSIZE`
+
+    """
+    with sf.SoundFile(in_fpath) as fin:
+        idx = min(AUDIO_CHANNELS[channel], fin.channels - 1)
+        with sf.SoundFile(
+                out_fpath, mode='w', samplerate=fin.samplerate, channels=1, subtype=fin.subtype, format=fin.format
+        ) as fout:
+            # We read integer files as integers to avoid any rounding when writing back to disc
+            dtype = 'int32' if fin.subtype.startswith('PCM') else 'float64'
+            for block in fin.blocks(blocksize=blocksize, dtype=dtype, always_2d=True):
+                fout.write(block[:, idx])
+
+
+def load_audio_channel(
+        fpath: str,
+        channel: str,
+        sr: int = SAMPLE_RATE,
+        offset: float = 0.0,
+        duration: float = None,
+        dtype: type = AUDIO_DTYPE,
+        res_type: str = 'soxr_vhq'
+) -> np.ndarray:
+    """Loads a single channel from an audio file and resamples it, with arguments equivalent to `librosa.load`.
+
+    This allows loaders to request e.g. "the left channel of this stereo file" directly, rather than requiring the
+    channel to have previously been written to a separate file on disc.
+
+    """
+    info = sf.info(fpath)
+    # Convert our offset and duration in seconds into frames in the original sample rate: like `librosa.load`, we
+    # truncate rather than round these values
+    start = int(offset * info.samplerate)
+    stop = None if duration is None else start + int(duration * info.samplerate)
+    y, native_sr = read_audio_channel(fpath, channel, dtype=dtype, start=start, stop=stop)
+    # Resample the audio to our desired rate, if necessary
+    if sr is not None and sr != native_sr:
+        import librosa
+
+        y = librosa.resample(y, orig_sr=native_sr, target_sr=sr, res_type=res_type)
+    return y.astype(dtype, copy=False)
+
+
+def hash_file(fpath: str, blocksize: int = 2 ** 20) -> str:
+    """Returns a hash of the contents of a file, read block-by-block"""
+    h = hashlib.blake2b(digest_size=16)
+    with open(fpath, 'rb') as f:
+        for block in iter(lambda: f.read(blocksize), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def hash_params(**kws) -> str:
+    """Returns a short hash of a set of parameters, which is the same whatever order the parameters are passed in"""
+    # We convert any types (e.g. numpy dtypes) to strings, so that the hash is consistent across runs
+    params = json.dumps({k: str(v) for k, v in sorted(kws.items())})
+    return hashlib.blake2b(params.encode(), digest_size=8).hexdigest()
+
+
+def get_audio_cache_fpath(fpath: str, **load_kws) -> str:
+    """Returns the stem of the path to the cached, decoded version of an audio file loaded with the given parameters.
+
+    Cached files are stored in a hidden directory next to the source audio, with the file name constructed from the
+    name of the source, a hash of the parameters used to load it, and a hash of its size and modification time. This
+    means that the cache is invalidated whenever either the audio itself or the parameters used to load it change,
+    without needing to read the whole source file on every call. The sample rate of the decoded audio (which may not be
+    known until the audio is loaded) and the file extension are appended to this stem when the cache is saved.
+
+    """
+    params_hash = hash_params(**load_kws)
+    stat = os.stat(fpath)
+    source_hash = hashlib.blake2b(f'{stat.st_size}:{stat.st_mtime_ns}'.encode(), digest_size=8).hexdigest()
+    root, fname = os.path.split(os.path.abspath(fpath))
+    return os.path.join(root, AUDIO_CACHE_DIR, f'{fname}.{params_hash}.{source_hash}')
+
+
+def _find_audio_cache(cache_stem: str) -> tuple:
+    """Returns the path to and sample rate of the cached audio with the given stem, or `(None, None)` if not cached"""
+    root, stem = os.path.split(cache_stem)
+    if not os.path.isdir(root):
+        return None, None
+    for f in os.listdir(root):
+        # Cached files are named `{stem}.{sample rate}.npy`
+        sr = f[len(stem) + 1:-len('.npy')]
+        if f.startswith(stem + '.') and f.endswith('.npy') and sr.isdigit():
+            return os.path.join(root, f), int(sr)
+    return None, None
+
+
+def load_audio(
+        fpath: str,
+        sr: int = SAMPLE_RATE,
+        mono: bool = True,
+        offset: float = 0.0,
+        duration: float = None,
+        dtype: type = AUDIO_DTYPE,
+        res_type: str = 'soxr_vhq',
+        channel: str = None,
+        use_cache: bool = True
+) -> tuple[np.ndarray, int]:
+    """Loads audio, using a cached version of the decoded and resampled audio if one is available.
+
+    Equivalent to calling `librosa.load` (or `load_audio_channel`, if a `channel` is passed), but the decoded output is
+    stored as a `.npy` file next to the source, which is memory-mapped on subsequent calls. As `SAMPLE_RATE` doesn't
+    change between runs, this means that repeated passes over the corpus can skip decoding and resampling entirely.
+
+    Arguments:
+        fpath (str): the path to the audio file
+        sr (int): the sample rate to load the audio in, defaults to `SAMPLE_RATE`
+        mono (bool): whether to convert the audio to mono, defaults to True. Ignored if `channel` is passed.
+        offset (float): start reading after this time (in seconds), defaults to 0.0
+        duration (float): only load up to this much audio (in seconds), defaults to None (load the whole file)
+        dtype (type): the data type to return the audio in, defaults to `AUDIO_DTYPE`
+        res_type (str): the resampling algorithm to use, defaults to `"soxr_vhq"`
+        channel (str): if passed, only read this channel (`"l"` or `"r"`) from the file, defaults to None
+        use_cache (bool): whether to read from and write to the cache, defaults to True
+
+    Returns:
+        tuple[np.ndarray, int]: the audio and its sample rate
+
+    """
+    load_kws = dict(sr=sr, offset=offset, duration=duration, dtype=dtype, res_type=res_type)
+    if channel is not None:
+        load_kws['channel'] = channel
+    else:
+        load_kws['mono'] = mono
+    # Try and load the audio from the cache, if it exists
+    if use_cache:
+        cache_stem = get_audio_cache_fpath(fpath, **load_kws)
+        cache_fpath, cache_sr = _find_audio_cache(cache_stem)
+        if cache_fpath is not None:
+            # Copy-on-write, so that callers can modify the array without changing the file on disc
+            return np.load(cache_fpath, mmap_mode='c'), cache_sr
+    # Otherwise, decode the audio, either a single channel or the whole file
+    if channel is not None:
+        y = load_audio_channel(fpath, **load_kws)
+        # When not resampling, the audio is returned in the native sample rate of the file
+        sr = sf.info(fpath).samplerate if sr is None else sr
+    else:
+        import librosa
+
+        y, sr = librosa.load(fpath, **load_kws)
+    # Store the decoded audio in the cache, for next time
+    if use_cache:
+        _save_audio_cache(cache_stem, y, sr)
+    return y, sr
+
+
+def _save_audio_cache(cache_stem: str, y: np.ndarray, sr: int) -> None:
+    """Atomically saves decoded audio to the cache and removes any stale entries for the same file and parameters"""
+    cache_fpath = f'{cache_stem}.{sr}.npy'
+    root, fname = os.path.split(cache_fpath)
+    os.makedirs(root, exist_ok=True)
+    # Write to a temporary file first, so that parallel workers never see a partially-written array
+    with NamedTemporaryFile(dir=root, suffix='.npy', delete=False) as tmp:
+        np.save(tmp, y)
+    os.replace(tmp.name, cache_fpath)
+    # Cached files are named `{source}.{params hash}.{source hash}.{sample rate}.npy`, so we can identify stale versions
+    prefix = fname.rsplit('.', 3)[0]
+    for f in os.listdir(root):
+        if f.startswith(prefix + '.') and f != fname and f.endswith('.npy'):
+            try:
+                os.remove(os.path.join(root, f))
+            except FileNotFoundError:
+                pass
+
+
 if __name__ == '__main__':
     pass
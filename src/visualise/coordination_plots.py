@@ -829,11 +829,12 @@ class TrianglePlotTrack(vutils.BasePlot):
         from src.features.rhythm_features import PhaseCorrection
         sd = pd.DataFrame(om.summary_dict)
         res = []
-        for my_instr in utils.INSTRUMENTS_TO_PERFORMER_ROLES.keys():
-            their_instrs = [i for i in utils.INSTRUMENTS_TO_PERFORMER_ROLES.keys() if i != my_instr]
-            my_beats = sd[my_instr]
-            their_beats = sd[their_instrs]
-            pc = PhaseCorrection(my_beats=my_beats, their_beats=their_beats)
+        instrs = list(utils.INSTRUMENTS_TO_PERFORMER_ROLES.keys())
+        # Fit the models for every instrument together
+        pcs = PhaseCorrection.fit_batch([
+            (sd[my_instr], sd[[i for i in instrs if i != my_instr]]) for my_instr in instrs
+        ])
+        for my_instr, pc in zip(instrs, pcs):
             for _ in range(int(pc.summary_dict['nobs'])):
                 res.append({'instrument': my_instr, 'pianist': om.item['pianist'],
                             'performer': om.item['musicians'][
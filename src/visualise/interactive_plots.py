@@ -249,11 +249,12 @@ class BarPlotCoordinationInteractive(BasePlotPlotly):
         from src.features.rhythm_features import PhaseCorrection
         sd = pd.DataFrame(om.summary_dict)
         res = []
-        for my_instr in utils.INSTRUMENTS_TO_PERFORMER_ROLES.keys():
-            their_instrs = [i for i in utils.INSTRUMENTS_TO_PERFORMER_ROLES.keys() if i != my_instr]
-            my_beats = sd[my_instr]
-            their_beats = sd[their_instrs]
-            pc = PhaseCorrection(my_beats=my_beats, their_beats=their_beats)
+        instrs = list(utils.INSTRUMENTS_TO_PERFORMER_ROLES.keys())
+        # Fit the models for every instrument together
+        pcs = PhaseCorrection.fit_batch([
+            (sd[my_instr], sd[[i for i in instrs if i != my_instr]]) for my_instr in instrs
+        ])
+        for my_instr, pc in zip(instrs, pcs):
             res.append({'instrument': my_instr, 'pianist': om.item['pianist'],
                         'performer': om.item['musicians'][
                             utils.INSTRUMENTS_TO_PERFORMER_ROLES[my_instr]]} | pc.summary_dict)
@@ -322,15 +323,14 @@ class HistPlotSwingInteractive(BasePlotPlotly):
     @staticmethod
     def format_df(om):
         from src.features.rhythm_features import BeatUpbeatRatio
-        res = []
-        for instr in utils.INSTRUMENTS_TO_PERFORMER_ROLES.keys():
-            my_beats = om.summary_dict[instr]
-            my_ons = om.ons[instr]
-            burs = BeatUpbeatRatio(my_beats=my_beats, my_onsets=my_ons).bur_log['burs'].dropna().values
-            res.append(dict(instrument=instr, bur=np.nan))
-            for bur in burs:
-                res.append(dict(instrument=instr, bur=bur))
-        bur_df = pd.DataFrame(res)
+        instrs = list(utils.INSTRUMENTS_TO_PERFORMER_ROLES.keys())
+        # Extract the log BURs for all instruments at once
+        burs = BeatUpbeatRatio.extract_burs_batch(
+            onsets_list=[om.ons[instr] for instr in instrs], beats_list=[om.summary_dict[instr] for instr in instrs]
+        )
+        # Each instrument starts with a NaN row, so it is still included even if we have no BURs for it
+        vals = [np.concatenate([[np.nan], bur_log[~np.isnan(bur_log)]]) for _, bur_log in burs]
+        bur_df = pd.DataFrame(dict(instrument=np.repeat(instrs, [len(v) for v in vals]), bur=np.concatenate(vals)))
         peak_df = bur_df.groupby('instrument', as_index=False).mean().rename(columns={'bur': 'peak'})
         return bur_df, peak_df
 
@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Test suite for numerical equivalence of float32 and float64 audio processing in src/detect/onset_utils.py"""
+
+import unittest
+
+import numpy as np
+
+from src import utils
+from src.detect.onset_utils import OnsetMaker, ClickTrackMaker, bandpass_filter
+
+
+def get_annotated_tracks_present_locally() -> list[dict]:
+    """Returns all manually annotated tracks in the corpus which have audio present locally"""
+    try:
+        tracks = utils.CorpusMaker.from_excel(fname='corpus_updated', only_annotated=True).tracks
+    except FileNotFoundError:
+        return []
+    root = f'{utils.get_project_root()}/data/raw/audio'
+    return [t for t in tracks if utils.check_item_present_locally(f'{root}/{t["fname"]}.{utils.AUDIO_FILE_FMT}')]
+
+
+class AudioPrecisionTest(unittest.TestCase):
+    tracks = get_annotated_tracks_present_locally()
+    # Tolerance for the difference between normalised audio signals loaded at either precision
+    audio_tol = 1e-5
+    # Tolerance for the difference in onset detection F-score against the manual annotations
+    f_score_tol = 0.01
+
+    def test_bandpass_filter_preserves_precision(self):
+        """Tests that filtering float32 audio returns float32 audio that matches the float64 result"""
+        rng = np.random.default_rng(1)
+        y64 = rng.uniform(-1, 1, utils.SAMPLE_RATE * 5)
+        y32 = y64.astype(np.float32)
+        filt64 = bandpass_filter(y64, lowcut=100, highcut=1000)
+        filt32 = bandpass_filter(y32, lowcut=100, highcut=1000)
+        self.assertEqual(filt32.dtype, np.float32)
+        self.assertEqual(filt64.dtype, np.float64)
+        self.assertTrue(np.allclose(filt32, filt64, atol=self.audio_tol))
+
+    def test_click_track_preserves_precision(self):
+        """Tests that click tracks are rendered in the precision of the input audio"""
+        blank = np.zeros(utils.SAMPLE_RATE * 5, dtype=np.float32)
+        onsets = np.array([0.5, 1.0, 1.5, np.nan, 2.5])
+        self.assertEqual(ClickTrackMaker(audio=blank).generate_audio([onsets]).dtype, np.float32)
+
+    @unittest.skipUnless(tracks, 'no manually annotated tracks present locally')
+    def test_float32_equivalent_to_float64(self):
+        """Tests that onsets detected from float32 audio are equivalent to those detected from float64 audio"""
+        for track in self.tracks:
+            om32 = OnsetMaker(item=track, dtype=np.float32)
+            om64 = OnsetMaker(item=track, dtype=np.float64)
+            for instr in utils.INSTRUMENTS_TO_PERFORMER_ROLES.keys():
+                with self.subTest(track=track['fname'], instr=instr):
+                    self.assertEqual(om32.audio[instr].dtype, np.float32)
+                    # The loaded, filtered, and normalised audio should be near-identical
+                    self.assertTrue(np.allclose(om32.audio[instr], om64.audio[instr], atol=self.audio_tol))
+                    # Onset detection accuracy against the manual annotations should be equivalent
+                    fn = rf'{utils.get_project_root()}/references/manual_annotation/{track["fname"]}_{instr}.txt'
+                    f32, f64 = (
+                        om.compare_onset_detection_accuracy(fname=fn, onsets=om.onset_detect_cnn(instr))['f_score']
+                        for om in (om32, om64)
+                    )
+                    self.assertLessEqual(abs(f32 - f64), self.f_score_tol)
+
+
+if __name__ == '__main__':
+    unittest.main()
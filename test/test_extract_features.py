@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Test suite for corpus-wide feature extraction in src/features/extract_features.py"""
+
+import json
+import os
+import tempfile
+import unittest
+from types import SimpleNamespace
+from unittest.mock import patch
+
+import numpy as np
+import pandas as pd
+
+from src import utils
+from src.features.extract_features import (
+    FEATURES, extract_features_from_context, get_annotation_hash, get_feature_key, process_track
+)
+from src.features.features_utils import FeatureContext
+
+
+class ExtractFeaturesTest(unittest.TestCase):
+    rng = np.random.default_rng(6)
+    beats = np.arange(1, 201) * 0.5
+    summary_df = pd.DataFrame(beats[:, None] + rng.normal(0, 0.01, (200, 3)), columns=['piano', 'bass', 'drums'])
+    summary_df['beats'] = beats
+    summary_df['metre_auto'] = np.tile([1, 2, 3, 4], 50)
+
+    def setUp(self):
+        self.context = FeatureContext(
+            beats=self.beats, downbeats=self.beats[::4], metre=self.summary_df['metre_auto'], tempo=120,
+            onsets={instr: self.summary_df[instr].to_numpy() for instr in ['piano', 'bass', 'drums']},
+            summary_df=self.summary_df
+        )
+
+    def test_feature_key(self):
+        """Tests that the cache key for a feature changes only when its parameters or instrument change"""
+        key = get_feature_key('bur', 'piano', dict(clean_outliers=True))
+        self.assertEqual(key, get_feature_key('bur', 'piano', dict(clean_outliers=True)))
+        self.assertNotEqual(key, get_feature_key('bur', 'piano', dict(clean_outliers=False)))
+        self.assertNotEqual(key, get_feature_key('bur', 'bass', dict(clean_outliers=True)))
+
+    def test_annotation_hash(self):
+        """Tests that the hash of a track's annotations changes when any annotation file changes"""
+        with tempfile.TemporaryDirectory() as dirpath:
+            self.summary_df.to_csv(os.path.join(dirpath, 'beats.csv'))
+            before = get_annotation_hash(dirpath)
+            self.assertEqual(before, get_annotation_hash(dirpath))
+            self.summary_df['piano'].to_csv(os.path.join(dirpath, 'piano_onsets.csv'), header=False, index=False)
+            self.assertNotEqual(before, get_annotation_hash(dirpath))
+
+    def test_features_independent(self):
+        """Tests that extracting features one at a time gives the same results as extracting them all together"""
+        together = extract_features_from_context(self.context, 'piano')
+        separate = {}
+        for name in FEATURES.keys():
+            separate.update(extract_features_from_context(self.context, 'piano', [name]))
+        self.assertEqual(list(together.keys()), list(separate.keys()))
+        np.testing.assert_array_equal(list(together.values()), list(separate.values()))
+        self.assertEqual(together['tempo'], 120)
+
+
+class ProcessTrackTest(unittest.TestCase):
+    """Runs `process_track` on a temporary corpus with dummy features, counting how often each is extracted"""
+    summary_df = ExtractFeaturesTest.summary_df
+    metadata = dict(mbz_id='abc', track_name='Test Track')
+
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.dirpath = os.path.join(self.tempdir.name, 'corpus', 'track-1')
+        self.cache_dir = os.path.join(self.tempdir.name, '.feature_cache')
+        os.makedirs(self.dirpath)
+        os.makedirs(self.cache_dir)
+        with open(os.path.join(self.dirpath, 'metadata.json'), 'w') as f:
+            json.dump(self.metadata, f)
+        self.summary_df.to_csv(os.path.join(self.dirpath, 'beats.csv'))
+        self.loads, self.extracted = 0, []
+        # Use dummy features and annotations, so we don't need to create a full `OnsetMaker`
+        patches = [
+            patch.dict(FEATURES, {'first': (self.extract_first, dict(order=1)), 'second': (self.extract_second, {})}),
+            patch.object(utils, 'load_annotations_from_files', side_effect=self.load_annotations),
+            patch.object(FeatureContext, 'from_onsetmaker', return_value=FeatureContext(
+                beats=ExtractFeaturesTest.beats, downbeats=ExtractFeaturesTest.beats[::4], tempo=120,
+                metre=self.summary_df['metre_auto'], summary_df=self.summary_df
+            )),
+        ]
+        for p in patches:
+            p.start()
+            self.addCleanup(p.stop)
+        self.addCleanup(self.tempdir.cleanup)
+
+    def load_annotations(self, _) -> SimpleNamespace:
+        self.loads += 1
+        return SimpleNamespace(item=dict(**self.metadata, tempo=120))
+
+    def extract_first(self, _, exog_ins: str, order: int) -> dict:
+        self.extracted.append('first')
+        return dict(first=np.float64(order), exog_ins=exog_ins)
+
+    def extract_second(self, *_) -> dict:
+        self.extracted.append('second')
+        return dict(second=np.int64(2))
+
+    def process(self) -> dict:
+        return process_track(self.dirpath, self.cache_dir, features=['first', 'second'])
+
+    def test_cache_hit(self):
+        """Tests that a track with every feature cached is returned without loading its annotations again"""
+        first = self.process()
+        self.assertEqual(first, dict(fname='track-1', **self.metadata, first=1.0, exog_ins='piano', second=2))
+        second = self.process()
+        self.assertEqual(first, second)
+        self.assertEqual(self.loads, 1)
+        self.assertEqual(self.extracted, ['first', 'second'])
+
+    def test_changed_params(self):
+        """Tests that changing the parameters of one feature, or adding a new feature, only extracts that feature"""
+        self.process()
+        FEATURES['first'] = (self.extract_first, dict(order=2))
+        res = self.process()
+        self.assertEqual(res['first'], 2.0)
+        self.assertEqual(self.extracted, ['first', 'second', 'first'])
+        FEATURES['third'] = (lambda *_: self.extracted.append('third') or dict(third=3), {})
+        res = process_track(self.dirpath, self.cache_dir, features=['first', 'second', 'third'])
+        self.assertEqual(res['third'], 3)
+        self.assertEqual(self.extracted, ['first', 'second', 'first', 'third'])
+        self.assertEqual(self.loads, 3)
+
+    def test_annotation_change(self):
+        """Tests that changing a track's annotations discards every feature cached for it"""
+        self.process()
+        self.summary_df.iloc[:10].to_csv(os.path.join(self.dirpath, 'beats.csv'))
+        self.process()
+        self.assertEqual(self.extracted, ['first', 'second'] * 2)
+        cache = utils.load_json(self.cache_dir, 'track-1')
+        self.assertEqual(cache['annotation_hash'], get_annotation_hash(self.dirpath))
+        self.assertEqual(len(cache['features']), 2)
+        # Cached features should still be used if we've only changed the parameters of another feature
+        FEATURES['first'] = (self.extract_first, dict(order=2))
+        self.process()
+        self.assertEqual(len(utils.load_json(self.cache_dir, 'track-1')['features']), 3)
+
+    def test_corrupt_cache(self):
+        """Tests that a corrupt or partially-written cache is extracted again rather than raising an error"""
+        expected = self.process()
+        with open(os.path.join(self.cache_dir, 'track-1.json')) as f:
+            valid = f.read()
+        annotation_hash = get_annotation_hash(self.dirpath)
+        for contents in [
+            valid[:len(valid) // 2], '', '[]', 'null', '{"features": {}}',
+            json.dumps(dict(annotation_hash=annotation_hash, metadata=None, features={})),
+            json.dumps(dict(annotation_hash=annotation_hash, metadata=self.metadata, features=[])),
+            json.dumps(dict(annotation_hash=annotation_hash, metadata=self.metadata, features={
+                k: None for k in json.loads(valid)['features'].keys()
+            })),
+        ]:
+            with open(os.path.join(self.cache_dir, 'track-1.json'), 'w') as f:
+                f.write(contents)
+            self.assertEqual(self.process(), expected)
+            self.assertEqual(utils.load_json(self.cache_dir, 'track-1'), json.loads(valid))
+        self.assertEqual(self.loads, 9)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,215 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Test suite for utility classes and functions in src/features/features_utils.py"""
+
+import json
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from src.features.features_utils import (
+    BaseExtractor, BeatGrid, FeatureContext, fit_ols, fit_ols_batch, summary_statistics
+)
+from src.features.rhythm_features import BeatUpbeatRatio, EventDensity, IOIComplexity, PhaseCorrection, TempoSlope
+
+
+class SummaryStatisticsTest(unittest.TestCase):
+    rng = np.random.default_rng(3)
+    funcs = dict(
+        mean=np.nanmean,
+        median=np.nanmedian,
+        std=np.nanstd,
+        var=np.nanvar,
+        quantile25=BaseExtractor.quantile25,
+        quantile75=BaseExtractor.quantile75,
+        count=len,
+        count_nonzero=BaseExtractor.count_nonzero,
+    )
+
+    def _arrays(self) -> list[np.ndarray]:
+        """Returns arrays of different lengths, with some missing values"""
+        arrays = []
+        for _ in range(50):
+            arr = self.rng.normal(0.5, 0.1, self.rng.integers(1, 700))
+            arr[self.rng.uniform(size=len(arr)) < 0.2] = np.nan
+            arrays.append(arr)
+        return arrays + [np.full(5, np.nan), np.full(5, 0.3)]
+
+    def test_matches_individual_functions(self):
+        """Tests that fused summary statistics match those calculated by each function in turn"""
+        arrays = self._arrays()
+        with np.errstate(all='ignore'):
+            actual = summary_statistics(arrays)
+            for func_k, func_v in self.funcs.items():
+                expected = [func_v(arr) for arr in arrays]
+                np.testing.assert_allclose(actual[func_k], expected, rtol=1e-14, err_msg=func_k)
+
+    def test_single_array_identical(self):
+        """Tests that summary statistics for a single array are identical to those from numpy"""
+        arr = self._arrays()[0]
+        actual = summary_statistics([arr])
+        for func_k, func_v in self.funcs.items():
+            self.assertEqual(actual[func_k][0], func_v(arr), msg=func_k)
+
+    def test_2d_input(self):
+        """Tests that passing a 2D array is equivalent to passing each row separately"""
+        mat = self.rng.normal(size=(10, 20))
+        mat[0, 3] = np.nan
+        self.assertEqual(summary_statistics(mat), summary_statistics(list(mat)))
+
+
+class BaseExtractorTest(unittest.TestCase):
+    def test_registered_functions(self):
+        """Tests that both batched and individual functions can be registered and are applied to every array"""
+        be = BaseExtractor()
+        be.register_summary_func('nanmax', lambda x: np.nanmax(x, axis=1), batched=True)
+        be.register_summary_func('first', lambda x: x[0])
+        be.update_summary_dict(['a', 'b'], [np.array([1., np.nan, 3.]), np.array([4., 5.])])
+        self.assertEqual(be.summary_dict['a_nanmax'], 3.)
+        self.assertEqual(be.summary_dict['b_nanmax'], 5.)
+        self.assertEqual(be.summary_dict['b_first'], 4.)
+        self.assertEqual(be.summary_dict['a_count'], 3)
+        self.assertEqual(be.summary_dict['a_count_nonzero'], 2)
+        # The summary dictionary should be serialisable
+        self.assertIsInstance(json.loads(repr(be)), dict)
+
+
+class OLSTest(unittest.TestCase):
+    rng = np.random.default_rng(5)
+    attributes = ['nobs', 'rsquared', 'rsquared_adj', 'aic', 'bic', 'llf']
+
+    def _data(self, n: int, k: int) -> tuple[pd.Series, pd.DataFrame]:
+        """Returns dependent and predictor variables for a linear model with some missing values"""
+        x = pd.DataFrame(self.rng.normal(size=(n, k)), columns=[f'x{i}' for i in range(k)])
+        y = pd.Series(x.to_numpy() @ self.rng.normal(size=k) + self.rng.normal(0.5, 0.1, n), name='y')
+        y[self.rng.uniform(size=n) < 0.1] = np.nan
+        x[self.rng.uniform(size=(n, k)) < 0.05] = np.nan
+        return y, x
+
+    def test_matches_statsmodels(self):
+        """Tests that models fitted with numpy match those fitted with statsmodels"""
+        for n, k in [(10, 1), (100, 3), (1000, 5)]:
+            y, x = self._data(n, k)
+            actual, expected = fit_ols(y, x), fit_ols(y, x, backend='statsmodels')
+            pd.testing.assert_series_equal(actual.params, expected.params, rtol=1e-10)
+            pd.testing.assert_series_equal(actual.bse, expected.bse, rtol=1e-10)
+            np.testing.assert_allclose(actual.resid, expected.resid, rtol=1e-8, atol=1e-12)
+            for attribute in self.attributes:
+                self.assertAlmostEqual(getattr(actual, attribute), getattr(expected, attribute), places=8)
+
+    def test_batch_matches_individual(self):
+        """Tests that fitting many models together gives the same results as fitting them separately"""
+        data = [self._data(int(self.rng.integers(20, 200)), int(self.rng.integers(1, 4))) for _ in range(20)]
+        data.append((pd.Series([np.nan, np.nan]), pd.Series([1., 2.])))
+        batch = fit_ols_batch([y for y, _ in data], [x for _, x in data])
+        self.assertIsNone(batch[-1])
+        for (y, x), res in zip(data[:-1], batch[:-1]):
+            pd.testing.assert_series_equal(res.params, fit_ols(y, x).params, rtol=1e-10)
+        self.assertRaises(ValueError, fit_ols, *data[-1])
+
+
+class BeatGridTest(unittest.TestCase):
+    rng = np.random.default_rng(4)
+    beats = np.arange(1, 101) * 0.5
+    metre = np.tile([1, 2, 3, 4], 25)
+    onsets = np.sort(rng.uniform(0, 50, 400))
+    summary_df = pd.DataFrame(dict(beats=beats, piano=beats + rng.normal(0, 0.01, 100), metre_auto=metre))
+    grid = BeatGrid(
+        beats=beats, downbeats=beats[metre == 1], metre=metre, tempo=120, time_signature=4,
+        onsets=dict(piano=onsets), summary_df=summary_df
+    )
+
+    def test_bar_bounds(self):
+        """Tests that onset indices for every window of bars match masking the whole array, and are cached"""
+        lo, hi = self.grid.get_bar_bounds('piano', 2)
+        downbeats = self.grid.downbeats
+        for i, (i1, i2) in enumerate(zip(downbeats, downbeats[2:])):
+            np.testing.assert_array_equal(self.onsets[lo[i]:hi[i]], BaseExtractor.get_between(self.onsets, i1, i2))
+        self.assertIs(self.grid.get_bar_bounds('piano', 2)[0], lo)
+        np.testing.assert_array_equal(self.grid.bar_ids[:8], [0, 0, 0, 0, 1, 1, 1, 1])
+
+    def test_extractors_from_grid(self):
+        """Tests that extractors created from the grid match those created directly"""
+        downbeats, my_beats = self.grid.downbeats, self.summary_df['piano']
+        for actual, expected in [
+            (BeatUpbeatRatio.from_grid(self.grid, 'piano'), BeatUpbeatRatio(self.onsets, my_beats)),
+            (IOIComplexity.from_grid(self.grid, 'piano'), IOIComplexity(self.onsets, downbeats, 120, 4)),
+            (
+                EventDensity.from_grid(self.grid, 'piano', bar_period=2),
+                EventDensity(self.onsets, downbeats, bar_period=2)
+            )
+        ]:
+            self.assertEqual(json.loads(repr(actual)), json.loads(repr(expected)))
+
+
+class FeatureContextTest(unittest.TestCase):
+    rng = np.random.default_rng(5)
+    beats = np.arange(1, 101) * 0.5
+    summary_df = pd.DataFrame(beats[:, None] + rng.normal(0, 0.01, (100, 3)), columns=['piano', 'bass', 'drums'])
+    summary_df['beats'] = beats
+    summary_df['metre_auto'] = np.tile([1, 2, 3, 4], 25)
+    summary_df.loc[[10, 50], 'bass'] = np.nan
+
+    def setUp(self):
+        self.context = FeatureContext(
+            beats=self.beats, downbeats=self.beats[::4], metre=self.summary_df['metre_auto'], tempo=120,
+            summary_df=self.summary_df
+        )
+
+    def test_phase_correction_from_context(self):
+        """Tests that phase correction models using intermediate arrays from the context match those without"""
+        df = self.summary_df
+        pairs = [(df['piano'], df[['bass', 'drums']]), (df['bass'], df[['piano', 'drums']])]
+        for kws in [dict(), dict(iqr_filter=True), dict(difference_iois=False)]:
+            expected = PhaseCorrection.fit_batch(pairs, order=2, **kws)
+            actual = PhaseCorrection.fit_batch(pairs, order=2, context=self.context, **kws)
+            for act, exp in zip(actual, expected):
+                self.assertEqual(json.loads(repr(act)), json.loads(repr(exp)))
+        # Formatting the arrays for the models should not modify the cached arrays
+        self.assertEqual(self.context.get_beat_iois('piano').name, 'piano')
+
+    def test_phase_correction_mismatched_context(self):
+        """Tests that phase correction falls back to the input data when it doesn't come from the context"""
+        df = self.summary_df
+        # Series from another part of the track, with the same names as columns in the context
+        expected = PhaseCorrection(df['piano'].iloc[5:], df[['bass', 'drums']].iloc[5:], order=2)
+        actual = PhaseCorrection(df['piano'].iloc[5:], df[['bass', 'drums']].iloc[5:], order=2, context=self.context)
+        self.assertEqual(json.loads(repr(actual)), json.loads(repr(expected)))
+        # Unnamed series, and series with names that aren't columns in the context
+        unnamed = pd.Series(df['piano'].to_numpy() + 0.01)
+        renamed = df[['bass', 'drums']].rename(columns={'bass': 'guitar'})
+        for my_beats, their_beats in [(unnamed, df['bass']), (df['piano'], renamed), (df['piano'].rename(None), None)]:
+            pc = PhaseCorrection(my_beats, their_beats, order=2, context=self.context, fit=False)
+            self.assertFalse(pc._use_context(my_beats, their_beats))
+            actual_y, actual_x = pc.get_model_inputs(my_beats, their_beats)
+            expected_y, expected_x = PhaseCorrection(my_beats, their_beats, order=2, fit=False).get_model_inputs(
+                my_beats, their_beats
+            )
+            pd.testing.assert_series_equal(actual_y, expected_y)
+            pd.testing.assert_frame_equal(actual_x, expected_x)
+        self.assertTrue(PhaseCorrection(df['piano'], df['bass'], context=self.context)._use_context(df['piano']))
+
+    def test_tempo_slope_from_context(self):
+        """Tests that the tempo slope from the mean of every beat in the context matches the original"""
+        expected = TempoSlope(self.summary_df[['piano', 'bass', 'drums']].mean(axis=1))
+        self.assertEqual(TempoSlope.from_context(self.context).summary_dict, expected.summary_dict)
+
+    def test_dependency_report(self):
+        """Tests that the report shows which arrays were computed and reused by each feature"""
+        with self.context.track('first'):
+            self.context.get_differenced_iois('piano')
+            self.context.get_asynchronies('piano', 'bass')
+        with self.context.track('second'):
+            self.context.get_differenced_iois('piano')
+            asynchronies = self.context.get_asynchronies('bass', 'piano')
+        pd.testing.assert_series_equal(asynchronies, self.summary_df['piano'] - self.summary_df['bass'])
+        report = self.context.dependency_report()
+        self.assertEqual(report['feature'].tolist(), ['first'] * 3 + ['second'] * 2)
+        self.assertEqual(report['status'].tolist(), ['computed'] * 3 + ['reused'] * 2)
+        self.assertEqual(report['intermediate'].iloc[1], 'beat_iois_piano')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,219 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Test suite for melodic feature extraction in src/features/melody_features.py"""
+
+import math
+import os
+import tempfile
+import unittest
+import warnings
+from collections import Counter
+
+import numpy as np
+
+from src.detect.midi_utils import MelodyMaker
+from src import utils
+from src.features.melody_features import (
+    HURON_CONTOURS, KEY_NAMES, ContourExtractor, IntervalExtractor, MelodyChunkManager, MultiMelodyChunkManager,
+    PitchExtractor, TonalityExtractor, contour_kernel, interval_kernel, key_correlations, normalized_entropy,
+    pitch_kernel, tonality_kernel
+)
+from test.test_midi_utils import write_random_midi
+
+
+def normalized_entropy_reference(array: list, norm: int) -> float:
+    """The original implementation of `normalized_entropy`, used as a reference"""
+    rel_freq = [v / len(array) for _, v in Counter(array).items()]
+    return -(sum(v * math.log(v, 2) for v in rel_freq) / math.log(norm, 2))
+
+
+def pitch_features_reference(my_notes: list) -> dict:
+    """The original, list-based implementation of `PitchExtractor`, used as a reference"""
+    pitches = [i.pitch for i in my_notes]
+    return {
+        'pitch_range': max(pitches) - min(pitches) if len(pitches) > 1 else np.nan,
+        'pitch_std': np.nanstd(pitches),
+        'pitch_class_entropy': normalized_entropy_reference([i.pitch_class for i in my_notes], 24)
+    }
+
+
+def interval_features_reference(my_notes: list) -> dict:
+    """The original, list-based implementation of `IntervalExtractor`, used as a reference"""
+    intervals = [i2.pitch - i1.pitch for i2, i1 in zip(my_notes, my_notes[1:])]
+    abs_intervals = [abs(i) for i in intervals]
+    abs_freqs = Counter(intervals)
+    top_freqs = [k for k, v in abs_freqs.items() if v == max(abs_freqs.values())]
+    return dict(
+        abs_interval_range=max(abs_intervals) - min(abs_intervals) if len(abs_intervals) > 1 else np.nan,
+        mean_abs_interval=np.nanmean(abs_intervals),
+        std_abs_interval=np.nanstd(abs_intervals),
+        interval_entropy=normalized_entropy_reference(intervals, norm=23),
+        modal_interval=max(top_freqs, key=lambda i: abs(i))
+    )
+
+
+def contour_features_reference(my_notes: list) -> dict:
+    """The original implementation of `ContourExtractor`, testing each of the Huron contours in turn, as a reference"""
+    pitches = [i.pitch for i in my_notes]
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        firstpitch, meanpitch, lastpitch = pitches[0], np.mean(pitches[1:-2]), pitches[-1]
+    for name, func in HURON_CONTOURS.items():
+        if func(firstpitch, meanpitch, lastpitch):
+            return dict(huron_contour=name)
+    return dict(huron_contour=None)
+
+
+class RaggedKernelsTest(unittest.TestCase):
+    rng = np.random.default_rng(14)
+    # Chunks of random pitches with different lengths, including some very short chunks
+    lengths = np.concatenate([[1, 2, 3, 4], rng.integers(5, 40, 60)])
+    offsets = np.concatenate([[0], np.cumsum(lengths)])
+    pitches = rng.integers(60, 72, offsets[-1])
+
+    def get_chunks(self):
+        """Splits the ragged batch of pitches into a list of pitches for every chunk"""
+        return [self.pitches[lo:hi].tolist() for lo, hi in zip(self.offsets, self.offsets[1:])]
+
+    def test_pitch_kernel(self):
+        """Tests pitch features for every chunk against calculating them for each chunk with lists"""
+        actual = pitch_kernel(self.pitches, self.offsets)
+        for num, pitches in enumerate(self.get_chunks()):
+            expected_range = max(pitches) - min(pitches) if len(pitches) > 1 else np.nan
+            np.testing.assert_equal(actual['pitch_range'][num], expected_range)
+            self.assertAlmostEqual(actual['pitch_std'][num], np.nanstd(pitches))
+            self.assertAlmostEqual(
+                actual['pitch_class_entropy'][num], normalized_entropy([p % 12 for p in pitches], 24)
+            )
+        # Ranges of integer pitches should be integers, as with lists, unless any chunks are too short
+        self.assertEqual(actual['pitch_range'].dtype, float)
+        complete = pitch_kernel(self.pitches[self.offsets[1]:], self.offsets[1:] - self.offsets[1])
+        self.assertEqual(complete['pitch_range'].dtype, np.int64)
+
+    def test_interval_kernel(self):
+        """Tests interval features for every chunk against calculating them for each chunk with lists"""
+        actual = interval_kernel(self.pitches, self.offsets)
+        for num, pitches in enumerate(self.get_chunks()[1:], 1):
+            intervals = [i2 - i1 for i2, i1 in zip(pitches, pitches[1:])]
+            abs_intervals = [abs(i) for i in intervals]
+            self.assertAlmostEqual(actual['mean_abs_interval'][num], np.mean(abs_intervals))
+            self.assertAlmostEqual(actual['std_abs_interval'][num], np.std(abs_intervals))
+            self.assertAlmostEqual(actual['interval_entropy'][num], normalized_entropy(intervals, 23))
+            self.assertEqual(actual['modal_interval'][num], IntervalExtractor.modal_interval(intervals))
+        # A single note has no intervals
+        self.assertTrue(np.isnan(actual['modal_interval'][0]))
+        # We need at least three notes to get an integer interval range for every chunk
+        self.assertEqual(actual['abs_interval_range'].dtype, float)
+        complete = interval_kernel(self.pitches[self.offsets[2]:], self.offsets[2:] - self.offsets[2])
+        self.assertEqual(complete['abs_interval_range'].dtype, np.int64)
+
+    def test_contour_kernel(self):
+        """Tests Huron contours for every chunk against testing each contour in turn"""
+        actual = contour_kernel(self.pitches, self.offsets)
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)
+            expected = [ContourExtractor.huron_contour(pitches) for pitches in self.get_chunks()]
+        self.assertEqual(actual['huron_contour'].tolist(), expected)
+        # We need at least four notes to get a contour
+        self.assertEqual(actual['huron_contour'].tolist()[:4], [None, None, None, expected[3]])
+        self.assertIsNotNone(expected[3])
+
+
+class TonalityTest(unittest.TestCase):
+    rng = np.random.default_rng(13)
+    histograms = rng.integers(0, 10, (50, 12)).astype(float)
+
+    def test_key_correlations(self):
+        """Tests correlations with every key against correlating each rotation of the histogram with `np.corrcoef`"""
+        actual = key_correlations(self.histograms)
+        for histogram, corrs in zip(self.histograms, actual):
+            for num, key in enumerate(KEY_NAMES):
+                pitch, mode = key.split(' ')
+                tonic = utils.ALL_PITCHES.index(pitch)
+                profile = TonalityExtractor.MAJ_PROFILE if mode == 'major' else TonalityExtractor.MIN_PROFILE
+                expected = np.corrcoef(profile, np.roll(histogram / histogram.sum(), -tonic))[1, 0]
+                self.assertAlmostEqual(corrs[num], expected)
+
+    def test_tonality_kernel(self):
+        """Tests tonality features for many chunks against the definitions for a single chunk"""
+        corrs = key_correlations(self.histograms)
+        actual = tonality_kernel(corrs)
+        for num, chunk_corrs in enumerate(corrs):
+            # Remove duplicate correlations, allowing for floating point error
+            corrs_set = sorted(chunk_corrs)
+            duplicates = np.isclose(corrs_set, [np.nan] + corrs_set[:-1], rtol=1e-12, atol=1e-12)
+            corrs_set = [c for c, dup in zip(corrs_set, duplicates) if not dup]
+            self.assertEqual(actual['tonalness'][num], corrs_set[-1])
+            self.assertAlmostEqual(actual['tonal_clarity'][num], corrs_set[-1] / corrs_set[-2])
+            self.assertAlmostEqual(actual['tonal_spike'][num], corrs_set[-1] / sum(i for i in corrs_set if i > 0))
+            self.assertEqual(actual['mode'][num], KEY_NAMES[np.argmax(chunk_corrs)].split(' ')[-1])
+
+
+class MelodyChunkManagerTest(unittest.TestCase):
+    rng = np.random.default_rng(12)
+    beats = np.cumsum(rng.uniform(0.4, 0.6, 200))
+    extractors = [PitchExtractor, IntervalExtractor, ContourExtractor, TonalityExtractor]
+
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        midi_fpath = os.path.join(self.tempdir.name, 'piano_midi.mid')
+        write_random_midi(midi_fpath, self.beats, self.rng, n_notes=1000)
+        self.mm = MelodyMaker(midi_fpath, self.beats, self.beats[::4], tempo=120, time_signature=4)
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+
+    def test_multiple_extractors(self):
+        """Tests that applying every extractor in one pass matches applying each extractor separately"""
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)
+            multi = MultiMelodyChunkManager(self.extractors, self.mm)
+            separate = {}
+            for extractor in self.extractors:
+                separate.update(MelodyChunkManager(extractor, self.mm).summary_dict)
+        self.assertEqual(list(multi.summary_dict.keys()), list(separate.keys()))
+        np.testing.assert_array_equal(list(multi.summary_dict.values()), list(separate.values()))
+        self.assertEqual(len(multi.chunk_features[PitchExtractor]['pitch_range']), len(self.mm.chunk_melody()))
+
+    def test_chunk_features(self):
+        """Tests features for every chunk, extracted at once and for each chunk, against the original implementations"""
+        chunks = [chunk for chunk in self.mm.chunk_melody() if len(chunk) > 2]
+        references = [
+            (PitchExtractor, pitch_features_reference),
+            (IntervalExtractor, interval_features_reference),
+            (ContourExtractor, contour_features_reference)
+        ]
+        for extractor, reference in references:
+            expected = [reference(chunk) for chunk in chunks]
+            batch = MultiMelodyChunkManager.extract_chunks(extractor, chunks)
+            chunk_list = MelodyChunkManager(extractor, self.mm).chunk_list
+            self.assertEqual(len(chunk_list), len(expected))
+            for num, (chunk, exp) in enumerate(zip(chunks, expected)):
+                single = extractor(chunk).summary_dict
+                self.assertEqual(list(single.keys()), list(exp.keys()))
+                for k, v in exp.items():
+                    for actual in [single[k], batch[k][num], chunk_list[num][k]]:
+                        if isinstance(v, str) or v is None:
+                            self.assertEqual(actual, v)
+                        else:
+                            np.testing.assert_allclose(actual, v, rtol=1e-12, atol=1e-12)
+        # Modal intervals and ranges are whole numbers of semitones, as in the original implementation
+        self.assertIsInstance(IntervalExtractor(chunks[0]).summary_dict['modal_interval'], int)
+        self.assertIsInstance(IntervalExtractor(chunks[0]).summary_dict['abs_interval_range'], int)
+        self.assertIsInstance(PitchExtractor(chunks[0]).summary_dict['pitch_range'], int)
+        self.assertIsInstance(interval_kernel(np.array([60, 62, 60]), np.array([0, 3]))['modal_interval'][0], np.int64)
+
+    def test_tonality_chunks(self):
+        """Tests that extracting tonality features for every chunk at once matches extracting them for each chunk"""
+        chunks = [chunk for chunk in self.mm.chunk_melody() if len(chunk) > 2]
+        batch = TonalityExtractor.extract_chunks(chunks)
+        for num, chunk in enumerate(chunks):
+            expected = TonalityExtractor(chunk).summary_dict
+            self.assertEqual(expected.pop('mode'), batch['mode'][num])
+            for k, v in expected.items():
+                self.assertAlmostEqual(v, batch[k][num])
+
+
+if __name__ == '__main__':
+    unittest.main()
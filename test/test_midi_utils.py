@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Test suite for MelodyMaker and note tables in src/detect/midi_utils.py"""
+
+import os
+import tempfile
+import unittest
+
+import numpy as np
+import pretty_midi
+
+from src.detect.midi_utils import NOTE_NAMES, MelodyMaker, Note, make_note_table
+
+
+def skyline_reference(notes: list[pretty_midi.Note], beats: np.array, tempo_thresh: float) -> list[tuple]:
+    """A brute-force implementation of the skyline algorithm in `MelodyMaker.extract_melody`, used as a reference"""
+    notes = sorted(
+        [n for n in notes if n.end - n.start >= max(tempo_thresh, MelodyMaker.TIME_THRESH) and n.pitch > 60],
+        key=lambda n: n.start
+    )
+    melody = []
+    for beat1, beat2 in zip(beats, beats[1:]):
+        ticks = np.linspace(beat1, beat2, 8)
+        # Quantize the notes within this beat to the nearest 64th note
+        quantized = [
+            (ticks[np.argmin(np.abs(n.start - ticks))], n.end, n.pitch, n.velocity)
+            for n in notes if beat1 <= n.start < beat2
+        ]
+        # Get the highest note at every quantized start time
+        for start in sorted(set(q[0] for q in quantized)):
+            melody.append(max([q for q in quantized if q[0] == start], key=lambda q: q[2]))
+    return melody
+
+
+def write_random_midi(fpath: str, beats: np.array, rng: np.random.Generator, n_notes: int = 400) -> None:
+    """Writes a MIDI file with random notes, including some chords on the beat and some very short notes"""
+    starts = np.concatenate([rng.uniform(0, beats[-1], n_notes), np.repeat(beats[10:20], 3)])
+    durations = 0.05 + rng.exponential(0.2, len(starts))
+    durations[:20] = 0.005
+    instrument = pretty_midi.Instrument(0)
+    instrument.notes = [
+        pretty_midi.Note(velocity=int(v), pitch=int(p), start=s, end=s + d)
+        for s, d, p, v in zip(starts, durations, rng.integers(40, 100, len(starts)), rng.integers(1, 127, len(starts)))
+    ]
+    midi = pretty_midi.PrettyMIDI(initial_tempo=120)
+    midi.instruments.append(instrument)
+    midi.write(fpath)
+
+
+class MelodyMakerTest(unittest.TestCase):
+    rng = np.random.default_rng(11)
+    beats = np.cumsum(rng.uniform(0.4, 0.6, 100))
+
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.midi_fpath = os.path.join(self.tempdir.name, 'piano_midi.mid')
+        write_random_midi(self.midi_fpath, self.beats, self.rng)
+        self.mm = MelodyMaker(self.midi_fpath, self.beats, self.beats[::4], tempo=120, time_signature=4)
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+
+    def test_note_table(self):
+        """Tests that note names, octaves, and pitch classes from lookup tables match those from `pretty_midi`"""
+        table = self.mm.notes
+        self.assertTrue((np.diff(table.start) >= 0).all())
+        self.assertEqual(len(table), len(self.mm.midi.notes))
+        for row in table:
+            name = pretty_midi.note_number_to_name(row.pitch)
+            self.assertEqual(NOTE_NAMES[row.note_index] + str(row.octave), name)
+            self.assertEqual(row.pitch_class, pretty_midi.note_name_to_number(NOTE_NAMES[row.note_index] + '0') - 12)
+        note = Note(table[0])
+        self.assertEqual(note.note + str(note.octave), pretty_midi.note_number_to_name(note.pitch))
+        self.assertEqual(len(make_note_table([])), 0)
+
+    def test_melody_matches_reference(self):
+        """Tests that the extracted melody matches the brute-force skyline algorithm"""
+        expected = skyline_reference(self.mm.midi.notes, self.beats, self.mm.tempo_thresh)
+        actual = [(n.start, n.end, n.pitch, n.velocity) for n in self.mm.extract_melody()]
+        self.assertEqual(actual, expected)
+
+    def test_melody_beat_boundaries(self):
+        """Tests that notes quantized to the end of one beat are kept separate from notes in the next beat"""
+        self.mm.notes = make_note_table([
+            pretty_midi.Note(velocity=50, pitch=70, start=self.beats[5] - 0.001, end=self.beats[6]),
+            pretty_midi.Note(velocity=50, pitch=72, start=self.beats[5], end=self.beats[6]),
+            pretty_midi.Note(velocity=60, pitch=72, start=self.beats[5] + 0.001, end=self.beats[6]),
+            pretty_midi.Note(velocity=50, pitch=80, start=self.beats[-1], end=self.beats[-1] + 1),
+        ])
+        melody = self.mm.extract_melody_table()
+        np.testing.assert_array_equal(melody.start, [self.beats[5], self.beats[5]])
+        np.testing.assert_array_equal(melody.pitch, [70, 72])
+        # When two notes have the same pitch, we keep the first one
+        self.assertEqual(melody.velocity[1], 50)
+
+    def test_melody_memoised(self):
+        """Tests that the melody is only extracted once"""
+        self.assertIs(self.mm.extract_melody_table(), self.mm.extract_melody_table())
+        self.assertIs(next(self.mm.extract_melody()), next(self.mm.extract_melody()))
+
+    def test_chunk_melody(self):
+        """Tests that chunking the melody with index ranges matches filtering every note for every chunk"""
+        melody = list(self.mm.extract_melody())
+        for chunk_measures, overlapping_chunks in [(4, True), (4, False), (3, False), (100, True)]:
+            downbeats = self.mm.downbeats
+            if overlapping_chunks:
+                z = zip(downbeats, downbeats[chunk_measures:])
+            else:
+                z = zip(downbeats[::chunk_measures], downbeats[chunk_measures::chunk_measures])
+            expected = [tuple(m for m in melody if db1 <= m.start < db2) for db1, db2 in z]
+            actual = self.mm.chunk_melody(chunk_measures=chunk_measures, overlapping_chunks=overlapping_chunks)
+            self.assertEqual(actual, expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
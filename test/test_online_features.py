@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Test suite for online feature extractors in src/features/online_features.py"""
+
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from src.features.online_features import (
+    OnlineAsynchrony, OnlineBeatUpbeatRatio, OnlineIOISummaryStats, OnlinePhaseCorrection,
+    OnlineRollingIOISummaryStats, RecursiveLeastSquares, RunningMedian, RunningMoments
+)
+from src.features.rhythm_features import (
+    Asynchrony, BeatUpbeatRatio, IOISummaryStats, PhaseCorrection, RollingIOISummaryStats
+)
+
+
+class AccumulatorsTest(unittest.TestCase):
+    rng = np.random.default_rng(7)
+
+    def test_running_moments(self):
+        """Tests that moments updated in chunks match numpy functions on the whole array"""
+        values = self.rng.normal(5, 2, 1000)
+        values[self.rng.choice(1000, 50)] = np.nan
+        moments, median = RunningMoments(), RunningMedian()
+        for chunk in np.array_split(values, [3, 4, 200, 650]):
+            moments.update(chunk)
+            median.update(chunk)
+        self.assertAlmostEqual(moments.mean, np.nanmean(values))
+        self.assertAlmostEqual(moments.var(), np.nanvar(values))
+        self.assertAlmostEqual(moments.std(ddof=1), np.nanstd(values, ddof=1))
+        self.assertEqual(moments.count, 1000)
+        self.assertEqual(median.median, np.nanmedian(values))
+
+    def test_recursive_least_squares(self):
+        """Tests that parameters and standard errors from RLS match a batch OLS fit"""
+        x = np.column_stack([np.ones(200), self.rng.normal(size=(200, 2))])
+        y = x @ [1., 2., -3.] + self.rng.normal(size=200)
+        rls = RecursiveLeastSquares(3)
+        for idx in np.array_split(np.arange(200), 7):
+            rls.update(x[idx], y[idx])
+        params, ssr, *_ = np.linalg.lstsq(x, y, rcond=None)
+        np.testing.assert_allclose(rls.params, params)
+        np.testing.assert_allclose(rls.ssr, ssr[0])
+        np.testing.assert_allclose(rls.bse, np.sqrt(np.diag(np.linalg.inv(x.T @ x)) * ssr[0] / 197))
+
+
+class OnlineExtractorsTest(unittest.TestCase):
+    rng = np.random.default_rng(8)
+    beats = np.arange(1, 401) * 0.5
+    summary_df = pd.DataFrame(beats[:, None] + rng.normal(0, 0.01, (400, 3)), columns=['piano', 'bass', 'drums'])
+    summary_df.loc[rng.choice(400, 20), 'bass'] = np.nan
+    # Swung eighth notes, played on every beat and two-thirds of the way between beats
+    onsets = np.sort(np.concatenate([summary_df['piano'], beats[:-1] + 0.33 + rng.normal(0, 0.01, 399)]))
+    downbeats = beats[::4]
+    # Times to split the performance into chunks at
+    edges = [0, 10.2, 10.4, 77, 150, np.inf]
+
+    def get_chunks(self):
+        """Splits the onsets, beats, and matched onsets into chunks at the edges"""
+        for start, end in zip(self.edges, self.edges[1:]):
+            beat_idx = (self.beats > start) & (self.beats <= end)
+            yield (
+                self.onsets[(self.onsets > start) & (self.onsets <= end)],
+                self.summary_df[beat_idx],
+                self.downbeats[(self.downbeats > start) & (self.downbeats <= end)],
+                np.isinf(end)
+            )
+
+    def assertSummaryEqual(self, actual: dict, expected: dict):
+        """Checks that every value from an online extractor matches the equivalent batch extractor"""
+        for k, v in actual.items():
+            np.testing.assert_allclose(v, expected[k], rtol=1e-7, err_msg=k)
+
+    def test_onsets_and_beats(self):
+        """Tests that BUR, IOI, and rolling statistics updated in chunks match the batch extractors"""
+        bur, ioi, roll = OnlineBeatUpbeatRatio(), OnlineIOISummaryStats(), OnlineRollingIOISummaryStats(order=4)
+        for ons, matched, downbeats, final in self.get_chunks():
+            bur.update(ons, matched['piano'], final=final)
+            ioi.update(ons)
+            roll.update(ons, downbeats, final=final)
+        self.assertSummaryEqual(bur.summary(), BeatUpbeatRatio(self.onsets, self.summary_df['piano']).summary_dict)
+        self.assertSummaryEqual(ioi.summary(), IOISummaryStats(self.onsets).summary_dict)
+        self.assertSummaryEqual(
+            roll.summary(), RollingIOISummaryStats(self.onsets, self.downbeats, order=4).summary_dict
+        )
+
+    def test_matched_onsets(self):
+        """Tests that asynchrony and phase correction updated in chunks match the batch extractors"""
+        asy, pc = OnlineAsynchrony('piano'), OnlinePhaseCorrection('piano', order=2)
+        for _, matched, _, _ in self.get_chunks():
+            asy.update(matched)
+            pc.update(matched)
+        my_beats, their_beats = self.summary_df['piano'], self.summary_df[['bass', 'drums']]
+        self.assertSummaryEqual(asy.summary(), Asynchrony(my_beats, their_beats).summary_dict)
+        self.assertSummaryEqual(pc.summary(), PhaseCorrection(my_beats, their_beats, order=2).summary_dict)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Test suite for memory-budgeted processing of tracks in src/detect/process_dataset.py"""
+
+import os
+import tempfile
+import threading
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch
+
+import numpy as np
+import soundfile as sf
+
+from src import utils
+from src.detect import process_dataset
+
+
+class EstimatePeakMemoryTest(unittest.TestCase):
+    def test_zero_duration(self):
+        """Tests that the estimate for an empty track is just the largest fixed overhead"""
+        self.assertEqual(process_dataset.estimate_peak_memory(0.0), max(process_dataset.STAGE_OVERHEAD.values()))
+
+    def test_matches_stages(self):
+        """Tests that the estimate is the largest of the linear per-stage models"""
+        duration = 300.0
+        for dtype in [np.float32, np.float64]:
+            itemsize = np.dtype(dtype).itemsize
+            expected = max(
+                process_dataset.STAGE_OVERHEAD[stage]
+                + duration * process_dataset.STAGE_SAMPLES_PER_SEC[stage] * itemsize
+                + duration * process_dataset.STAGE_FIXED_BYTES_PER_SEC[stage]
+                for stage in process_dataset.STAGE_OVERHEAD.keys()
+            )
+            self.assertAlmostEqual(process_dataset.estimate_peak_memory(duration, dtype), expected)
+
+    def test_monotonic(self):
+        """Tests that longer tracks and higher precision both increase the estimate"""
+        durations = [0, 10, 60, 600, 3600]
+        estimates = [process_dataset.estimate_peak_memory(d) for d in durations]
+        self.assertTrue((np.diff(estimates) > 0).all())
+        self.assertGreater(
+            process_dataset.estimate_peak_memory(600, np.float64), process_dataset.estimate_peak_memory(600, np.float32)
+        )
+
+    def test_memory_budget(self):
+        """Tests that the memory budget is a fraction of a positive total memory, even without `os.sysconf`"""
+        self.assertGreater(process_dataset.get_memory_budget(), 0)
+        with patch.dict('sys.modules', {'psutil': None}), \
+                patch.object(os, 'sysconf', create=True, side_effect=ValueError):
+            self.assertEqual(process_dataset.get_memory_budget(0.5), 0.5 * process_dataset.FALLBACK_TOTAL_MEMORY)
+
+
+class GetTrackDurationTest(unittest.TestCase):
+    sr = 8000
+
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        os.makedirs(os.path.join(self.tempdir.name, 'data', 'raw', 'audio'))
+        self.item = dict(fname='track', timestamps=dict(start='00:10', end='01:40'))
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+
+    def test_duration_from_audio(self):
+        """Tests that the duration of a track is taken from its audio, when this is present locally"""
+        fpath = os.path.join(self.tempdir.name, 'data', 'raw', 'audio', f'track.{utils.AUDIO_FILE_FMT}')
+        sf.write(fpath, np.zeros((self.sr * 3, 2)), self.sr)
+        with patch.object(utils, 'get_project_root', return_value=self.tempdir.name):
+            self.assertAlmostEqual(process_dataset.get_track_duration(self.item), 3.0, places=2)
+
+    def test_duration_from_timestamps(self):
+        """Tests that the duration of a track is taken from its timestamps, when no audio is present"""
+        with patch.object(utils, 'get_project_root', return_value=self.tempdir.name):
+            self.assertEqual(process_dataset.get_track_duration(self.item), 90.0)
+            self.item['timestamps']['end'] = ''
+            self.assertEqual(process_dataset.get_track_duration(self.item), 0.0)
+
+
+class ProcessItemsUnderBudgetTest(unittest.TestCase):
+    """Runs `process_items_under_budget` with a dummy worker, where the estimated memory of a track is its duration"""
+
+    def setUp(self):
+        self.lock = threading.Lock()
+        self.started, self.concurrent, self.in_use, self.peaks = [], [], [], []
+
+    def dummy_process_item(self, track: dict, *_) -> float:
+        """Records the tracks that are running (and their total memory) when this track starts"""
+        with self.lock:
+            self.started.append(track['duration'])
+            self.in_use.append(track['duration'])
+            self.concurrent.append(len(self.in_use))
+            self.peaks.append(sum(self.in_use))
+        time.sleep(0.02 + track['duration'] / 1000)
+        with self.lock:
+            self.in_use.remove(track['duration'])
+        return track['duration']
+
+    def run_under_budget(self, durations: list, **kwargs) -> list:
+        tracks = [dict(duration=d) for d in durations]
+        with ThreadPoolExecutor(max_workers=kwargs.get('n_jobs', 4)) as executor, \
+                patch.object(process_dataset, 'process_item', self.dummy_process_item), \
+                patch.object(process_dataset, 'get_reusable_executor', return_value=executor), \
+                patch.object(process_dataset, 'get_track_duration', lambda t: t['duration']), \
+                patch.object(process_dataset, 'estimate_peak_memory', lambda d, _: d):
+            return process_dataset.process_items_under_budget(tracks, False, **kwargs)
+
+    def test_longest_first(self):
+        """Tests that tracks are started in order of their estimated memory, largest first"""
+        durations = [3, 9, 1, 7, 5]
+        res = self.run_under_budget(durations, n_jobs=1, memory_budget=100)
+        self.assertEqual(self.started, sorted(durations, reverse=True))
+        # Results should be returned in the same order as the input tracks
+        self.assertEqual(res, durations)
+
+    def test_never_over_budget(self):
+        """Tests that the total estimated memory of all running tracks never goes over the budget"""
+        durations = [4, 6, 2, 8, 5, 3, 7, 1, 2, 6]
+        res = self.run_under_budget(durations, n_jobs=4, memory_budget=10)
+        self.assertEqual(res, durations)
+        self.assertLessEqual(max(self.peaks), 10)
+        # We should still be processing more than one track at once where we can
+        self.assertGreater(max(self.concurrent), 1)
+
+    def test_oversized_item_alone(self):
+        """Tests that a track larger than the whole budget is still processed, but only when nothing else is running"""
+        durations = [2, 15, 3, 4]
+        res = self.run_under_budget(durations, n_jobs=4, memory_budget=10)
+        self.assertEqual(res, durations)
+        self.assertEqual(self.concurrent[self.started.index(15)], 1)
+        # No other track should have been started while the oversized track was running
+        self.assertEqual(max(self.peaks), 15)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,538 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Test suite for feature extraction classes in src/features/rhythm_features.py"""
+
+import random
+import unittest
+
+import numpy as np
+import pandas as pd
+import scipy.stats as stats
+
+from src.features.features_utils import get_window_bounds
+from src.features.rhythm_features import (
+    Asynchrony, asynchrony_kernel, BeatUpbeatRatio, bur_kernel, CrossCorrelation, EventDensity, GrangerCausality,
+    IOIComplexity, IOISummaryStats, PartialCorrelation, PhaseCorrection, ProportionalAsynchrony, RollingIOISummaryStats
+)
+
+
+def lz77_compress_reference(data: str, window_size: int = 4096) -> list:
+    """The original, brute-force implementation of `IOIComplexity.lz77_compress`, used as a reference"""
+    compressed = []
+    index = 0
+    while index < len(data):
+        best_offset = -1
+        best_length = -1
+        best_match = ''
+        # Search for the longest match in the sliding window
+        for length in range(1, min(len(data) - index, window_size)):
+            substring = data[index:index + length]
+            offset = data.rfind(substring, max(0, index - window_size), index)
+            if offset != -1 and length > best_length:
+                best_offset = index - offset
+                best_length = length
+                best_match = substring
+        if best_match:
+            compressed.append((best_offset, best_length, data[index + best_length]))
+            index += best_length + 1
+        else:
+            compressed.append((0, 0, data[index]))
+            index += 1
+    return compressed
+
+
+class LZ77Test(unittest.TestCase):
+    alphabet = ''.join(IOIComplexity.alphabet)
+
+    def _assert_equivalent(self, data: str, window_size: int = 4096) -> None:
+        self.assertEqual(
+            IOIComplexity.lz77_compress(data, window_size),
+            lz77_compress_reference(data, window_size),
+            msg=f'mismatch for data "{data}" with window size {window_size}'
+        )
+
+    def test_edge_cases(self):
+        """Tests compression of empty, single character, and repeated character strings"""
+        for data in ['', 'a', 'aa', 'aaa', 'ab', 'aab', 'abab', 'aaaaaaaaaa', 'abcabcabcabc']:
+            self._assert_equivalent(data)
+
+    def test_random_strings_equivalent(self):
+        """Tests that compression of random strings matches the reference implementation"""
+        rng = random.Random(42)
+        for _ in range(2000):
+            # Use small alphabets to ensure lots of repeated substrings
+            alphabet = self.alphabet[:rng.randint(1, len(self.alphabet))]
+            data = ''.join(rng.choice(alphabet) for _ in range(rng.randint(1, 60)))
+            self._assert_equivalent(data)
+
+    def test_small_windows_equivalent(self):
+        """Tests that compression with a sliding window shorter than the input matches the reference implementation"""
+        rng = random.Random(7)
+        for _ in range(1000):
+            data = ''.join(rng.choice('abc') for _ in range(rng.randint(1, 40)))
+            self._assert_equivalent(data, window_size=rng.randint(1, 12))
+
+    def test_batch_matches_individual(self):
+        """Tests that batch compression returns the same results, in the same order, as individual calls"""
+        rng = random.Random(0)
+        windows = [''.join(rng.choice('abcd') for _ in range(rng.randint(1, 30))) for _ in range(50)]
+        # Duplicate some windows, as would happen with overlapping bars
+        windows += windows[:10]
+        self.assertEqual(
+            IOIComplexity.lz77_compress_batch(windows),
+            [lz77_compress_reference(w) for w in windows]
+        )
+
+
+def ioi_complexity_reference(extractor: IOIComplexity, my_onsets: np.array, downbeats: np.array) -> tuple:
+    """The original per-window implementations of `IOIComplexity.bin_iois` and `extract_complexity`, as a reference"""
+    binned = []
+    for i in range(len(downbeats) - extractor.bar_period):
+        iois_bar = np.ediff1d(extractor.get_between(my_onsets, downbeats[i], downbeats[i + extractor.bar_period]))
+        binned_iois = np.array([extractor._bin_ioi(ioi) for ioi in iois_bar])
+        for binned_ioi in binned_iois[~np.isnan(binned_iois)]:
+            binned.append(dict(
+                bar_range=f'{i + 1}_{i + extractor.bar_period + 1}',
+                binned_ioi=binned_ioi,
+                binned_ascii=extractor.alphabet[extractor.fracs.index(binned_ioi)]
+            ))
+    binned = pd.DataFrame(binned, columns=['bar_range', 'binned_ioi', 'binned_ascii'])
+    complexity = []
+    for idx, grp in binned.groupby('bar_range', sort=False):
+        ascii_ = ''.join(grp['binned_ascii'].to_list())
+        complexity.append((idx, len(lz77_compress_reference(ascii_)), len(ascii_)))
+    return binned, pd.DataFrame(complexity, columns=IOIComplexity.col_names)
+
+
+class IOIComplexityTest(unittest.TestCase):
+    tempo, time_signature = 180, 4
+
+    def random_track(self, seed: int) -> tuple[np.ndarray, np.ndarray]:
+        """Returns random onsets and downbeats, with missing values, long gaps, and sparse bars"""
+        rng = np.random.default_rng(seed)
+        downbeats = np.cumsum(rng.uniform(1.2, 1.5, 60))
+        onsets = np.sort(rng.uniform(0, downbeats[-1] + 1, 400))
+        # Remove all the onsets from some bars, and leave only one onset in others
+        onsets = onsets[~((onsets > downbeats[10]) & (onsets < downbeats[16]))]
+        onsets = np.sort(np.append(onsets[~((onsets > downbeats[30]) & (onsets < downbeats[35]))], downbeats[32]))
+        # Onsets exactly on the downbeats
+        onsets = np.unique(np.concatenate([onsets, downbeats[40:45]]))
+        # Some onsets and downbeats are missing
+        onsets[rng.choice(len(onsets), 20, replace=False)] = np.nan
+        downbeats[[5, 50]] = np.nan
+        return onsets, downbeats
+
+    def test_matches_per_window_loop(self):
+        """Tests that binned IOIs and complexity scores match the original per-window loop"""
+        for seed, bar_period in [(1, 4), (2, 1), (3, 2), (4, 8)]:
+            onsets, downbeats = self.random_track(seed)
+            extractor = IOIComplexity(onsets, downbeats, self.tempo, self.time_signature, bar_period=bar_period)
+            expected_binned, expected_complexity = ioi_complexity_reference(extractor, onsets, downbeats)
+            # Windows with fewer than two onsets are dropped in both implementations
+            self.assertLess(len(expected_complexity), len(downbeats) - bar_period)
+            pd.testing.assert_frame_equal(extractor.binned_iois, expected_binned, check_dtype=False)
+            pd.testing.assert_frame_equal(extractor.complexity_df, expected_complexity, check_dtype=False)
+
+    def test_empty_windows(self):
+        """Tests that tracks with no valid IOIs in any window give an empty result, as with the original loop"""
+        downbeats = np.arange(10, dtype=float) * 1.5
+        for onsets in [np.array([]), np.array([0.1]), np.array([np.nan, 0.1, np.nan]), np.array([0.1, 14.0])]:
+            extractor = IOIComplexity(onsets, downbeats, self.tempo, self.time_signature)
+            expected_binned, _ = ioi_complexity_reference(extractor, onsets, downbeats)
+            self.assertEqual(len(extractor.binned_iois), len(expected_binned))
+            self.assertEqual(len(extractor.complexity_df), 0)
+            self.assertEqual(extractor.summary_dict['window_count'], 0)
+
+    def test_invalid_iois(self):
+        """Tests that missing IOIs and IOIs longer than one bar are not assigned a code"""
+        extractor = IOIComplexity(np.array([]), np.array([]), self.tempo, self.time_signature)
+        bar = extractor.quarter_note * self.time_signature
+        codes = extractor.bin_ioi_codes(np.array([np.nan, bar * 1.01, bar, bar / 2, 0.]))
+        np.testing.assert_array_equal(codes, [-1, -1, 0, 1, len(extractor.fracs) - 1])
+        self.assertTrue(np.isnan(extractor._bin_ioi(bar * 1.01)))
+
+
+def lempel_ziv_reference(binary: list) -> int:
+    """The original, pure Python implementation of Lempel-Ziv complexity, used as a reference"""
+    u, v, w = 0, 1, 1
+    v_max, complexity = 1, 1
+    while True:
+        if binary[u + v - 1] == binary[w + v - 1]:
+            v += 1
+            if w + v >= len(binary):
+                complexity += 1
+                break
+        else:
+            if v > v_max:
+                v_max = v
+            u += 1
+            if u == w:
+                complexity += 1
+                w += v_max
+                if w > len(binary):
+                    break
+                else:
+                    u = 0
+                    v = 1
+                    v_max = 1
+            else:
+                v = 1
+    return complexity
+
+
+class IOISummaryStatsTest(unittest.TestCase):
+    def test_lempel_ziv_equivalent(self):
+        """Tests that the compiled Lempel-Ziv complexity matches the pure Python implementation"""
+        rng = np.random.default_rng(42)
+        for _ in range(1000):
+            iois = pd.Series(rng.uniform(0.1, 1, rng.integers(3, 50)))
+            binary = [int(x > np.nanmean(iois)) for x in iois]
+            try:
+                expected = lempel_ziv_reference(binary)
+            except IndexError:
+                self.assertRaises(IndexError, IOISummaryStats.lempel_ziv_complexity, iois)
+            else:
+                self.assertEqual(IOISummaryStats.lempel_ziv_complexity(iois), expected)
+
+    def test_missing_values(self):
+        """Tests that summary functions ignore NaN values and return NaN for arrays that are too short"""
+        iois = pd.Series([np.nan, 0.5, 0.5, 0.25, np.nan, 0.25])
+        self.assertAlmostEqual(IOISummaryStats.binary_entropy(iois), 1.0)
+        self.assertAlmostEqual(IOISummaryStats.npvi(iois), 200 / 9)
+        self.assertTrue(np.isnan(IOISummaryStats.npvi(pd.Series([np.nan, 0.5]))))
+        self.assertTrue(np.isnan(IOISummaryStats.lempel_ziv_complexity(pd.Series([np.nan, 0.5, 0.4]))))
+
+
+class RollingIOISummaryStatsTest(unittest.TestCase):
+    rng = np.random.default_rng(1)
+    onsets = np.cumsum(rng.uniform(0.1, 0.5, 300))
+    downbeats = np.arange(0, onsets.max(), 2.0)
+
+    def _expected(self, bar_period: int, **kwargs) -> dict:
+        """Calculates rolling statistics by creating a new array for every window"""
+        res = {}
+        for i1, i2 in zip(self.downbeats, self.downbeats[bar_period:]):
+            iois = np.diff(self.onsets[(self.onsets >= i1) & (self.onsets <= i2)])
+            if kwargs.get('use_bpms', False):
+                iois = 60 / iois
+            for k, func in [
+                ('mean', np.mean), ('median', np.median), ('std', np.std), ('var', np.var),
+                ('quantile25', lambda x: np.quantile(x, 0.25)), ('quantile75', lambda x: np.quantile(x, 0.75)),
+                ('count_nonzero', len)
+            ]:
+                res.setdefault(f'rolling_{k}', []).append(func(iois))
+        return res
+
+    def test_rolling_statistics_match_windowed(self):
+        """Tests that rolling statistics match those calculated separately for each window"""
+        for kwargs in [{}, {'use_bpms': True}]:
+            actual = RollingIOISummaryStats.extract_rolling_statistics_multi(
+                self.onsets, self.downbeats, bar_periods=[1, 4], **kwargs
+            )
+            for bar_period in [1, 4]:
+                for k, v in self._expected(bar_period, **kwargs).items():
+                    np.testing.assert_allclose(actual[bar_period][k], v, rtol=1e-10, err_msg=k)
+
+    def test_missing_downbeats(self):
+        """Tests that windows with missing downbeats return NaN values"""
+        downbeats = self.downbeats.copy()
+        downbeats[5] = np.nan
+        rs = RollingIOISummaryStats(self.onsets, downbeats, order=1)
+        self.assertTrue(np.isnan(rs.rolling_statistics['rolling_mean'][5]))
+        self.assertEqual(rs.rolling_statistics['rolling_count'][5], 0)
+
+
+class GrangerCausalityTest(unittest.TestCase):
+    rng = np.random.default_rng(2)
+    grid = np.cumsum(np.full(400, 0.5))
+    beats = pd.DataFrame(grid[:, None] + rng.normal(0, 0.02, (len(grid), 3)), columns=['piano', 'bass', 'drums'])
+    # Add some missing values, so that restricted and unrestricted models use different observations
+    beats.loc[rng.choice(len(grid), 40), 'drums'] = np.nan
+    beats.loc[rng.choice(len(grid), 10), 'piano'] = np.nan
+
+    def _expected(self, partner: str, order: int) -> tuple[float, float]:
+        """Calculates the Granger index by fitting restricted and unrestricted phase correction models separately"""
+        kws = dict(order=order, ols_backend='statsmodels')
+        restricted = PhaseCorrection(self.beats['piano'], **kws).model
+        unrestricted = PhaseCorrection(self.beats['piano'], self.beats[partner], **kws).model
+        var_restricted, var_unrestricted = np.var(restricted.resid), np.var(unrestricted.resid)
+        gc = GrangerCausality(self.beats['piano'], self.beats[['bass', 'drums']], order=order)
+        p = gc.compute_fisher_test(var_restricted, var_unrestricted, restricted.nobs)
+        return np.log(var_restricted / var_unrestricted), p
+
+    def test_matches_separate_models(self):
+        """Tests that Granger indexes match those obtained from separately fitted models"""
+        for order in [1, 2, 3]:
+            gc = GrangerCausality(self.beats['piano'], self.beats[['bass', 'drums']], order=order)
+            for partner in ['bass', 'drums']:
+                gci, p = self._expected(partner, order)
+                self.assertAlmostEqual(gc.summary_dict[f'granger_causality_{partner}_i'], gci, places=10)
+                self.assertAlmostEqual(gc.summary_dict[f'granger_causality_{partner}_p'], p, places=10)
+
+    def test_sweep_matches_individual_orders(self):
+        """Tests that sweeping over many orders gives the same results as computing each order separately"""
+        gc = GrangerCausality(self.beats['piano'], self.beats[['bass', 'drums']], order=1, max_order=4)
+        self.assertEqual(gc.sweep['order'].tolist(), [1, 1, 2, 2, 3, 3, 4, 4])
+        for order in range(1, 5):
+            expected = GrangerCausality(self.beats['piano'], self.beats[['bass', 'drums']], order=order).sweep
+            pd.testing.assert_frame_equal(gc.sweep[gc.sweep['order'] == order].reset_index(drop=True), expected)
+        self.assertEqual(set(GrangerCausality.select_order(gc.sweep).index), {'bass', 'drums'})
+        # Passing `max_order=None` is the same as sweeping up to `order`
+        gc = GrangerCausality(self.beats['piano'], self.beats[['bass', 'drums']], order=2, max_order=None)
+        self.assertEqual(gc.sweep['order'].tolist(), [1, 1, 2, 2])
+
+
+class EventDensityTest(unittest.TestCase):
+    onsets = np.array([0.2, 0.5, 1.1, 3.9, np.nan, 4.0, 4.5, 7.2])
+    downbeats = np.array([0.0, 2.0, 4.0, 6.0, 8.0])
+
+    def test_matches_resample(self):
+        """Tests that event density per second matches the pandas resampling approach"""
+        ons = pd.Series(self.onsets)
+        for time_period in [1, 2, 3]:
+            expected = (
+                pd.DataFrame({'ts': pd.to_datetime(ons, unit='s'), 'density': ons})
+                .set_index('ts')
+                .resample(f'{time_period}s', label='left')
+                .count()
+                .reset_index(drop=False)
+            )
+            actual = EventDensity(ons, self.downbeats, time_period=time_period).per_second
+            pd.testing.assert_frame_equal(actual, expected, check_dtype=False)
+
+    def test_per_bar(self):
+        """Tests event density per bar, including onsets falling on a downbeat"""
+        ed = EventDensity(self.onsets, self.downbeats, bar_period=1)
+        self.assertEqual(ed.per_bar['bars'].tolist(), ['1-2', '2-3', '3-4', '4-5'])
+        self.assertEqual(ed.per_bar['density'].tolist(), [3, 2, 2, 1])
+        self.assertEqual(EventDensity(self.onsets, self.downbeats, bar_period=2).per_bar['density'].tolist(), [5, 3, 3])
+
+    def test_multiple_periods(self):
+        """Tests that extracting several periods at once matches extracting each period individually"""
+        ed = EventDensity(self.onsets, self.downbeats, time_period=[1, 2], bar_period=[1, 2])
+        for time_period, bar_period in zip([1, 2], [1, 2]):
+            single = EventDensity(self.onsets, self.downbeats, time_period=time_period, bar_period=bar_period)
+            pd.testing.assert_frame_equal(ed.per_second[time_period], single.per_second)
+            pd.testing.assert_frame_equal(ed.per_bar[bar_period], single.per_bar)
+            self.assertEqual(
+                ed.summary_dict[f'ed_per_{bar_period}_bars_mean'], single.summary_dict['ed_per_bar_mean']
+            )
+
+
+class AsynchronyTest(unittest.TestCase):
+    rng = np.random.default_rng(9)
+    beats = np.arange(1, 101) * 0.5
+    summary_df = pd.DataFrame(beats[:, None] + rng.normal(0, 0.02, (100, 3)), columns=['piano', 'bass', 'drums'])
+    summary_df.loc[rng.choice(100, 10), 'drums'] = np.nan
+
+    def test_matches_pairwise_calculation(self):
+        """Tests asynchrony statistics against calculating each pair of instruments individually"""
+        asy = Asynchrony(self.summary_df['piano'], self.summary_df[['bass', 'drums']]).summary_dict
+        for partner in ['bass', 'drums']:
+            asynchronies = (self.summary_df['piano'] - self.summary_df[partner]).to_numpy()
+            self.assertAlmostEqual(asy[f'{partner}_async_mean_pairwise_asynchrony'], np.nanmean(asynchronies))
+            self.assertAlmostEqual(asy[f'{partner}_async_pairwise_asynchronization'], np.nanstd(asynchronies, ddof=1))
+            self.assertAlmostEqual(asy[f'{partner}_async_mean_absolute_asynchrony'], np.nanmean(abs(asynchronies)))
+        self.assertTrue(np.isnan(asy['piano_async_mean']))
+        complete = self.summary_df.dropna()
+        self.assertAlmostEqual(
+            asy['mean_relative_asynchrony'], (complete['piano'] - complete.mean(axis=1)).mean()
+        )
+
+    def test_from_matrix(self):
+        """Tests that creating extractors for every instrument at once matches creating them individually"""
+        extractors = Asynchrony.from_matrix(self.summary_df)
+        # Extractors are returned in the same order as the columns of the input
+        self.assertEqual(len(extractors), len(self.summary_df.columns))
+        for my_instr, asy in zip(self.summary_df.columns, extractors):
+            others = [i for i in self.summary_df.columns if i != my_instr]
+            expected = Asynchrony(self.summary_df[my_instr], self.summary_df[others]).summary_dict
+            keys = [
+                f'{instr}_async_{func_k}' for instr in self.summary_df.columns for func_k in asy.summary_funcs.keys()
+            ] + ['mean_relative_asynchrony']
+            self.assertEqual(sorted(asy.summary_dict.keys()), sorted(keys))
+            self.assertEqual(sorted(expected.keys()), sorted(keys))
+            np.testing.assert_allclose([asy.summary_dict[k] for k in keys], [expected[k] for k in keys])
+            # We can't have asynchrony with our own performance
+            self.assertTrue(np.isnan(asy.summary_dict[f'{my_instr}_async_mean']))
+
+    def test_stacked_performances(self):
+        """Tests that the kernel gives the same results for a stack of performances as for each individually"""
+        stack = np.stack([self.summary_df.to_numpy(), self.summary_df.to_numpy()[::-1] * 2])
+        stacked = asynchrony_kernel(stack)
+        for num, performance in enumerate(stack):
+            for k, v in asynchrony_kernel(performance).items():
+                np.testing.assert_allclose(stacked[k][num], v, err_msg=k)
+        # Asynchrony to our own performance should always be missing
+        self.assertTrue(np.isnan(np.diagonal(stacked['mean'], axis1=1, axis2=2)).all())
+
+    def test_empty_performance(self):
+        """Tests that a performance without any beats gives missing asynchronies, rather than raising an error"""
+        empty = pd.Series([], dtype=float, name='piano')
+        summary = Asynchrony(empty, pd.DataFrame({'bass': empty.values, 'drums': empty.values})).summary_dict
+        self.assertTrue(np.isnan(summary['bass_async_mean']))
+        self.assertTrue(np.isnan(summary['mean_relative_asynchrony']))
+        self.assertEqual(summary['bass_async_count'], 0)
+
+
+class LaggedCorrelationTest(unittest.TestCase):
+    rng = np.random.default_rng(10)
+    summary_df = pd.DataFrame(
+        np.arange(1, 201)[:, None] * 0.5 + rng.normal(0, 0.02, (200, 3)), columns=['piano', 'bass', 'drums']
+    )
+    summary_df.loc[rng.choice(200, 15), 'bass'] = np.nan
+
+    def test_partial_correlation_matches_pairwise(self):
+        """Tests partial correlations at every lag against calculating each lag and instrument individually"""
+        pc = PartialCorrelation(self.summary_df['piano'], self.summary_df[['bass', 'drums']], order=2, max_order=4)
+        iois = self.summary_df['piano'].diff().diff()
+        for order in range(1, 5):
+            for partner in ['bass', 'drums']:
+                asynchronies = self.summary_df[partner] - self.summary_df['piano']
+                df = pd.concat([iois.shift(-1), asynchronies.shift(order), iois.shift(order)], axis=1).dropna()
+                expected = PartialCorrelation.partial_correlation(df.iloc[:, 0], df.iloc[:, 1], df.iloc[:, 2])
+                actual = pc.sweep[(pc.sweep['order'] == order) & (pc.sweep['instrument'] == partner)].iloc[0]
+                self.assertAlmostEqual(actual['partial_corr_r'], expected)
+                self.assertAlmostEqual(actual['partial_corr_p'], PartialCorrelation.pvalue(len(df), 1, expected))
+                self.assertEqual(actual['partial_corr_n'], len(df))
+        self.assertEqual(pc.summary_dict['partial_corr_order'], 2)
+        self.assertTrue(np.isnan(pc.summary_dict['partial_corr_piano_r']))
+
+    def test_cross_correlation_matches_pearsonr(self):
+        """Tests cross-correlations at every lag against `scipy.stats.pearsonr`"""
+        cc = CrossCorrelation(self.summary_df['piano'], self.summary_df[['bass', 'drums']], order=3, max_order=5)
+        iois = self.summary_df['piano'].diff().diff()
+        for order in range(1, 6):
+            single = CrossCorrelation(self.summary_df['piano'], self.summary_df[['bass', 'drums']], order=order)
+            for partner in ['bass', 'drums']:
+                asynchronies = self.summary_df[partner] - self.summary_df['piano']
+                df = pd.concat([iois, asynchronies.shift(order)], axis=1).dropna()
+                r, p = stats.pearsonr(df.iloc[:, 0], df.iloc[:, 1])
+                self.assertAlmostEqual(single.summary_dict[f'cross_corr_{partner}_r'], r)
+                self.assertAlmostEqual(single.summary_dict[f'cross_corr_{partner}_p'], p)
+                self.assertEqual(single.summary_dict[f'cross_corr_{partner}_n'], len(df))
+        self.assertEqual(len(cc.sweep), 10)
+
+    def test_missing_max_order(self):
+        """Tests that passing `max_order=None` is the same as sweeping up to `order`"""
+        my_beats, their_beats = self.summary_df['piano'], self.summary_df[['bass', 'drums']]
+        for cls in [PartialCorrelation, CrossCorrelation]:
+            expected = cls(my_beats, their_beats, order=3, max_order=3)
+            actual = cls(my_beats, their_beats, order=3, max_order=None)
+            pd.testing.assert_frame_equal(actual.sweep, expected.sweep)
+            pd.testing.assert_series_equal(pd.Series(actual.summary_dict), pd.Series(expected.summary_dict))
+
+    def test_too_few_observations(self):
+        """Tests that correlations are missing when there are fewer than two observations"""
+        cc = CrossCorrelation(self.summary_df['piano'].iloc[:4], self.summary_df[['bass', 'drums']].iloc[:4], order=3)
+        self.assertTrue(np.isnan(cc.summary_dict['cross_corr_drums_r']))
+        self.assertEqual(cc.summary_dict['cross_corr_drums_n'], 1)
+        # Series without any observations should also give missing correlations, rather than raising an error
+        empty = self.summary_df.iloc[:0]
+        for cls, prefix in [(CrossCorrelation, 'cross_corr'), (PartialCorrelation, 'partial_corr')]:
+            summary = cls(empty['piano'], empty[['bass', 'drums']], order=1).summary_dict
+            for k in ['r', 'p']:
+                self.assertTrue(np.isnan(summary[f'{prefix}_bass_{k}']))
+            self.assertEqual(summary[f'{prefix}_bass_n'], 0)
+
+
+def extract_burs_reference(
+        my_onsets: np.array,
+        my_beats: np.array,
+        use_log_burs: bool = False,
+        clean_outliers: bool = True
+) -> np.ndarray:
+    """The original per-beat implementation of `BeatUpbeatRatio.extract_burs`, as a reference"""
+    func = lambda a: a
+    if use_log_burs:
+        from math import log2 as func
+
+    def bur(a: float, b: float) -> float:
+        match = BeatUpbeatRatio.get_between(my_onsets, a, b)
+        if len(match) == 3:
+            bur_val = func((match[1] - match[0]) / (match[2] - match[1]))
+            if clean_outliers:
+                if bur_val > func(BeatUpbeatRatio.HIGH_THRESH) or bur_val < func(BeatUpbeatRatio.LOW_THRESH):
+                    return np.nan
+                else:
+                    return bur_val
+            else:
+                return bur_val
+        else:
+            return np.nan
+
+    burs = [bur(i1, i2) for i1, i2 in zip(my_beats, my_beats[1:])]
+    burs.append(np.nan)
+    # The original raised an error when creating its dataframe for tracks without any beats, so we truncate here
+    return np.array(burs[:len(my_beats)], dtype=float)
+
+
+class BeatUpbeatRatioTest(unittest.TestCase):
+    rng = np.random.default_rng(30)
+
+    def random_track(self, n_beats: int) -> tuple[np.ndarray, np.ndarray]:
+        """Returns random beats, plus onsets on most beats and a variable number of upbeats, both with missing values"""
+        beats = np.cumsum(self.rng.uniform(0.4, 0.6, n_beats))
+        upbeats = beats[:-1] + self.rng.uniform(0.05, 0.95, max(n_beats - 1, 0)) * np.diff(beats)
+        onsets = np.concatenate([beats[self.rng.random(n_beats) > 0.1], upbeats[self.rng.random(len(upbeats)) > 0.2]])
+        # Some beats have more than one upbeat, and some onsets and beats are missing
+        onsets = np.concatenate([onsets, upbeats[:n_beats // 5] + 0.01, [np.nan] * 3])
+        beats[self.rng.random(n_beats) > 0.9] = np.nan
+        return self.rng.permutation(onsets), beats
+
+    def test_batch_matches_individual(self):
+        """Tests that BURs extracted for many tracks at once match the original implementation for each track"""
+        tracks = [self.random_track(n) for n in [200, 0, 1, 2, 50, 300, 3]]
+        tracks.append((np.array([]), np.cumsum(np.ones(10))))
+        for clean_outliers in [True, False]:
+            batch = BeatUpbeatRatio.extract_burs_batch(*zip(*tracks), clean_outliers=clean_outliers)
+            self.assertEqual(len(batch), len(tracks))
+            for (onsets, beats), (burs, burs_log) in zip(tracks, batch):
+                kernel_burs, kernel_burs_log, outliers = bur_kernel(onsets, beats)
+                if clean_outliers:
+                    kernel_burs[outliers], kernel_burs_log[outliers] = np.nan, np.nan
+                # Compare against the original per-beat loop, which expects onsets in time order
+                for use_log_burs, actuals in [(False, [burs, kernel_burs]), (True, [burs_log, kernel_burs_log])]:
+                    expected = extract_burs_reference(np.sort(onsets), beats, use_log_burs, clean_outliers)
+                    for actual in actuals:
+                        np.testing.assert_allclose(actual, expected)
+                extractor = BeatUpbeatRatio(onsets, beats, clean_outliers=clean_outliers)
+                np.testing.assert_array_equal(burs, extractor.bur['burs'].to_numpy())
+
+    def test_precomputed_bounds(self):
+        """Tests that precomputed onset indices for some tracks give the same BURs as searching for them"""
+        tracks = [self.random_track(n) for n in [100, 150, 80]]
+        bounds_list = [None, *(
+            get_window_bounds(np.sort(onsets[~np.isnan(onsets)]), beats[:-1], beats[1:]) for onsets, beats in tracks[1:]
+        )]
+        expected = BeatUpbeatRatio.extract_burs_batch(*zip(*tracks))
+        actual = BeatUpbeatRatio.extract_burs_batch(*zip(*tracks), bounds_list=bounds_list)
+        for (exp, exp_log), (act, act_log) in zip(expected, actual):
+            np.testing.assert_array_equal(exp, act)
+            np.testing.assert_array_equal(exp_log, act_log)
+
+
+class ProportionalAsynchronyTest(unittest.TestCase):
+    def test_proportional_durations(self):
+        """Tests proportional positions, bounds, and row order on a simple example with two bars of 4/4"""
+        summary_df = pd.DataFrame(dict(
+            beats=[1.0, 1.5, 2.0, 2.5, 3.0, 3.5, 4.0, 4.5, 5.0, 5.5],
+            # The bass plays early on beat 1 of the first bar, beyond the lower bound
+            piano=[1.0, 1.5, 2.0, 2.5, 3.0, 3.5, 4.0, 4.5, 5.0, 5.5],
+            bass=[1.01, 1.3, 2.0, 2.5, 3.0, 3.5, 4.0, 4.5, 5.0, 5.5],
+            drums=[1.02, 1.5, 2.0, 2.5, 3.0, 3.5, 4.0, np.nan, 5.0, 5.5],
+            metre_manual=[4, 1, 2, 3, 4, 1, 2, 3, 4, 1],
+        ))
+        actual = ProportionalAsynchrony(summary_df, my_instr_name='piano').asynchronies
+        # The first beat is before the first downbeat, and the last beat is a downbeat with no following bar
+        self.assertEqual(len(actual), 8 * 3)
+        self.assertEqual(actual['instr'].tolist(), (['piano'] * 4 + ['bass'] * 4 + ['drums'] * 4) * 2)
+        self.assertEqual(actual['beat'].tolist(), [1., 2., 3., 4.] * 6)
+        np.testing.assert_allclose(actual['asynchrony'].iloc[:4], [0, 90, 180, 270])
+        self.assertTrue(np.isnan(actual['asynchrony'].iloc[4]))
+        self.assertTrue(np.isnan(actual['asynchrony'].iloc[22]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Test suite for audio loading utilities in src/utils.py"""
+
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+import numpy as np
+import soundfile as sf
+
+from src import utils
+
+
+class ReadAudioChannelTest(unittest.TestCase):
+    sr = 8000
+    rng = np.random.default_rng(15)
+    # Different signals in each channel, so we can tell them apart
+    stereo = rng.uniform(-0.5, 0.5, (10001, 2)).astype(np.float32)
+
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.stereo_fpath = os.path.join(self.tempdir.name, 'stereo.wav')
+        self.mono_fpath = os.path.join(self.tempdir.name, 'mono.wav')
+        sf.write(self.stereo_fpath, self.stereo, self.sr, subtype='FLOAT')
+        sf.write(self.mono_fpath, self.stereo[:, 0], self.sr, subtype='FLOAT')
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+
+    def test_stereo_channels(self):
+        """Tests that the left and right channels of a stereo file are read correctly"""
+        for channel, idx in utils.AUDIO_CHANNELS.items():
+            y, sr = utils.read_audio_channel(self.stereo_fpath, channel)
+            np.testing.assert_array_equal(y, self.stereo[:, idx])
+            self.assertEqual(sr, self.sr)
+            self.assertEqual(y.dtype, utils.AUDIO_DTYPE)
+
+    def test_mono_passthrough(self):
+        """Tests that mono files are returned as they are, regardless of the channel requested"""
+        for channel in utils.AUDIO_CHANNELS.keys():
+            y, _ = utils.read_audio_channel(self.mono_fpath, channel)
+            np.testing.assert_array_equal(y, self.stereo[:, 0])
+
+    def test_past_end_of_file(self):
+        """Tests that reading beyond the end of the file truncates the audio rather than raising an error"""
+        y, _ = utils.read_audio_channel(self.stereo_fpath, 'r', start=10000, stop=20000)
+        np.testing.assert_array_equal(y, self.stereo[10000:, 1])
+        y, _ = utils.read_audio_channel(self.stereo_fpath, 'r', start=20000, stop=30000)
+        self.assertEqual(len(y), 0)
+        y, _ = utils.read_audio_channel(self.stereo_fpath, 'l', start=20000)
+        self.assertEqual(len(y), 0)
+
+    def test_small_blocksize(self):
+        """Tests that reading the file in many small blocks gives the same result as reading it all at once"""
+        y, _ = utils.read_audio_channel(self.stereo_fpath, 'l', blocksize=999, start=5, stop=9000)
+        np.testing.assert_array_equal(y, self.stereo[5:9000, 0])
+
+    def test_offset_and_duration(self):
+        """Tests that offset and duration (in seconds) follow `librosa.load`, i.e. are truncated to whole frames"""
+        offset, duration = 0.33339, 0.50001
+        y = utils.load_audio_channel(self.stereo_fpath, 'r', sr=self.sr, offset=offset, duration=duration)
+        start = int(offset * self.sr)
+        np.testing.assert_array_equal(y, self.stereo[start:start + int(duration * self.sr), 1])
+        # Without a duration, we should read to the end of the file
+        y = utils.load_audio_channel(self.stereo_fpath, 'l', sr=None, offset=offset)
+        np.testing.assert_array_equal(y, self.stereo[start:, 0])
+
+
+class AudioCacheTest(unittest.TestCase):
+    sr = 8000
+    rng = np.random.default_rng(16)
+    audio = rng.uniform(-0.5, 0.5, (8000, 2)).astype(np.float32)
+
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.fpath = os.path.join(self.tempdir.name, 'track.wav')
+        sf.write(self.fpath, self.audio, self.sr, subtype='FLOAT')
+        self.cache_dir = os.path.join(self.tempdir.name, utils.AUDIO_CACHE_DIR)
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+
+    def test_miss_then_hit(self):
+        """Tests that a cache hit returns the same audio and native sample rate as the initial miss, without decoding"""
+        y1, sr1 = utils.load_audio(self.fpath, sr=None, channel='l')
+        self.assertEqual(len(os.listdir(self.cache_dir)), 1)
+        with patch.object(utils, 'load_audio_channel') as mock_load:
+            y2, sr2 = utils.load_audio(self.fpath, sr=None, channel='l')
+            mock_load.assert_not_called()
+        np.testing.assert_array_equal(y1, y2)
+        np.testing.assert_array_equal(y2, self.audio[:, 0])
+        self.assertEqual(sr1, self.sr)
+        self.assertEqual(sr2, self.sr)
+
+    def test_invalidation(self):
+        """Tests that changing the source audio invalidates the cache and removes the stale entry"""
+        utils.load_audio(self.fpath, sr=None, channel='r')
+        stale = os.listdir(self.cache_dir)
+        new_audio = self.audio[:4000] * 0.5
+        sf.write(self.fpath, new_audio, self.sr, subtype='FLOAT')
+        # Make sure the modification time changes, even on file systems with a coarse timestamp resolution
+        mtime = os.stat(self.fpath).st_mtime_ns + 10 ** 9
+        os.utime(self.fpath, ns=(mtime, mtime))
+        y, _ = utils.load_audio(self.fpath, sr=None, channel='r')
+        np.testing.assert_array_equal(y, new_audio[:, 1])
+        current = os.listdir(self.cache_dir)
+        self.assertEqual(len(current), 1)
+        self.assertNotEqual(current, stale)
+
+    def test_different_params(self):
+        """Tests that loading the same file with different parameters creates separate cache entries"""
+        y1, _ = utils.load_audio(self.fpath, sr=None, channel='l')
+        y2, _ = utils.load_audio(self.fpath, sr=None, channel='l', offset=0.5)
+        y3, _ = utils.load_audio(self.fpath, sr=None, channel='r')
+        self.assertEqual(len(os.listdir(self.cache_dir)), 3)
+        np.testing.assert_array_equal(utils.load_audio(self.fpath, sr=None, channel='l', offset=0.5)[0], y2)
+        np.testing.assert_array_equal(y1[4000:], y2)
+        np.testing.assert_array_equal(y3, self.audio[:, 1])
+
+    def test_no_cache(self):
+        """Tests that nothing is written to disc when the cache is disabled"""
+        y, sr = utils.load_audio(self.fpath, sr=None, channel='l', use_cache=False)
+        np.testing.assert_array_equal(y, self.audio[:, 0])
+        self.assertEqual(sr, self.sr)
+        self.assertFalse(os.path.exists(self.cache_dir))
+
+    def test_hash_params(self):
+        """Tests that cache keys depend on the values of the parameters, but not the order they are passed in"""
+        self.assertEqual(utils.hash_params(sr=8000, mono=False), utils.hash_params(mono=False, sr=np.int64(8000)))
+        self.assertNotEqual(utils.hash_params(sr=8000, mono=False), utils.hash_params(sr=8000, mono=True))
+
+
+if __name__ == '__main__':
+    unittest.main()